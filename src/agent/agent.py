@@ -1,13 +1,36 @@
 from logging import getLogger
 import logging
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import hashlib
+import os
+import threading
+import uuid
 from agent_gateway import Agent
 from agent_gateway.tools import CortexSearchTool, CortexAnalystTool, PythonTool, SQLTool
-from snowflake.snowpark import Session
-import os
 from dotenv import load_dotenv
-from src.analyst.preprocess import Analyst_preprocess
+import time
+from src.analyst.preprocess import Analyst_preprocess, TABLE_SCHEMAS
+from src.analyst.aggregates import MaterializedAggregates
+from src.analyst.sql_cache import AnalystSqlCache, SqlCacheMetrics
+from src.analyst.semantic_compiler import LookupRouter, RouterMetrics, compile_semantic_model
 from src.search.preprocess import Search_preprocess
+from src.search.embedding_pipeline import estimate_tokens
+from src.bootstrap import bootstrap
+from src.common.pool import ConnectionPool, LeasedConnection, PoolMetrics, get_pool
+from src.common.schema_cache import get_schema_cache
 from .response import AgentResult
+from .cache import CacheMetrics, ResponseCache
+from .tool_cache import ToolCache, ToolCacheMetrics, ToolCachePolicy, _invoke, target_lag_seconds
+from . import events
+from .scheduler import ToolLimits, ToolScheduler, tracing
+from .local_search import LocalSearch, LocalSearchMetrics
+from .context_compression import CompressionMetrics, ContextCompressor
+from .telemetry import NOOP_SPAN, JsonlExporter, InMemoryExporter, PrometheusExporter, StageStats, Telemetry, span
+from .events import EventStream
+from .answer_stream import enable_answer_streaming
 from .tools import html_crawl
 
 logging.basicConfig(
@@ -17,98 +40,441 @@ logging.basicConfig(
 logger = getLogger(__name__)
 
 class AgentGateway:
-    def __init__(self):
+    def __init__(
+        self,
+        provision: bool = False,
+        pool: ConnectionPool | None = None,
+        agent_factory=None,
+        response_cache: ResponseCache | None = None,
+        enable_response_cache: bool = True,
+    ):
+        """
+        provision=False (serve モード): 接続を開くだけで起動する。環境構築は事前に
+        `python -m src.bootstrap` で行っておく。ツールは初回利用時に生成する
+        provision=True: 起動時に Search / Analyst の環境構築も行う
+        agent_factory: Agent の代わりに使うクラス (ベンチマーク用のスタブなど)
+        response_cache: レスポンスキャッシュ (省略時は環境変数の設定で生成する)
+        """
+        start = time.perf_counter()
         load_dotenv(encoding='utf-8', override=True)
 
-        # SearchとAnalystの用意
-        self.search_preprocess = Search_preprocess()
-        self.search_preprocess.run()
-        self.analyst_preprocess = Analyst_preprocess()
-        self.analyst_preprocess.run()
-
-
-        connection_parameters = {
-        "account": os.getenv("SNOWFLAKE_ACCOUNT"),
-        "user": os.getenv("SNOWFLAKE_USER"),
-        "password": os.getenv("SNOWFLAKE_PASSWORD"),
-        "role": os.getenv("SNOWFLAKE_ROLE"),
-        "warehouse": os.getenv("SNOWFLAKE_WAREHOUSE"),
-        "database": os.getenv("SNOWFLAKE_DATABASE"),
-        "schema": os.getenv("SNOWFLAKE_SCHEMA"),
-        }
+        if provision:
+            bootstrap()
 
-        self.connection = Session.builder.configs(connection_parameters).create()
+        # Agent (プランナー・回答生成の LLM 呼び出しの認証) とデータバージョンの確認には、
+        # プロセス共有プールの接続を1本借りて Snowpark Session を作る (close() で返却)
+        self.pool = pool or get_pool()
+        self._connection_lease = self.pool.acquire()
+        self.connection = self.pool.session(self._connection_lease)
+        # ツール (Search / Analyst の SQL・ルーター) は呼び出しごとにプールから借りて返す
+        self.tool_connection = LeasedConnection(self.pool, fallback=self._connection_lease)
 
-    def  initialize_tools(self) -> list:
-        search_config = {
-            "service_name": self.search_preprocess.search_service,
-            "service_topic": "サンプルテック社の第1四半期経営計画",
-            "data_description": "経営計画",
-            "retrieval_columns": ["chunk_id", "file_name", "text"],
-            "snowflake_connection": self.connection,
-            "k": 10,
-        }
+        self._search_tool = None
+        self._analyst_tool = None
+        self._html_crawl_tool = None
+        self.local_search: LocalSearch | None = None
+        # 検索結果は重複除去・隣接チャンクの結合・並べ替えのあと、トークン数の上限に収めて LLM に渡す
+        self.context_compressor: ContextCompressor | None = None
+        if os.getenv("SEARCH_COMPRESSION_ENABLED", "true").lower() in ("true", "1"):
+            self.context_compressor = ContextCompressor(max_tokens=int(os.getenv("SEARCH_CONTEXT_MAX_TOKENS", "1500")))
 
-        analyst_config = {
-            "semantic_model": self.analyst_preprocess.semantic_model_path.replace("src/analyst/semantic_model/", ""),
-            "stage": str(self.analyst_preprocess.stage_name),
-            "service_topic": "サンプルテック社の商品売り上げデータ",
-            "data_description": "商品名、売り上げ、売上地域、件数",
-            "snowflake_connection": self.connection,
-            "max_results": 5,
-        }
+        self.agent_factory = agent_factory or Agent
+        self._agent = None
+        self._loop = None
+        self._loop_lock = threading.Lock()
 
-        html_crawl_config = {
-            "tool_description": "URLを指定すると、HTMLを取得するツール",
-            "output_description": "htmlのウェブページ",
-            "python_func": html_crawl
+        if response_cache is None and enable_response_cache:
+            response_cache = ResponseCache(
+                ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+                path=os.getenv("RESPONSE_CACHE_PATH") or None)
+        self.response_cache = response_cache
+        # ツール結果のキャッシュ (Searchは TARGET_LAG より長く保持しない)
+        self.tool_cache = ToolCache()
+        self.tool_cache_ttl = {
+            "search": min(600.0, target_lag_seconds(Search_preprocess.target_lag)),
+            "analyst": 300.0,
+            "html_crawl": 600.0,
         }
+        # Cortex Analyst の生成SQLの結果キャッシュ (データバージョンが変わると破棄) と集計テーブルへの書き換え
+        self.sql_cache: AnalystSqlCache | None = None
+        if os.getenv("ANALYST_SQL_CACHE_ENABLED", "true").lower() in ("true", "1"):
+            self.sql_cache = AnalystSqlCache(
+                ttl=float(os.getenv("ANALYST_SQL_CACHE_TTL", "3600")),
+                aggregates=MaterializedAggregates.from_semantic_model(Analyst_preprocess.semantic_model_path))
+        # 「部署はいくつ？」のような単純な質問はセマンティックモデルのテンプレート SQL で答え、Cortex Analyst を呼ばない
+        self.analyst_router: LookupRouter | None = None
+        if os.getenv("ANALYST_ROUTER_ENABLED", "true").lower() in ("true", "1"):
+            self.analyst_router = self._compile_router()
+        # ツール呼び出しは専用スレッドで実行し、独立したタスクを並行させる
+        self.tool_scheduler = ToolScheduler()
+        self.tool_limits = {
+            "search": ToolLimits(max_concurrency=4, timeout=30.0),
+            "analyst": ToolLimits(max_concurrency=4, timeout=60.0),
+            "html_crawl": ToolLimits(max_concurrency=8, timeout=30.0),
+        }
+        # リクエスト・計画・タスク・ツール・SQL・LLM 呼び出しのスパン (TRACING_ENABLED=false で何も仕込まない)
+        self.telemetry: Telemetry | None = None
+        if os.getenv("TRACING_ENABLED", "true").lower() in ("true", "1"):
+            exporters = [InMemoryExporter(max_traces=int(os.getenv("TRACE_MEMORY_TRACES", "100"))), PrometheusExporter()]
+            if os.getenv("TRACE_JSONL_PATH"):
+                exporters.append(JsonlExporter(os.environ["TRACE_JSONL_PATH"]))
+            self.telemetry = Telemetry(exporters)
+        self.version_check_interval = 60.0 # データ更新の確認間隔(秒)
+        self._version_checked_at = 0.0
+        # "running X task" などのログを進捗イベントとして配信する
+        events.install_progress_handler()
+
+        self.startup_seconds = time.perf_counter() - start
+        logger.info(f"AgentGatewayを起動しました ({self.startup_seconds:.2f}s, provision={provision})")
+
+    @property
+    def search_tool(self) -> CortexSearchTool:
+        if self._search_tool is None:
+            self._search_tool = self._resolve_tool("search", lambda: self._compressed(self._local_first(self._leased(CortexSearchTool(**{
+                "service_name": Search_preprocess.search_service,
+                "service_topic": "サンプルテック社の第1四半期経営計画",
+                "data_description": "経営計画",
+                "retrieval_columns": ["chunk_id", "file_name", "text"],
+                "snowflake_connection": self.tool_connection,
+                "k": 10,
+            })))))
+        return self._search_tool
+
+    def _compressed(self, tool: CortexSearchTool) -> CortexSearchTool:
+        """ローカル検索・Cortex Search どちらの結果も圧縮してから返す"""
+        return self.context_compressor.wrap(tool) if self.context_compressor is not None else tool
+
+    def _local_first(self, tool: CortexSearchTool) -> CortexSearchTool:
+        """ローカルの索引 (ベクトル / キーワード) があれば、Cortex Search の前段に置く (LOCAL_SEARCH_ENABLED=false で無効)"""
+        if os.getenv("LOCAL_SEARCH_ENABLED", "true").lower() not in ("true", "1"):
+            return tool
+        try:
+            self.local_search = LocalSearch.load(
+                Search_preprocess.index_dir, Search_preprocess.keyword_index_dir, k=10,
+                min_score=float(os.getenv("LOCAL_SEARCH_MIN_SCORE", "0.35")),
+                min_keyword_score=float(os.getenv("LOCAL_SEARCH_MIN_KEYWORD_SCORE", "10.0")),
+                alpha=float(os.getenv("LOCAL_SEARCH_ALPHA", "0.5")))
+        except Exception as e:
+            logger.warning(f"ローカル検索の索引を読み込めませんでした: {e}")
+            self.local_search = None
+        return self.local_search.wrap(tool) if self.local_search is not None else tool
+
+    @property
+    def analyst_tool(self) -> CortexAnalystTool:
+        if self._analyst_tool is None:
+            self._analyst_tool = self._resolve_tool("analyst", lambda: self._leased(self._routed(self._sql_cached(self._sql_traced(CortexAnalystTool(**{
+                "semantic_model": Analyst_preprocess.semantic_model_path.replace("src/analyst/semantic_model/", ""),
+                "stage": Analyst_preprocess.stage_name,
+                "service_topic": "サンプルテック社の商品売り上げデータ",
+                "data_description": "商品名、売り上げ、売上地域、件数",
+                "snowflake_connection": self.tool_connection,
+                "max_results": 5,
+            }))))))
+        return self._analyst_tool
+
+    def _leased(self, tool):
+        """
+        ツール呼び出しの間だけ tool_connection の接続をプールから借りる
+        ToolScheduler より内側に置き、ワーカースレッドで借りて返す (ローカル検索で答えた場合は借りない)
+        """
+        func = tool.func
+
+        @functools.wraps(func)
+        async def leased_func(*args, **kwargs):
+            with self.tool_connection.lease():
+                return await _invoke(func, *args, **kwargs)
+
+        tool.func = leased_func
+        return tool
+
+    def _sql_traced(self, tool: CortexAnalystTool) -> CortexAnalystTool:
+        """ウェアハウスに送る SQL を1文ずつスパンにする (キャッシュより内側に置き、ヒットした SQL は数えない)"""
+        return self.telemetry.wrap_connection(tool) if self.telemetry is not None else tool
+
+    def _sql_cached(self, tool: CortexAnalystTool) -> CortexAnalystTool:
+        """生成SQLの実行を結果キャッシュ・集計テーブル経由にする"""
+        return self.sql_cache.wrap(tool) if self.sql_cache is not None else tool
+
+    def _routed(self, tool: CortexAnalystTool) -> CortexAnalystTool:
+        """単純な質問をテンプレート SQL で答える (SQL は結果キャッシュ・スパンを通る)"""
+        return self.analyst_router.wrap(tool) if self.analyst_router is not None else tool
+
+    def _compile_router(self) -> LookupRouter | None:
+        """セマンティックモデルをスキーマ情報と突き合わせてコンパイルする (起動時に1回)"""
+        try:
+            snapshot = get_schema_cache(os.getenv("SNOWFLAKE_DATABASE"), os.getenv("SNOWFLAKE_SCHEMA")).get(self._connection_lease)
+            return LookupRouter(compile_semantic_model(Analyst_preprocess.semantic_model_path, snapshot))
+        except Exception as e:
+            logger.warning(f"セマンティックモデルをコンパイルできませんでした。すべて Cortex Analyst に回します: {e}")
+            return None
+
+    @property
+    def html_crawl_tool(self) -> PythonTool:
+        if self._html_crawl_tool is None:
+            self._html_crawl_tool = self._resolve_tool("html_crawl", lambda: PythonTool(**{
+                "tool_description": "URLを指定すると、HTMLを取得するツール",
+                "output_description": "htmlのウェブページ",
+                "python_func": html_crawl
+            }))
+        return self._html_crawl_tool
+
+    def cache_metrics(self) -> CacheMetrics | None:
+        """レスポンスキャッシュのヒット・ミス数など"""
+        return self.response_cache.metrics() if self.response_cache is not None else None
+
+    def tool_cache_metrics(self) -> dict[str, ToolCacheMetrics]:
+        """ツール名ごとのキャッシュヒット・相乗り数など"""
+        return self.tool_cache.metrics()
+
+    def local_search_metrics(self) -> LocalSearchMetrics | None:
+        """ローカル検索で応答した回数と Cortex Search に回した回数"""
+        return self.local_search.metrics() if self.local_search is not None else None
+
+    def context_compression_metrics(self) -> CompressionMetrics | None:
+        """検索結果の圧縮前後のトークン数の見積もり"""
+        return self.context_compressor.metrics() if self.context_compressor is not None else None
 
-        self.html_crawl_tool = PythonTool(**html_crawl_config)
-        self.search_tool = CortexSearchTool(**search_config)
-        self.analyst_tool = CortexAnalystTool(**analyst_config)
+    def sql_cache_metrics(self) -> SqlCacheMetrics | None:
+        """Analyst の生成SQLのキャッシュヒット数・集計テーブルへの書き換え数・省いたウェアハウス秒"""
+        return self.sql_cache.metrics() if self.sql_cache is not None else None
 
+    def analyst_router_metrics(self) -> RouterMetrics | None:
+        """テンプレート SQL で答えた回数と Cortex Analyst に回した回数"""
+        return self.analyst_router.metrics() if self.analyst_router is not None else None
+
+    def telemetry_metrics(self) -> dict[str, StageStats] | None:
+        """段階 ("kind/name") ごとの件数・所要時間の分位点・トークン数"""
+        prometheus = self.telemetry.exporter(PrometheusExporter) if self.telemetry is not None else None
+        return prometheus.stats() if prometheus is not None else None
+
+    def prometheus_metrics(self) -> str:
+        """スパンのヒストグラムとトークン数 (Prometheus のテキスト形式)"""
+        prometheus = self.telemetry.exporter(PrometheusExporter) if self.telemetry is not None else None
+        return prometheus.render() if prometheus is not None else ""
+
+    def pool_metrics(self) -> PoolMetrics:
+        """接続プールの利用状況 (待ち時間・使用率など)"""
+        return self.pool.metrics()
+
+    def _resolve_tool(self, name: str, factory):
+        start = time.perf_counter()
+        tool = factory()
+        tool = self.tool_scheduler.wrap(tool, self.tool_limits[name])
+        if self.telemetry is not None:
+            tool = self.telemetry.wrap_tool(tool)
+        tool = self.tool_cache.wrap(tool, ToolCachePolicy(ttl=self.tool_cache_ttl[name]))
+        tool = events.wrap_tool(tool)
+        logger.info(f"ツール {name} を初期化しました ({time.perf_counter() - start:.2f}s)")
+        return tool
+
+    def  initialize_tools(self) -> list:
         return [self.search_tool, self.analyst_tool, self.html_crawl_tool]
 
     def enable_cross_region_inference(self):
         logger.info("Cross-region inferenceを有効化します。")
         # クロスリージョン推論を有効化
-        connector = self.analyst_preprocess.connector
-        connector.cursor().execute(f"ALTER ACCOUNT SET CORTEX_ENABLED_CROSS_REGION = 'ANY_REGION';")
-        connector.commit()
-        connector.cursor().close()
+        self.connection.sql("ALTER ACCOUNT SET CORTEX_ENABLED_CROSS_REGION = 'ANY_REGION'").collect()
         logger.info("Cross-region inferenceを有効化しました。")
 
 
-    def run(self, query) -> AgentResult:
-        agent = Agent(snowflake_connection=self.connection, 
-                    tools=[self.search_tool,self.analyst_tool,self.html_crawl_tool], 
-                    max_retries=3,
-                    planner_llm="claude-4-sonnet", 
-                    agent_llm="claude-4-sonnet")
+    @property
+    def agent(self) -> Agent:
+        """ゲートウェイで1つのAgentを使い回す (初回アクセス時に生成する)"""
+        if self._agent is None:
+            start = time.perf_counter()
+            # 複数ユーザー・複数クエリで共有するので、会話メモリは持たせない
+            self._agent = self.agent_factory(
+                snowflake_connection=self.connection,
+                tools=self.initialize_tools(),
+                max_retries=3,
+                planner_llm="claude-4-sonnet",
+                agent_llm="claude-4-sonnet",
+                memory=False)
+            # 回答生成の LLM 出力を stream() のイベントとして逐次送る (計測の差し込みより前に差し替える)
+            enable_answer_streaming(self._agent)
+            if self.telemetry is not None:
+                self.telemetry.instrument_agent(self._agent)
+            logger.info(f"Agentを初期化しました ({time.perf_counter() - start:.2f}s)")
+        return self._agent
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """Agentを実行する常駐イベントループ (専用スレッドで動かす)"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._loop.run_forever, name="agent-gateway-loop", daemon=True)
+                thread.start()
+        return self._loop
+
+    async def arun(self, query: str) -> AgentResult:
+        """
+        クエリを非同期に実行する。複数のクエリを同時に実行できる
+        Agentは常駐ループに紐づくので、他のループから呼ばれた場合は常駐ループに委譲する
+        """
+        if asyncio.get_running_loop() is self.loop:
+            return await self._arun(query)
+        return await asyncio.wrap_future(self._submit(self._arun(query)))
+
+    def run(self, query: str) -> AgentResult:
+        """arun の同期版"""
+        return self._submit(self._arun(query)).result()
+
+    def stream(self, query: str, max_events: int = 256) -> EventStream:
+        """
+        クエリを常駐ループで実行し、進捗イベントのストリームを返す
+        iterate するとツール選択・ツール結果・生成中の回答 (answer)・最終回答 (final) が届いた順に取り出せる
+        """
+        stream = EventStream(max_events=max_events)
+        self._submit(self._astream(query, stream))
+        return stream
+
+    def _submit(self, coro) -> concurrent.futures.Future:
+        """呼び出し元の contextvars (ログの取得範囲など) を引き継いで常駐ループで実行する"""
+        return asyncio.run_coroutine_threadsafe(_with_context(contextvars.copy_context(), coro), self.loop)
+
+    async def _astream(self, query: str, stream: EventStream) -> None:
+        events.current_stream.set(stream)
+        try:
+            result = await self._arun(query)
+        except Exception as e:
+            logger.exception(f"クエリの実行に失敗しました: {query}")
+            stream.publish("error", str(e))
+            return
+        except BaseException:
+            # キャンセル (常駐ループの停止など) でもストリームを閉じ、iterate している読み手が待ち続けないようにする
+            logger.warning(f"クエリの実行が中断されました: {query}")
+            stream.publish("error", "クエリの実行が中断されました")
+            raise
+        stream.publish("final", result.output, data=result.model_dump())
+        first_answer = "-" if stream.first_answer_seconds is None else f"{stream.first_answer_seconds:.3f}s"
+        logger.info(f"最初の進捗表示まで {stream.first_update_seconds:.3f}s, 最初の回答表示まで {first_answer} "
+                    f"(破棄 {stream.dropped}件)")
 
-        response = agent.acall(query)
+    async def _arun(self, query: str) -> AgentResult:
+        if self.telemetry is None:
+            return await self._arun_traced(query, NOOP_SPAN)
+        with self.telemetry.request(query_tokens=estimate_tokens(query)) as request:
+            return await self._arun_traced(query, request)
+
+    async def _arun_traced(self, query: str, request) -> AgentResult:
+        if self.response_cache is not None or self.sql_cache is not None:
+            await self._refresh_data_version()
+        if self.response_cache is not None:
+            cached = await asyncio.to_thread(self.response_cache.get, query)
+            if cached is not None:
+                logger.info(f"キャッシュから応答しました: {query}")
+                request.set(response_cache="hit", answer_tokens=estimate_tokens(cached.output))
+                return cached
+
+        with tracing() as trace:
+            response = await self.agent.acall(query)
+        if trace.spans:
+            logger.info(trace.summary())
         logger.info(response)
+        result = to_agent_result(response)
+        request.set(response_cache="miss", answer_tokens=estimate_tokens(result.output), sources=len(result.sources))
+
+        # ツールを使わずに返した回答 (回答不能など) はキャッシュしない
+        if self.response_cache is not None and result.sources:
+            await asyncio.to_thread(self.response_cache.put, query, result)
+        return result
+
+    def data_version(self) -> str:
+        """
+        Searchテーブル・Analystテーブルの最終更新時刻とセマンティックモデルのハッシュ
+        同じ問い合わせで集計テーブルの最終更新時刻も取り、元テーブルより新しい集計テーブルだけを書き換えに使う
+        """
+        tables = [Search_preprocess.table.upper()] + [table.upper() for table in TABLE_SCHEMAS]
+        aggregates = self.sql_cache.aggregates if self.sql_cache is not None else None
+        names = tables + (aggregates.tables if aggregates is not None else [])
+        table_list = ", ".join(f"'{table}'" for table in names)
+        rows = self.connection.sql(f"""
+            SELECT TABLE_NAME, LAST_ALTERED FROM INFORMATION_SCHEMA.TABLES
+            WHERE TABLE_SCHEMA = CURRENT_SCHEMA() AND TABLE_NAME IN ({table_list})
+            ORDER BY TABLE_NAME
+            """).collect()
+        if aggregates is not None:
+            aggregates.set_last_altered({str(row[0]).upper(): row[1] for row in rows})
+
+        digest = hashlib.sha256()
+        for row in rows:
+            if str(row[0]).upper() in tables:
+                digest.update(f"{row[0]}={row[1]};".encode())
+        with open(Analyst_preprocess.semantic_model_path, "rb") as f:
+            digest.update(f.read())
+        return digest.hexdigest()
+
+    async def _refresh_data_version(self) -> None:
+        if time.monotonic() - self._version_checked_at < self.version_check_interval:
+            return
+        self._version_checked_at = time.monotonic()
+        try:
+            with span("sql", "data_version"):
+                version = await asyncio.to_thread(self.data_version)
+        except Exception as e:
+            # データが更新されたか分からないので、前回のバージョンのまま古い結果を返し続けないよう、
+            # 毎回異なるバージョンにしてキャッシュを破棄する (集計テーブルへの書き換えも止める)
+            logger.warning(f"データバージョンの取得に失敗しました。キャッシュ済みの結果は使いません: {e}")
+            version = f"unknown:{uuid.uuid4().hex}"
+            if self.sql_cache is not None and self.sql_cache.aggregates is not None:
+                self.sql_cache.aggregates.set_last_altered({})
+        if self.response_cache is not None:
+            self.response_cache.set_version(version)
+        if self.sql_cache is not None:
+            self.sql_cache.set_version(version)
 
-        # ! Analystの型も取れるように修正
-        return AgentResult(
-            output=response["output"],
-            sources=[
-            {
-                "tool_type": source.get("tool_type"),
-                "tool_name": source.get("tool_name"),
-                "metadata": [
-                    {
-                        "file_name": metadata.get("file_name"),
-                        "text": metadata.get("text"),
-                        "chunk_id": metadata.get("chunk_id")
-                    }
-                    for metadata in source.get("metadata", [])
-                ]
-            }
-            for source in response.get("sources", []) or []
-        ]
-        )
+    def close(self) -> None:
+        """常駐ループを止め、借りている接続をプールに返却する"""
+        with self._loop_lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._loop = None
+        if self.response_cache is not None:
+            self.response_cache.close()
+        self.tool_scheduler.close()
+        if self.telemetry is not None:
+            self.telemetry.close()
+        if self._connection_lease is not None:
+            self.pool.release(self._connection_lease)
+            self._connection_lease = None
+
+
+async def _with_context(context: contextvars.Context, coro):
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+def to_agent_result(response: dict) -> AgentResult:
+    """
+    Agent.acall の戻り値を AgentResult に変換する
+    ツールは並行に実行されるので、sources はツール種別・ツール名の順に並べる (同じツール内の順序は保つ)
+    """
+    sources = response.get("sources") or []
+    if isinstance(sources, dict):
+        sources = [sources]
+    sources = sorted(sources, key=lambda source: (source.get("tool_type") or "", source.get("tool_name") or ""))
+
+    # ! Analystの型も取れるように修正
+    return AgentResult(
+        output=response["output"],
+        sources=[
+        {
+            "tool_type": source.get("tool_type"),
+            "tool_name": source.get("tool_name"),
+            "metadata": [
+                {
+                    "file_name": metadata.get("file_name"),
+                    "text": metadata.get("text"),
+                    "chunk_id": None if metadata.get("chunk_id") is None else str(metadata.get("chunk_id"))
+                }
+                for metadata in source.get("metadata") or []
+            ]
+        }
+        for source in sources
+    ]
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+"""
+回答生成 (fuse) の LLM 出力の逐次配信
+agent_gateway の CortexCompleteAgent は complete の SSE を最後まで受け取ってから回答を返すので、
+ストリームのあるリクエストでは SSE を受け取った順に読み、Finish(...) の中身を answer イベントとして送る
+"""
+import json
+from typing import AsyncIterator
+
+import httpx
+from agent_gateway.gateway.gateway import AgentGatewayError, CortexCompleteAgent
+from agent_gateway.tools.utils import _determine_runtime
+
+from . import events
+
+_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+_FINISH = "Action: Finish"
+_END = "<END_OF_RESPONSE>"
+
+
+async def stream_cortex_request(url: str, headers: dict, data: dict) -> AsyncIterator[str]:
+    """complete の SSE を受け取った順に読み、delta の content を返す"""
+    async with httpx.AsyncClient(headers=headers | {"Accept": "text/event-stream"}, timeout=_TIMEOUT) as client:
+        async with client.stream("POST", url, json=data) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if not payload or payload == "[DONE]":
+                    continue
+                choices = json.loads(payload).get("choices") or [{}]
+                content = choices[0].get("delta", {}).get("content")
+                if content:
+                    yield content
+
+
+def partial_answer(raw: str) -> str:
+    """
+    生成途中の fuse の出力から、回答として確定した部分を返す (Finish でなければ空文字)
+    末尾の <END_OF_RESPONSE> の書きかけと閉じ括弧は、続きが届くまで出さない
+    """
+    start = raw.find(_FINISH)
+    if start < 0:
+        return ""
+    answer = raw[start + len(_FINISH):].lstrip("( \t\r\n")
+    end = answer.find(_END)
+    if end >= 0:
+        answer = answer[:end]
+    else:
+        for size in range(min(len(_END), len(answer)), 0, -1):
+            if answer.endswith(_END[:size]):
+                answer = answer[:-size]
+                break
+    return answer.rstrip().removesuffix(")").rstrip()
+
+
+class StreamingCompleteAgent(CortexCompleteAgent):
+    """
+    回答生成の LLM 呼び出しを SSE のストリームで読む CortexCompleteAgent
+    ストリームのないリクエストと Streamlit in Snowflake (SSE を読めない) では元の動作のまま
+    """
+
+    async def arun(self, prompt: str) -> str:
+        stream = events.current_stream.get()
+        if stream is None or _determine_runtime():
+            return await super().arun(prompt)
+
+        headers, url, data = self._prepare_llm_request(prompt=prompt)
+        completion = ""
+        published = ""
+        try:
+            async for content in stream_cortex_request(url=url, headers=headers, data=data):
+                completion += content
+                answer = partial_answer(completion)
+                if answer and answer != published:
+                    stream.publish("answer", answer)
+                    published = answer
+        except Exception as e:
+            raise AgentGatewayError(message=f"Failed Cortex LLM Request. See details:{str(e)}") from e
+        return completion
+
+
+def enable_answer_streaming(agent):
+    """Agent の回答生成を StreamingCompleteAgent に差し替える (スタブなど CortexCompleteAgent を持たない Agent はそのまま)"""
+    completion = getattr(agent, "agent", None)
+    if isinstance(completion, CortexCompleteAgent) and not isinstance(completion, StreamingCompleteAgent):
+        agent.agent = StreamingCompleteAgent(session=completion.session, llm=completion.llm)
+    return agent
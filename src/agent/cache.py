@@ -0,0 +1,228 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from logging import getLogger
+from pathlib import Path
+from typing import Callable
+
+from pydantic import BaseModel, Field
+
+from .response import AgentResult
+
+logger = getLogger(__name__)
+
+_TRAILING_PUNCTUATION = re.compile(r"[\s?？。．.!！、,，]+$")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """全角/半角・大文字/小文字・空白・末尾の句読点の違いを吸収したキー"""
+    text = unicodedata.normalize("NFKC", query).casefold().strip()
+    text = _WHITESPACE.sub(" ", text)
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+
+class CacheMetrics(BaseModel):
+    """レスポンスキャッシュのメトリクス"""
+    size: int = 0
+    hits_exact: int = Field(default=0, description="正規化クエリの完全一致でヒット")
+    hits_semantic: int = Field(default=0, description="埋め込みの近傍一致でヒット")
+    misses: int = 0
+    evictions: int = Field(default=0, description="LRUで追い出した件数")
+    expirations: int = Field(default=0, description="TTL切れで破棄した件数")
+    invalidations: int = Field(default=0, description="データ更新による全破棄の回数")
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits_exact + self.hits_semantic + self.misses
+        return (self.hits_exact + self.hits_semantic) / total if total else 0.0
+
+
+class _Entry:
+    __slots__ = ("query", "result", "created", "embedding")
+
+    def __init__(self, query: str, result: AgentResult, created: float, embedding=None):
+        self.query = query
+        self.result = result
+        self.created = created
+        self.embedding = embedding
+
+
+class ResponseCache:
+    """
+    AgentGateway のレスポンスキャッシュ
+    - 1段目: 正規化したクエリ文字列の完全一致
+    - 2段目 (embedder 指定時): クエリ埋め込みのコサイン類似度が threshold 以上のもの
+    TTL・LRU で破棄し、path を指定すると SQLite に永続化する
+    version (データのフィンガープリント) が変わると全件破棄する
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl: float = 3600.0,
+        path: str | Path | None = None,
+        embedder: Callable[[list[str]], list[list[float]]] | None = None,
+        similarity_threshold: float = 0.95,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embedder = embedder
+        self.similarity_threshold = similarity_threshold
+        self.version = ""
+
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._metrics = CacheMetrics()
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                query TEXT,
+                result TEXT,
+                created REAL,
+                version TEXT,
+                embedding TEXT
+            )""")
+            self._db.commit()
+            self._load()
+
+    def get(self, query: str) -> AgentResult | None:
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._remove(key)
+                self._metrics.expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._metrics.hits_exact += 1
+                return entry.result.model_copy(deep=True)
+
+        if self.embedder is not None:
+            entry = self._nearest(key)
+            if entry is not None:
+                with self._lock:
+                    self._metrics.hits_semantic += 1
+                return entry.result.model_copy(deep=True)
+
+        with self._lock:
+            self._metrics.misses += 1
+        return None
+
+    def put(self, query: str, result: AgentResult) -> None:
+        key = normalize_query(query)
+        embedding = self._embed(key) if self.embedder is not None else None
+        entry = _Entry(query, result.model_copy(deep=True), time.time(), embedding)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._metrics.evictions += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, query, result.model_dump_json(), entry.created, self.version,
+                     json.dumps(embedding) if embedding is not None else None),
+                )
+                self._db.commit()
+
+    def set_version(self, version: str) -> bool:
+        """データのバージョンを設定する。変わっていれば全件破棄して True を返す"""
+        with self._lock:
+            if version == self.version:
+                return False
+            changed = bool(self.version)
+            self.version = version
+        if changed:
+            self.invalidate()
+            logger.info("データが更新されたため、レスポンスキャッシュを破棄しました")
+        elif self._db is not None:
+            # 起動直後: 永続化済みのうち別バージョンのものを捨てる
+            with self._lock:
+                self._db.execute("DELETE FROM responses WHERE version != ?", (version,))
+                self._db.commit()
+                self._entries.clear()
+            self._load()
+        return changed
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._metrics.invalidations += 1
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def metrics(self) -> CacheMetrics:
+        with self._lock:
+            return self._metrics.model_copy(update={"size": len(self._entries)})
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _expired(self, entry: _Entry) -> bool:
+        return time.time() - entry.created > self.ttl
+
+    def _remove(self, key: str) -> None:
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.commit()
+
+    def _embed(self, text: str) -> list[float]:
+        if hasattr(self.embedder, "embed_query"):
+            return list(self.embedder.embed_query(text))
+        return list(self.embedder([text])[0])
+
+    def _nearest(self, key: str) -> _Entry | None:
+        import numpy as np
+
+        with self._lock:
+            candidates = [(k, e) for k, e in self._entries.items() if e.embedding is not None and not self._expired(e)]
+        if not candidates:
+            return None
+
+        query = np.asarray(self._embed(key), dtype=np.float32)
+        matrix = np.asarray([e.embedding for _, e in candidates], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+        scores = matrix @ query / np.where(norms == 0, 1.0, norms)
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+
+        best_key, entry = candidates[best]
+        with self._lock:
+            if best_key in self._entries:
+                self._entries.move_to_end(best_key)
+        return entry
+
+    def _load(self) -> None:
+        now = time.time()
+        rows = self._db.execute(
+            "SELECT key, query, result, created, embedding FROM responses WHERE version = ? ORDER BY created",
+            (self.version,),
+        ).fetchall()
+        with self._lock:
+            for key, query, result, created, embedding in rows:
+                if now - created > self.ttl:
+                    continue
+                self._entries[key] = _Entry(
+                    query,
+                    AgentResult.model_validate_json(result),
+                    created,
+                    json.loads(embedding) if embedding else None,
+                )
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
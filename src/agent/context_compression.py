@@ -0,0 +1,202 @@
+"""
+検索結果をエージェントの LLM に渡す前に圧縮する
+CortexSearchTool (またはローカル検索) の {"output": [...], "sources": {...}} を受け取り、
+1. 同じ file_name で chunk_id が連続するチャンクを1つにつなぐ (分割時の重なり部分は1回だけ残す)
+2. 他の結果に含まれる・同じ内容の結果を除く
+3. クエリとの文字 bi-gram の一致率と元の順位で並べ替える
+4. トークン数の上限 (max_tokens) に収まるまで上位から詰める (最後の1件は文の途中で切ることがある)
+出典 (sources.metadata) は残した結果に含まれるチャンクだけにする
+"""
+import functools
+import time
+from logging import getLogger
+
+from pydantic import BaseModel
+
+from src.search.embedding_pipeline import estimate_tokens
+from src.search.keyword_index import tokenize
+from .tool_cache import _invoke
+
+logger = getLogger(__name__)
+
+
+class CompressionMetrics(BaseModel):
+    calls: int = 0
+    input_rows: int = 0
+    output_rows: int = 0
+    input_tokens: int = 0 # 圧縮前の観測 (str(result)) のトークン数の見積もり
+    output_tokens: int = 0
+    seconds: float = 0.0 # 圧縮にかかった時間
+
+    @property
+    def saved_ratio(self) -> float:
+        return 1.0 - self.output_tokens / self.input_tokens if self.input_tokens else 0.0
+
+
+class Passage:
+    __slots__ = ("row", "members", "rank", "score")
+
+    def __init__(self, row: dict, members: list[dict], rank: int):
+        self.row = row
+        self.members = members
+        self.rank = rank
+        self.score = 0.0
+
+
+class ContextCompressor:
+    def __init__(self, max_tokens: int = 1500, rank_weight: float = 0.3, min_overlap: int = 5,
+                 text_column: str = "text", id_column: str = "chunk_id", group_column: str = "file_name"):
+        self.max_tokens = max_tokens
+        self.rank_weight = rank_weight
+        self.min_overlap = min_overlap
+        self.text_column = text_column
+        self.id_column = id_column
+        self.group_column = group_column
+        self._metrics = CompressionMetrics()
+
+    def wrap(self, tool):
+        """検索ツールの func の結果を圧縮する (LocalSearch.wrap より外側に置き、ローカルの結果も圧縮する)"""
+        func = tool.func
+
+        @functools.wraps(func)
+        async def compressed(*args, **kwargs):
+            result = await _invoke(func, *args, **kwargs)
+            query = kwargs.get("query", args[0] if args else "")
+            try:
+                return self.compress(str(query), result)
+            except Exception as e:
+                logger.warning(f"検索結果を圧縮できませんでした。そのまま返します: {e}")
+                return result
+
+        tool.func = compressed
+        return tool
+
+    def compress(self, query: str, result):
+        if not isinstance(result, dict) or not isinstance(result.get("output"), list):
+            return result
+        rows = [row for row in result["output"] if isinstance(row, dict) and isinstance(row.get(self.text_column), str)]
+        if not rows:
+            return result
+
+        start = time.perf_counter()
+        passages = self.rerank(query, self.deduplicate(self.merge_adjacent(rows)))
+        kept = self.fit(passages)
+
+        compressed = dict(result)
+        compressed["output"] = [p.row for p in kept]
+        sources = result.get("sources")
+        if isinstance(sources, dict) and isinstance(sources.get("metadata"), list):
+            compressed["sources"] = {**sources, "metadata": self.citations(kept, sources["metadata"])}
+
+        self._metrics.calls += 1
+        self._metrics.input_rows += len(result["output"])
+        self._metrics.output_rows += len(kept)
+        self._metrics.input_tokens += estimate_tokens(str(result))
+        self._metrics.output_tokens += estimate_tokens(str(compressed))
+        self._metrics.seconds += time.perf_counter() - start
+        return compressed
+
+    def merge_adjacent(self, rows: list[dict]) -> list[Passage]:
+        """同じファイルで chunk_id が連続する結果をつなぐ。つないだ結果の順位はメンバーの最上位"""
+        passages, mergeable = [], []
+        for rank, row in enumerate(rows):
+            chunk_id = as_int(row.get(self.id_column))
+            if chunk_id is None or self.group_column not in row:
+                passages.append(Passage(row, [row], rank))
+            else:
+                mergeable.append((rank, chunk_id, row))
+
+        mergeable.sort(key=lambda item: (str(item[2][self.group_column]), item[1]))
+        current: Passage | None = None
+        last_id = None
+        for rank, chunk_id, row in mergeable:
+            last = current.members[-1] if current else None
+            if last is not None and row[self.group_column] == last[self.group_column] and chunk_id - last_id <= 1:
+                if chunk_id != last_id:
+                    current.row = {**current.row, self.text_column: join_overlapping(
+                        current.row[self.text_column], row[self.text_column], self.min_overlap)}
+                    current.members.append(row)
+                current.rank = min(current.rank, rank)
+                last_id = chunk_id
+                continue
+            current = Passage(dict(row), [row], rank)
+            last_id = chunk_id
+            passages.append(current)
+        return sorted(passages, key=lambda p: p.rank)
+
+    def deduplicate(self, passages: list[Passage]) -> list[Passage]:
+        """空白を除いた本文が、より上位の結果に含まれるものを除く"""
+        kept: list[Passage] = []
+        squashed: list[str] = []
+        for passage in passages:
+            text = "".join(passage.row[self.text_column].split())
+            if any(text in other for other in squashed):
+                continue
+            kept.append(passage)
+            squashed.append(text)
+        return kept
+
+    def rerank(self, query: str, passages: list[Passage]) -> list[Passage]:
+        """クエリの bi-gram が本文に含まれる割合と元の順位 (1 / (1 + rank)) の重み付き和で並べ替える"""
+        terms = set(tokenize(query))
+        for passage in passages:
+            coverage = len(terms & set(tokenize(passage.row[self.text_column]))) / len(terms) if terms else 0.0
+            passage.score = (1.0 - self.rank_weight) * coverage + self.rank_weight / (1.0 + passage.rank)
+        return sorted(passages, key=lambda p: (-p.score, p.rank))
+
+    def fit(self, passages: list[Passage]) -> list[Passage]:
+        """上位から max_tokens に収まるまで詰める。はみ出す1件は残りの予算で切り詰める (最低1件は返す)"""
+        kept, used = [], 0
+        for passage in passages:
+            tokens = estimate_tokens(passage.row[self.text_column])
+            if used + tokens <= self.max_tokens:
+                kept.append(passage)
+                used += tokens
+                continue
+            remaining = self.max_tokens - used
+            if remaining >= 32 or not kept:
+                passage.row = {**passage.row, self.text_column: truncate(passage.row[self.text_column], max(remaining, 32))}
+                kept.append(passage)
+            break
+        return kept
+
+    def citations(self, passages: list[Passage], metadata: list) -> list:
+        """残した結果に含まれるチャンクの出典だけを元の順序で返す"""
+        members = [{k: v for k, v in row.items() if k != self.text_column} for p in passages for row in p.members]
+        kept = [item for item in metadata if item in members]
+        return kept or metadata
+
+    def metrics(self) -> CompressionMetrics:
+        return self._metrics.model_copy()
+
+
+def as_int(value) -> int | None:
+    """chunk_id は Cortex Search から文字列で返ることもある"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def join_overlapping(left: str, right: str, min_overlap: int = 5) -> str:
+    """left の末尾と right の先頭の重なり (min_overlap 文字以上) を1回にしてつなぐ"""
+    for size in range(min(len(left), len(right)), min_overlap - 1, -1):
+        if left.endswith(right[:size]):
+            return left + right[size:]
+    return left + "\n" + right
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    """max_tokens に収まるように末尾を切る (文末があればそこで切る)"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens - 1:
+            low = mid
+        else:
+            high = mid - 1
+    head = text[:low]
+    end = max(head.rfind("。"), head.rfind("\n"))
+    return (head[:end + 1] if end >= len(head) // 2 else head) + "…"
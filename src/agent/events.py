@@ -0,0 +1,189 @@
+"""
+エージェント実行中の進捗イベント (ツール選択・ツール結果・生成中の回答・最終回答) の配信
+ゲートウェイの常駐ループから publish し、UI 側のスレッドで届いた順に取り出す
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Iterator, Literal
+
+from agent_gateway.tools.utils import parse_log_message
+from pydantic import BaseModel
+
+from .tool_cache import _invoke
+
+EventKind = Literal["tool_selection", "tool_result", "replan", "answer", "final", "error"]
+
+# 実行中のリクエストのイベントストリーム (Agent のタスクにもコンテキストごと引き継がれる)
+current_stream: contextvars.ContextVar["EventStream | None"] = contextvars.ContextVar(
+    "agent_event_stream", default=None)
+
+
+class AgentEvent(BaseModel):
+    kind: EventKind
+    text: str = ""
+    tool_name: str | None = None
+    data: Any = None
+    elapsed: float = 0.0 # リクエスト開始からの経過秒
+
+
+class EventStream:
+    """
+    1リクエスト分のイベントバッファ (スレッドセーフ・上限付き)
+    iterate すると、イベントが届くまでブロックし、final / error で終わる
+    async for でも取り出せる (別スレッド・別ループからの publish で起こす)
+    読み手が遅れて max_events を超えた場合は古い途中経過から捨てる (final / error は必ず届く)
+    answer はそれまでに生成された回答の全文なので、読み手が取り出す前に次が届いたら置き換える
+    """
+
+    def __init__(self, max_events: int = 256):
+        self.max_events = max_events
+        self.started = time.perf_counter()
+        self.first_update_seconds: float | None = None
+        self.first_answer_seconds: float | None = None
+        self.dropped = 0
+        self._events: deque[AgentEvent] = deque()
+        self._closed = False
+        self._cond = threading.Condition()
+        self._listeners: list = []
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def publish(self, kind: EventKind, text: str = "", **fields) -> None:
+        with self._cond:
+            if self._closed:
+                return
+            elapsed = time.perf_counter() - self.started
+            if self.first_update_seconds is None:
+                self.first_update_seconds = elapsed
+            event = AgentEvent(kind=kind, text=text, elapsed=elapsed, **fields)
+            if kind == "answer":
+                if self.first_answer_seconds is None:
+                    self.first_answer_seconds = elapsed
+                if self._events and self._events[-1].kind == "answer":
+                    self._events[-1] = event
+                    return
+            if len(self._events) >= self.max_events:
+                self._events.popleft()
+                self.dropped += 1
+            self._events.append(event)
+            if kind in ("final", "error"):
+                self._closed = True
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for notify in listeners:
+            notify()
+
+    def __iter__(self) -> Iterator[AgentEvent]:
+        while True:
+            with self._cond:
+                while not self._events and not self._closed:
+                    self._cond.wait()
+                if not self._events:
+                    return
+                event = self._events.popleft()
+            yield event
+
+    async def __aiter__(self) -> AsyncIterator[AgentEvent]:
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+
+        def notify():
+            loop.call_soon_threadsafe(wakeup.set)
+
+        with self._cond:
+            self._listeners.append(notify)
+        try:
+            while True:
+                with self._cond:
+                    if self._events:
+                        event = self._events.popleft()
+                    elif self._closed:
+                        return
+                    else:
+                        event = None
+                        wakeup.clear()
+                if event is None:
+                    await wakeup.wait()
+                    continue
+                yield event
+        finally:
+            with self._cond:
+                self._listeners.remove(notify)
+
+
+def publish(kind: EventKind, text: str = "", **fields) -> None:
+    """実行中のリクエストにイベントを送る (ストリームがなければ何もしない)"""
+    stream = current_stream.get()
+    if stream is not None:
+        stream.publish(kind, text, **fields)
+
+
+class ProgressLogHandler(logging.Handler):
+    """
+    AgentGatewayLogger の "running X task" / "Replanning" をイベントに変換する
+    ストリームのないリクエストではフォーマットもしない。1行は受け取った時に1回だけ解析する
+    """
+
+    def __init__(self):
+        super().__init__(level=logging.INFO)
+        self.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+
+    def emit(self, record: logging.LogRecord) -> None:
+        stream = current_stream.get()
+        if stream is None:
+            return
+        try:
+            message = parse_log_message(self.format(record))
+        except Exception:
+            self.handleError(record)
+            return
+        if message is None:
+            return
+        if message.startswith("Replanning"):
+            stream.publish("replan", message)
+        else:
+            stream.publish("tool_selection", message)
+
+
+_handler_lock = threading.Lock()
+_handler: ProgressLogHandler | None = None
+
+
+def install_progress_handler() -> ProgressLogHandler:
+    """AgentGatewayLogger にハンドラを1つだけ登録する (何度呼んでも増えない)"""
+    global _handler
+    with _handler_lock:
+        if _handler is None:
+            _handler = ProgressLogHandler()
+            logging.getLogger("AgentGatewayLogger").addHandler(_handler)
+    return _handler
+
+
+def wrap_tool(tool):
+    """tool.func の結果を tool_result イベントとして送る"""
+    func = tool.func
+
+    @functools.wraps(func)
+    async def reporting_func(*args, **kwargs):
+        result = await _invoke(func, *args, **kwargs)
+        publish("tool_result", summarize(result), tool_name=tool.name)
+        return result
+
+    tool.func = reporting_func
+    return tool
+
+
+def summarize(result, max_chars: int = 200) -> str:
+    """ツール結果を進捗表示用の短い文字列にする"""
+    output = result.get("output") if isinstance(result, dict) else result
+    if isinstance(output, list):
+        return f"{len(output)}件の結果"
+    text = "" if output is None else str(output)
+    return text if len(text) <= max_chars else text[:max_chars] + "..."
@@ -0,0 +1,100 @@
+"""
+Cortex Search の前段に置くローカル検索
+取り込み時に作ったベクトル索引とキーワード (BM25) 索引のハイブリッドで先に検索し、十分に一致するチャンクがあればそのまま返す
+索引がない・ベクトルの類似度が min_score 未満かつ BM25 が min_keyword_score 未満・検索に失敗した場合は Cortex Search に回す
+"""
+import functools
+from logging import getLogger
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from src.search.embedder import load_embedder
+from src.search.hybrid import HybridResult, HybridRetriever
+from src.search.keyword_index import KeywordIndex
+from src.search.vector_index import VectorIndex
+from .tool_cache import _invoke
+
+logger = getLogger(__name__)
+
+
+class LocalSearchMetrics(BaseModel):
+    hits: int = 0 # ローカル検索で応答した回数
+    fallbacks: int = 0 # Cortex Search に回した回数
+    errors: int = 0 # ローカル検索で例外が出た回数
+
+
+class LocalSearch:
+    def __init__(self, retriever: HybridRetriever, k: int = 10, min_score: float = 0.35,
+                 min_keyword_score: float = 10.0):
+        self.retriever = retriever
+        self.k = k
+        self.min_score = min_score
+        self.min_keyword_score = min_keyword_score
+        self._metrics = LocalSearchMetrics()
+
+    @classmethod
+    def load(cls, path: Path, keyword_path: Path | None = None, k: int = 10, min_score: float = 0.35,
+             min_keyword_score: float = 10.0, alpha: float = 0.5) -> "LocalSearch | None":
+        """保存済みの索引を読み込む (ベクトルは mmap)。どちらの索引もなければ None"""
+        index = VectorIndex.load(path)
+        keyword = KeywordIndex.load(keyword_path) if keyword_path is not None else None
+        if index is not None and keyword is not None and index.chunks != keyword.chunks:
+            logger.warning("ベクトル索引とキーワード索引のチャンクが一致しません。ベクトル索引だけを使います")
+            keyword = None
+        if index is None and keyword is None:
+            return None
+        logger.info(f"ローカル検索の索引を読み込みました (ベクトル: {len(index) if index else 'なし'}件"
+                    f"{f', {index.manifest.embedder}' if index else ''} / キーワード: {len(keyword) if keyword else 'なし'}件)")
+        retriever = HybridRetriever(index, keyword, load_embedder(index.manifest.embedder) if index else None, alpha=alpha)
+        return cls(retriever, k=k, min_score=min_score, min_keyword_score=min_keyword_score)
+
+    def accepts(self, found: HybridResult) -> bool:
+        """ベクトルが十分に近いか、キーワードが十分に一致すればローカルの結果で応答する"""
+        if not found.results:
+            return False
+        return ((found.vector_top is not None and found.vector_top >= self.min_score)
+                or (found.keyword_top is not None and found.keyword_top >= self.min_keyword_score))
+
+    def wrap(self, tool):
+        """
+        CortexSearchTool の func をローカル優先に差し替える (ToolScheduler より内側に置き、ワーカースレッドで動かす)
+        返り値は CortexSearchTool と同じ {"output": [...], "sources": {...}} の形
+        """
+        func = tool.func
+
+        @functools.wraps(func)
+        async def local_first(*args, **kwargs):
+            query = kwargs.get("query", args[0] if args else "")
+            try:
+                found = self.retriever.search(str(query), self.k)
+            except Exception as e:
+                self._metrics.errors += 1
+                logger.warning(f"ローカル検索に失敗しました。Cortex Search に切り替えます: {e}")
+                found = HybridResult(results=[])
+
+            if self.accepts(found):
+                self._metrics.hits += 1
+                return to_search_response(found.results, tool.name)
+            self._metrics.fallbacks += 1
+            return await _invoke(func, *args, **kwargs)
+
+        tool.func = local_first
+        return tool
+
+    def metrics(self) -> LocalSearchMetrics:
+        return self._metrics.model_copy()
+
+
+def to_search_response(results, tool_name: str) -> dict:
+    """CortexSearchTool.asearch と同じ形の応答 (metadata は検索列 text 以外の列)"""
+    output = [{"chunk_id": r.chunk_id, "file_name": r.file_name, "text": r.text} for r in results]
+    metadata = []
+    for row in output:
+        citation = {"chunk_id": row["chunk_id"], "file_name": row["file_name"]}
+        if citation not in metadata:
+            metadata.append(citation)
+    return {
+        "output": output,
+        "sources": {"tool_type": "cortex_search", "tool_name": tool_name, "metadata": metadata},
+    }
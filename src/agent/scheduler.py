@@ -0,0 +1,202 @@
+"""
+ツール呼び出しのスケジューラ
+agent_gateway はプランの独立したタスクを asyncio.create_task で同時に始めるが、
+CortexSearchTool / CortexAnalystTool はメタデータ取得や SQL 実行を同期的に行うため、
+1つのツール呼び出しがイベントループを止めて、結果的に直列に実行されてしまう
+ここでは各呼び出しを専用スレッド (スレッドごとのイベントループ) で実行し、ループを止めないようにする
+- ツールごとの同時実行数の上限
+- 1回の呼び出しのタイムアウトとキャンセル (スレッド側のタスクもキャンセルする)
+- リクエストごとのトレース (開始・終了・待ち時間・結果) で重なりを確認できる
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from logging import getLogger
+from typing import Iterator, Literal
+
+from pydantic import BaseModel
+
+from .tool_cache import _invoke
+
+logger = getLogger(__name__)
+
+
+class ToolTimeout(Exception):
+    """ツール呼び出しがタイムアウトした"""
+
+
+class ToolLimits(BaseModel):
+    max_concurrency: int = 4 # ツールごとの同時実行数
+    timeout: float = 60.0 # 1回の呼び出しのタイムアウト(秒)
+
+
+class ToolSpan(BaseModel):
+    tool_name: str
+    queued: float # 呼び出された時刻 (トレース開始からの秒)
+    started: float # 実行を始めた時刻 (同時実行数の空き待ちのあと)
+    finished: float
+    status: Literal["ok", "error", "timeout", "cancelled"]
+
+    @property
+    def seconds(self) -> float:
+        return self.finished - self.started
+
+
+class ToolTrace:
+    """1リクエスト分のツール呼び出しの記録"""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans: list[ToolSpan] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: ToolSpan) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def max_overlap(self) -> int:
+        """同時に実行されていたツール呼び出しの最大数"""
+        points = sorted([(s.started, 1) for s in self.spans] + [(s.finished, -1) for s in self.spans])
+        running = peak = 0
+        for _, delta in points:
+            running += delta
+            peak = max(peak, running)
+        return peak
+
+    def summary(self) -> str:
+        if not self.spans:
+            return "ツール呼び出しなし"
+        busy = sum(s.seconds for s in self.spans)
+        wall = max(s.finished for s in self.spans) - min(s.started for s in self.spans)
+        return (f"ツール呼び出し {len(self.spans)}件 (最大並行 {self.max_overlap()}, "
+                f"合計 {busy:.2f}s / 実時間 {wall:.2f}s)")
+
+    def render(self, width: int = 50) -> str:
+        """呼び出しごとの実行区間をテキストで描く"""
+        if not self.spans:
+            return ""
+        end = max(s.finished for s in self.spans) or 1e-9
+        lines = []
+        for span in sorted(self.spans, key=lambda s: (s.started, s.tool_name)):
+            left = int(span.started / end * width)
+            right = max(int(span.finished / end * width), left + 1)
+            bar = " " * left + "#" * (right - left)
+            lines.append(f"{span.tool_name[:32]:>32} |{bar:<{width}}| {span.seconds * 1000:7.1f} ms {span.status}")
+        return "\n".join(lines)
+
+
+current_trace: contextvars.ContextVar[ToolTrace | None] = contextvars.ContextVar("tool_trace", default=None)
+
+
+class ToolScheduler:
+    """wrap() でツールの func を差し替えて使う (ToolCache より内側に置く)"""
+
+    def __init__(self, max_workers: int = 32):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-tool")
+        self._limits: dict[str, ToolLimits] = {}
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+
+    def wrap(self, tool, limits: ToolLimits | None = None):
+        self._limits[tool.name] = limits or ToolLimits()
+        self._semaphores.pop(tool.name, None)
+        func = tool.func
+
+        @functools.wraps(func)
+        async def scheduled_func(*args, **kwargs):
+            return await self.call(tool.name, func, *args, **kwargs)
+
+        tool.func = scheduled_func
+        return tool
+
+    async def call(self, tool_name: str, func, *args, **kwargs):
+        limits = self._limits.get(tool_name, ToolLimits())
+        semaphore = self._semaphores.get(tool_name)
+        if semaphore is None:
+            semaphore = self._semaphores[tool_name] = asyncio.Semaphore(limits.max_concurrency)
+
+        trace = current_trace.get()
+        origin = trace.origin if trace is not None else time.perf_counter()
+        queued = time.perf_counter() - origin
+        started = queued
+        status = "error"
+        try:
+            async with semaphore:
+                started = time.perf_counter() - origin
+                result = await self._run(func, args, kwargs, limits.timeout)
+                status = "ok"
+                return result
+        except ToolTimeout:
+            status = "timeout"
+            logger.warning(f"ツール {tool_name} が {limits.timeout}s でタイムアウトしました")
+            raise
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            if trace is not None:
+                trace.add(ToolSpan(tool_name=tool_name, queued=queued, started=started,
+                                   finished=time.perf_counter() - origin, status=status))
+
+    async def _run(self, func, args: tuple, kwargs: dict, timeout: float):
+        call = _ThreadCall(func, args, kwargs)
+        context = contextvars.copy_context()
+        future = asyncio.get_running_loop().run_in_executor(self._executor, context.run, call.run)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            call.cancel()
+            raise ToolTimeout(f"ツールの呼び出しが {timeout}s 以内に終わりませんでした")
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _ThreadCall:
+    """ワーカースレッド上のイベントループで1回のツール呼び出しを実行する"""
+
+    def __init__(self, func, args: tuple, kwargs: dict):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._task: asyncio.Task | None = None
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    def run(self):
+        with self._lock:
+            if self._cancelled:
+                raise asyncio.CancelledError()
+            self._loop = asyncio.new_event_loop()
+            self._task = self._loop.create_task(_invoke(self.func, *self.args, **self.kwargs))
+        try:
+            return self._loop.run_until_complete(self._task)
+        finally:
+            with self._lock:
+                self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+                self._loop.close()
+                self._loop = None
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._cancelled = True
+            if self._loop is not None and self._task is not None:
+                self._loop.call_soon_threadsafe(self._task.cancel)
+
+
+@contextmanager
+def tracing() -> Iterator[ToolTrace]:
+    """with の中 (と、そこから引き継いだコンテキスト) のツール呼び出しを記録する"""
+    trace = ToolTrace()
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
@@ -0,0 +1,445 @@
+"""
+ゲートウェイのリクエストのトレースと段階ごとのメトリクス
+1リクエストを木構造のスパンで記録する
+- request: AgentGateway._arun 全体 (キャッシュ参照を含む)
+- plan / llm: プランナーの計画 (LLM 呼び出しを含む)、回答の生成 (fusion) の LLM 呼び出し
+- step: プランの各タスク (ツールキャッシュのヒットも含む)
+- tool: スケジューラ経由のツール呼び出し (待ち時間を含む)
+- sql: ウェアハウスに送った SQL 1文
+属性名が *_tokens の値はトークン数 (estimate_tokens の見積もり) として集計する
+リクエストが終わるとスパンをまとめてエクスポーター (メモリ・JSON Lines・Prometheus テキスト) に渡す
+外部のコレクターは使わない。トレース中のリクエストがなければ span() は共有の no-op を返すだけなので、
+無効にしたときの負荷はほぼない
+"""
+import bisect
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from logging import getLogger
+from typing import Literal
+
+from pydantic import BaseModel
+
+from src.search.embedding_pipeline import estimate_tokens
+from .tool_cache import _invoke
+
+logger = getLogger(__name__)
+
+SpanKind = Literal["request", "plan", "llm", "step", "tool", "sql"]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Span:
+    """1区間の記録。with で使うと、その中 (と引き継いだコンテキスト) のスパンの親になる"""
+    __slots__ = ("trace", "span_id", "parent_id", "kind", "name", "start", "seconds", "status",
+                 "attributes", "_started", "_token")
+
+    def __init__(self, trace: "Trace", kind: str, name: str, parent_id: str | None, attributes: dict):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.kind = kind
+        self.name = name
+        self.start = 0.0 # 開始時刻 (UNIX 時間)
+        self.seconds = 0.0
+        self.status = "ok"
+        self.attributes = attributes
+        self._started = 0.0
+        self._token = None
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> "Span":
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self._token = current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.seconds = time.perf_counter() - self._started
+        if exc_type is not None:
+            self.status = "cancelled" if exc_type.__name__ == "CancelledError" else "error"
+            self.attributes.setdefault("error", f"{exc_type.__name__}: {exc}")
+        current_span.reset(self._token)
+        self.trace.finish(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "kind": self.kind,
+            "name": self.name,
+            "start": self.start,
+            "seconds": self.seconds,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """トレースしていないときの span() の戻り値 (何も記録しない)"""
+    __slots__ = ()
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("telemetry_span", default=None)
+
+
+class Trace:
+    """1リクエスト分のスパン。ルートのスパンが終わったらエクスポートする"""
+    __slots__ = ("trace_id", "telemetry", "spans", "_lock")
+
+    def __init__(self, telemetry: "Telemetry"):
+        self.trace_id = uuid.uuid4().hex
+        self.telemetry = telemetry
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    def finish(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+        if span.parent_id is None:
+            self.telemetry.export(list(self.spans))
+
+
+def span(kind: SpanKind, name: str, **attributes) -> Span | _NoopSpan:
+    """実行中のリクエストのトレースに子スパンを作る (トレース中でなければ no-op)"""
+    parent = current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(parent.trace, kind, name, parent.span_id, attributes)
+
+
+class Histogram:
+    """固定バケットの度数分布 (Prometheus の histogram と同じく上限値ごとに数える)"""
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # 最後は +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """バケット内を線形補間した分位点の見積もり"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class StageStats(BaseModel):
+    count: int = 0
+    errors: int = 0
+    seconds: float = 0.0 # 合計時間
+    p50: float = 0.0
+    p95: float = 0.0
+    tokens: dict[str, int] = {} # 属性名 (*_tokens) ごとの合計
+
+
+class SpanExporter:
+    """リクエストが終わるたびに、そのリクエストのスパンをまとめて受け取る"""
+
+    def export(self, spans: list[Span]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class InMemoryExporter(SpanExporter):
+    """直近 max_traces 件のリクエストのスパンを保持する (テスト・ベンチマーク・デバッグ用)"""
+
+    def __init__(self, max_traces: int = 100):
+        self._traces: deque[list[dict]] = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+
+    def export(self, spans: list[Span]) -> None:
+        trace = [span.to_dict() for span in sorted(spans, key=lambda s: s.start)]
+        with self._lock:
+            self._traces.append(trace)
+
+    def traces(self) -> list[list[dict]]:
+        with self._lock:
+            return list(self._traces)
+
+
+class JsonlExporter(SpanExporter):
+    """1スパン1行の JSON Lines としてファイルに追記する"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, spans: list[Span]) -> None:
+        lines = "".join(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n"
+                        for span in sorted(spans, key=lambda s: s.start))
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class PrometheusExporter(SpanExporter):
+    """(kind, name) ごとの所要時間のヒストグラムとトークン数を集計し、Prometheus のテキスト形式で出す"""
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS, prefix: str = "agent_gateway"):
+        self.buckets = buckets
+        self.prefix = prefix
+        self._histograms: dict[tuple[str, str], Histogram] = {}
+        self._errors: dict[tuple[str, str], int] = {}
+        self._tokens: dict[tuple[str, str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def export(self, spans: list[Span]) -> None:
+        with self._lock:
+            for span in spans:
+                key = (span.kind, span.name)
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(self.buckets)
+                histogram.observe(span.seconds)
+                if span.status != "ok":
+                    self._errors[key] = self._errors.get(key, 0) + 1
+                for attribute, value in span.attributes.items():
+                    if attribute.endswith("_tokens") and isinstance(value, int):
+                        token_key = (span.kind, span.name, attribute[:-len("_tokens")])
+                        self._tokens[token_key] = self._tokens.get(token_key, 0) + value
+
+    def stats(self) -> dict[str, StageStats]:
+        """"kind/name" ごとの件数・エラー数・合計時間・p50/p95 (秒)・トークン数"""
+        with self._lock:
+            stats = {}
+            for (kind, name), histogram in sorted(self._histograms.items()):
+                stats[f"{kind}/{name}"] = StageStats(
+                    count=histogram.count, errors=self._errors.get((kind, name), 0), seconds=histogram.sum,
+                    p50=histogram.quantile(0.5), p95=histogram.quantile(0.95),
+                    tokens={f"{t}_tokens": v for (k, n, t), v in self._tokens.items() if (k, n) == (kind, name)})
+            return stats
+
+    def render(self) -> str:
+        metric = f"{self.prefix}_span_seconds"
+        lines = [f"# HELP {metric} Duration of gateway spans.", f"# TYPE {metric} histogram"]
+        with self._lock:
+            for (kind, name), histogram in sorted(self._histograms.items()):
+                labels = f'kind="{kind}",name="{_escape(name)}"'
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+
+            errors = f"{self.prefix}_span_errors_total"
+            lines += [f"# HELP {errors} Spans that ended with an error or cancellation.", f"# TYPE {errors} counter"]
+            for (kind, name), count in sorted(self._errors.items()):
+                lines.append(f'{errors}{{kind="{kind}",name="{_escape(name)}"}} {count}')
+
+            tokens = f"{self.prefix}_tokens_total"
+            lines += [f"# HELP {tokens} Estimated tokens by span and direction.", f"# TYPE {tokens} counter"]
+            for (kind, name, direction), count in sorted(self._tokens.items()):
+                lines.append(f'{tokens}{{kind="{kind}",name="{_escape(name)}",type="{direction}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class TelemetryMetrics(BaseModel):
+    traces: int = 0
+    spans: int = 0
+    export_errors: int = 0
+
+
+class Telemetry:
+    """
+    リクエストのトレースを始め、ツール・エージェント・接続にスパンを仕込む
+    wrap_tool はスケジューラより外側 (ツールキャッシュより内側) に置く
+    """
+
+    def __init__(self, exporters: list[SpanExporter] | None = None):
+        self.exporters = exporters if exporters is not None else [InMemoryExporter(), PrometheusExporter()]
+        self._metrics = TelemetryMetrics()
+        self._lock = threading.Lock()
+
+    def request(self, name: str = "query", **attributes) -> Span:
+        """ルートのスパン (with の中で作ったスパンがこのトレースに入る)"""
+        return Span(Trace(self), "request", name, None, attributes)
+
+    def export(self, spans: list[Span]) -> None:
+        errors = 0
+        for exporter in self.exporters:
+            try:
+                exporter.export(spans)
+            except Exception as e:
+                errors += 1
+                logger.warning(f"トレースを出力できませんでした ({type(exporter).__name__}): {e}")
+        with self._lock:
+            self._metrics.traces += 1
+            self._metrics.spans += len(spans)
+            self._metrics.export_errors += errors
+
+    def exporter(self, exporter_type: type) -> SpanExporter | None:
+        return next((e for e in self.exporters if isinstance(e, exporter_type)), None)
+
+    def wrap_tool(self, tool):
+        """ツール呼び出しを tool スパンにする (結果のトークン数を observation_tokens に入れる)"""
+        func = tool.func
+
+        @functools.wraps(func)
+        async def traced_func(*args, **kwargs):
+            if current_span.get() is None:
+                return await _invoke(func, *args, **kwargs)
+            with span("tool", tool.name) as tool_span:
+                result = await _invoke(func, *args, **kwargs)
+                tool_span.set(observation_tokens=estimate_tokens(str(result)))
+                return result
+
+        tool.func = traced_func
+        return tool
+
+    def wrap_connection(self, tool):
+        """ツールの接続から実行する SQL を1文ずつ sql スパンにする (CortexAnalystTool 用)"""
+        tool.connection = TracingConnection(tool.connection)
+        return tool
+
+    def instrument_agent(self, agent):
+        """Agent のプランナー・回答生成の LLM 呼び出しと、プランの各タスクにスパンを仕込む"""
+        planner = getattr(agent, "planner", None)
+        if planner is not None and hasattr(planner, "plan") and hasattr(planner, "run_llm"):
+            planner.plan = _traced_plan(planner.plan)
+            planner.run_llm = _traced_planner_llm(planner, planner.run_llm)
+        completion = getattr(agent, "agent", None)
+        if completion is not None and hasattr(completion, "arun"):
+            completion.arun = _traced_llm("fusion", completion.arun)
+        return agent
+
+    def metrics(self) -> TelemetryMetrics:
+        with self._lock:
+            return self._metrics.model_copy()
+
+    def close(self) -> None:
+        for exporter in self.exporters:
+            exporter.close()
+
+
+def _traced_plan(plan):
+    @functools.wraps(plan)
+    async def traced_plan(inputs: dict, is_replan: bool, **kwargs):
+        with span("plan", "replan" if is_replan else "plan") as plan_span:
+            tasks = await plan(inputs=inputs, is_replan=is_replan, **kwargs)
+            plan_span.set(steps=len(tasks))
+        if isinstance(plan_span, Span):
+            for task in tasks.values():
+                if not getattr(task, "is_fuse", False):
+                    task.tool = _traced_step(task, task.tool)
+        return tasks
+    return traced_plan
+
+
+def _traced_step(task, func):
+    @functools.wraps(func)
+    async def traced_step(*args, **kwargs):
+        with span("step", task.name, idx=str(task.idx), dependencies=[str(d) for d in task.dependencies]):
+            return await _invoke(func, *args, **kwargs)
+    return traced_step
+
+
+def _traced_planner_llm(planner, run_llm):
+    @functools.wraps(run_llm)
+    async def traced_run_llm(inputs: dict, is_replan: bool = False):
+        if current_span.get() is None:
+            return await run_llm(inputs=inputs, is_replan=is_replan)
+        system_prompt = getattr(planner, "system_prompt_replan" if is_replan else "system_prompt", "")
+        with span("llm", "planner", model=getattr(planner, "llm", None)) as llm_span:
+            completion = await run_llm(inputs=inputs, is_replan=is_replan)
+            llm_span.set(prompt_tokens=estimate_tokens(str(system_prompt)) + estimate_tokens(str(inputs)),
+                         completion_tokens=estimate_tokens(str(completion)))
+            return completion
+    return traced_run_llm
+
+
+def _traced_llm(name: str, arun):
+    @functools.wraps(arun)
+    async def traced_arun(prompt: str):
+        if current_span.get() is None:
+            return await arun(prompt)
+        with span("llm", name, model=getattr(getattr(arun, "__self__", None), "llm", None)) as llm_span:
+            completion = await arun(prompt)
+            llm_span.set(prompt_tokens=estimate_tokens(str(prompt)), completion_tokens=estimate_tokens(str(completion)))
+            return completion
+    return traced_arun
+
+
+class TracingConnection:
+    """cursor() だけを差し替え、それ以外は元の接続に委ねる"""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def cursor(self, *args, **kwargs):
+        return TracingCursor(self._connection.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class TracingCursor:
+    """execute() を sql スパンにする (SQL 文は先頭 200 文字だけ残す)"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql: str, *args, **kwargs):
+        if current_span.get() is None:
+            self._cursor.execute(sql, *args, **kwargs)
+            return self
+        with span("sql", _statement_type(sql), statement=" ".join(sql.split())[:200]):
+            self._cursor.execute(sql, *args, **kwargs)
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def _statement_type(sql: str) -> str:
+    words = sql.split(None, 1)
+    return words[0].lower() if words else "empty"
@@ -0,0 +1,158 @@
+import asyncio
+import copy
+import functools
+import inspect
+import json
+import re
+import time
+from collections import OrderedDict
+from logging import getLogger
+
+from pydantic import BaseModel, Field
+
+logger = getLogger(__name__)
+
+_LAG_UNITS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def target_lag_seconds(target_lag: str) -> float:
+    """Cortex Search の TARGET_LAG ('1 hour' など) を秒に変換する"""
+    match = re.fullmatch(r"\s*(\d+)\s*(second|minute|hour|day)s?\s*", target_lag.lower())
+    if match is None:
+        raise ValueError(f"TARGET_LAG を解釈できません: {target_lag}")
+    return int(match.group(1)) * _LAG_UNITS[match.group(2)]
+
+
+class ToolCachePolicy(BaseModel):
+    """ツールごとのキャッシュ方針"""
+    ttl: float = Field(default=300.0, description="キャッシュの有効期間(秒)")
+    enabled: bool = True
+
+
+class ToolCacheMetrics(BaseModel):
+    """ツール結果キャッシュのメトリクス"""
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = Field(default=0, description="実行中の同一呼び出しに相乗りした回数")
+    errors: int = 0
+    evictions: int = 0
+
+
+class _LeaderCancelled(Exception):
+    """同じ呼び出しを実行していたタスクがキャンセルされた (相乗りしていた呼び出しはやり直す)"""
+
+
+class ToolCache:
+    """
+    ツール呼び出し結果のキャッシュ
+    - キーはツール名 + 引数
+    - LRU (max_entries) と ツールごとの TTL
+    - 同じ引数の呼び出しが同時に来た場合はバックエンドへのリクエストを1回にまとめる
+      (実行していた呼び出しがキャンセルされても、相乗りしていた呼び出しは1つが引き継いで実行する)
+    wrap() でツールの func を差し替えて使う (Agent のタスクは tool.func を呼ぶ)
+    """
+
+    def __init__(self, max_entries: int = 512, policies: dict[str, ToolCachePolicy] | None = None):
+        self.max_entries = max_entries
+        self.policies = dict(policies or {})
+        self._entries: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._metrics: dict[str, ToolCacheMetrics] = {}
+
+    def wrap(self, tool, policy: ToolCachePolicy | None = None):
+        """tool.func をキャッシュ付きの非同期関数に差し替える"""
+        if policy is not None:
+            self.policies[tool.name] = policy
+        func = tool.func
+
+        @functools.wraps(func)
+        async def cached_func(*args, **kwargs):
+            return await self.call(tool.name, func, *args, **kwargs)
+
+        tool.func = cached_func
+        return tool
+
+    async def call(self, tool_name: str, func, *args, **kwargs):
+        policy = self.policies.get(tool_name, ToolCachePolicy())
+        if not policy.enabled:
+            return await _invoke(func, *args, **kwargs)
+
+        metrics = self._metrics.setdefault(tool_name, ToolCacheMetrics())
+        key = self._key(tool_name, args, kwargs)
+
+        while True:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    metrics.hits += 1
+                    return copy.deepcopy(value)
+                del self._entries[key]
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            metrics.coalesced += 1
+            try:
+                return copy.deepcopy(await asyncio.shield(inflight))
+            except _LeaderCancelled:
+                # 実行していた呼び出しだけがキャンセルされた: 相乗りしていた呼び出しのうち最初の1つが実行し直す
+                continue
+
+        metrics.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await _invoke(func, *args, **kwargs)
+        except asyncio.CancelledError:
+            # 相乗りしている呼び出しはキャンセルされていないので、CancelledError ではなくやり直しを伝える
+            self._inflight.pop(key, None)
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            metrics.errors += 1
+            future.set_exception(e)
+            # 相乗りがいない場合に "exception was never retrieved" を出さない
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            self._store(key, value, policy.ttl)
+            return copy.deepcopy(value)
+        finally:
+            self._inflight.pop(key, None)
+
+    def clear(self, tool_name: str | None = None) -> None:
+        if tool_name is None:
+            self._entries.clear()
+            return
+        prefix = f"{tool_name}\x00"
+        for key in [k for k in self._entries if k.startswith(prefix)]:
+            del self._entries[key]
+
+    def metrics(self) -> dict[str, ToolCacheMetrics]:
+        return {name: m.model_copy() for name, m in self._metrics.items()}
+
+    def _store(self, key: str, value, ttl: float) -> None:
+        if ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, copy.deepcopy(value))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._metrics[evicted.split("\x00", 1)[0]].evictions += 1
+
+    @staticmethod
+    def _key(tool_name: str, args: tuple, kwargs: dict) -> str:
+        arguments = json.dumps([args, kwargs], sort_keys=True, ensure_ascii=False, default=str)
+        return f"{tool_name}\x00{arguments}"
+
+
+async def _invoke(func, *args, **kwargs):
+    # agent_gateway のツールは同期関数がコルーチンを返すものと、async 関数の両方がある
+    result = func(*args, **kwargs)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
@@ -1,8 +1,263 @@
-import requests
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from html.parser import HTMLParser
+from logging import getLogger
+from pathlib import Path
+from urllib.parse import urlsplit
 
+import httpx
+from pydantic import BaseModel, Field
 
-def html_crawl(url) -> str:
-    response = requests.get(url)
+logger = getLogger(__name__)
+
+_SKIP_TAGS = {"script", "style", "noscript", "svg", "template", "iframe", "head"}
+_BLOCK_TAGS = {
+    "p", "div", "br", "li", "ul", "ol", "tr", "table", "section", "article", "header", "footer",
+    "h1", "h2", "h3", "h4", "h5", "h6", "title", "dt", "dd", "blockquote", "pre", "hr",
+}
+_META_CHARSET = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.IGNORECASE)
+
+
+class _TextExtractor(HTMLParser):
+    """HTMLから本文テキストだけを取り出す (script/style などは捨てる)"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.title = ""
+        self._skip = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title":
+            self._in_title = True
+        elif tag in _SKIP_TAGS:
+            self._skip += 1
+        if tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+        elif tag in _SKIP_TAGS and self._skip:
+            self._skip -= 1
+        if tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        elif not self._skip:
+            self.parts.append(data)
+
+
+def html_to_text(html: str, max_chars: int | None = None) -> str:
+    """HTMLをLLMに渡す用のプレーンテキストに変換する"""
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+
+    lines = []
+    for line in "".join(parser.parts).splitlines():
+        line = " ".join(line.split())
+        if line:
+            lines.append(line)
+    text = "\n".join(lines)
+    if parser.title.strip():
+        text = f"# {' '.join(parser.title.split())}\n{text}"
+    if max_chars is not None and len(text) > max_chars:
+        text = text[:max_chars] + "\n...(以下省略)"
+    return text
+
+
+class CrawlResult(BaseModel):
+    """html_crawl の取得結果"""
+    url: str
+    status_code: int
+    text: str | None = Field(default=None, description="抽出したテキスト")
+    bytes_read: int = Field(default=0, description="受信したバイト数")
+    truncated: bool = Field(default=False, description="max_bytes で打ち切ったか")
+    from_cache: bool = Field(default=False, description="304 でディスクキャッシュを使ったか")
+    elapsed: float = 0.0
+
+
+class HtmlCrawler:
+    """
+    html_crawl ツールの実体
+    - keep-alive 付きの非同期HTTPクライアントを共有し、ホストごとに同時接続数を制限する
+    - 接続・読み込みタイムアウトと max_bytes での打ち切り
+    - ETag / Last-Modified による条件付きGETとディスクキャッシュ
+    - HTMLをテキストに変換し、max_chars で切り詰めてからエージェントに渡す
+    クライアントは専用スレッドのイベントループで動かすので、同期・非同期どちらからも呼べる
+    """
+
+    def __init__(
+        self,
+        cache_dir: str | Path | None = None,
+        max_bytes: int = 2_000_000,
+        max_chars: int = 8000,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 10.0,
+        per_host_limit: int = 4,
+        max_connections: int = 32,
+    ):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.max_bytes = max_bytes
+        self.max_chars = max_chars
+        self.per_host_limit = per_host_limit
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+        self._client = None
+        self._host_limits: dict[str, asyncio.Semaphore] = {}
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="html-crawler-loop", daemon=True).start()
+        return self._loop
+
+    def crawl(self, url: str) -> CrawlResult:
+        """同期版 (PythonTool のスレッドプールから呼ばれる)"""
+        result, body, encoding = asyncio.run_coroutine_threadsafe(self._fetch(url), self.loop).result()
+        return self._to_text(result, body, encoding)
+
+    async def acrawl(self, url: str) -> CrawlResult:
+        result, body, encoding = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._fetch(url), self.loop))
+        # HTMLの解析はCPUを使うので、クライアントのループを塞がないよう別スレッドで行う
+        return await asyncio.to_thread(self._to_text, result, body, encoding)
+
+    def close(self) -> None:
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        if self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), loop).result()
+            self._client = None
+        asyncio.run_coroutine_threadsafe(loop.shutdown_asyncgens(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+    def _to_text(self, result: CrawlResult, body: bytes | None, encoding: str | None) -> CrawlResult:
+        if body is not None:
+            result.text = html_to_text(self._decode(body, encoding), self.max_chars)
+        return result
+
+    async def _fetch(self, url: str) -> tuple[CrawlResult, bytes | None, str | None]:
+        """本文のバイト列を取得する (テキスト化は呼び出し側のスレッドで行う)"""
+        start = time.perf_counter()
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=self.limits,
+                follow_redirects=True,
+                headers={"User-Agent": "agent-gateway-html-crawl/0.1"},
+            )
+
+        host = urlsplit(url).netloc
+        semaphore = self._host_limits.setdefault(host, asyncio.Semaphore(self.per_host_limit))
+        meta, cached_body = self._read_cache(url)
+
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        async with semaphore:
+            async with self._client.stream("GET", url, headers=headers) as response:
+                if response.status_code != 200:
+                    # 本文を読み切らずに閉じると接続がプールに戻らないので、304 などの短い応答も読み切る
+                    await response.aread()
+                if response.status_code == 304 and cached_body is not None:
+                    result = CrawlResult(url=url, status_code=200, from_cache=True, elapsed=time.perf_counter() - start)
+                    return result, cached_body, meta.get("encoding")
+                if response.status_code != 200:
+                    return CrawlResult(url=url, status_code=response.status_code, elapsed=time.perf_counter() - start), None, None
+
+                chunks = []
+                size = 0
+                truncated = False
+                stream = response.aiter_bytes()
+                async for chunk in stream:
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= self.max_bytes:
+                        truncated = True
+                        break
+                await stream.aclose()
+                body = b"".join(chunks)[:self.max_bytes]
+                encoding = response.charset_encoding
+
+                # 打ち切ったレスポンスは不完全なのでキャッシュしない
+                if not truncated:
+                    self._write_cache(url, body, {
+                        "url": url,
+                        "etag": response.headers.get("etag"),
+                        "last_modified": response.headers.get("last-modified"),
+                        "encoding": encoding,
+                    })
+
+        result = CrawlResult(url=url, status_code=200, bytes_read=size, truncated=truncated, elapsed=time.perf_counter() - start)
+        return result, body, encoding
+
+    @staticmethod
+    def _decode(body: bytes, encoding: str | None) -> str:
+        if not encoding:
+            match = _META_CHARSET.search(body[:4096])
+            encoding = match.group(1).decode("ascii") if match else "utf-8"
+        try:
+            return body.decode(encoding, errors="replace")
+        except LookupError:
+            return body.decode("utf-8", errors="replace")
+
+    def _cache_paths(self, url: str) -> tuple[Path, Path]:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return self.cache_dir / f"{key}.json", self.cache_dir / f"{key}.html"
+
+    def _read_cache(self, url: str) -> tuple[dict, bytes | None]:
+        if self.cache_dir is None:
+            return {}, None
+        meta_path, body_path = self._cache_paths(url)
+        try:
+            return json.loads(meta_path.read_text(encoding="utf-8")), body_path.read_bytes()
+        except (OSError, ValueError):
+            return {}, None
+
+    def _write_cache(self, url: str, body: bytes, meta: dict) -> None:
+        if self.cache_dir is None or not (meta.get("etag") or meta.get("last_modified")):
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        meta_path, body_path = self._cache_paths(url)
+        body_path.write_bytes(body)
+        meta_path.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+
+
+_crawler: HtmlCrawler | None = None
+_crawler_lock = threading.Lock()
+
+
+def get_crawler() -> HtmlCrawler:
+    """html_crawl が共有するクローラーを返す
+    キャッシュの場所 (HTML_CRAWL_CACHE_DIR) は load_dotenv のあとに読むよう、最初の呼び出しで生成する"""
+    global _crawler
+    with _crawler_lock:
+        if _crawler is None:
+            _crawler = HtmlCrawler(cache_dir=os.getenv("HTML_CRAWL_CACHE_DIR", ".cache/html_crawl"))
+        return _crawler
+
+
+def html_crawl(url: str) -> str:
+    response = get_crawler().crawl(url)
     if response.status_code == 200:
         return response.text
-    return None
\ No newline at end of file
+    return None
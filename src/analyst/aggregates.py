@@ -0,0 +1,228 @@
+"""
+セマンティックモデル (cortex_analyst_demo.yaml) から作る集計テーブル
+- テーブルごとに「ディメンション (時間ディメンション・他テーブルと共有する *_ID を含む) 別の数値ファクトの合計と件数」を
+  AGG_<テーブル>_BY_<列> として事前に計算しておく (部署別・チャネル別・商品別・日付別の合計など)
+- refresh() は元テーブルの LAST_ALTERED が集計テーブルより新しいもの (または未作成のもの) だけを作り直す
+- rewrite() は Cortex Analyst が生成した単純な集計 SQL (1テーブル・1列の GROUP BY・SUM/COUNT、WHERE なし) を
+  集計テーブルを読む SQL に書き換える。集計テーブルが元テーブルより古い場合は書き換えない
+python -m src.analyst.aggregates で作成・更新する
+"""
+import re
+import threading
+import time
+from logging import getLogger
+
+import yaml
+from pydantic import BaseModel, Field
+
+logger = getLogger(__name__)
+
+
+class Measure(BaseModel):
+    func: str # SUM / COUNT
+    column: str | None = None # COUNT(*) の場合は None
+    name: str # 集計テーブルの列名
+
+    @property
+    def expr(self) -> str:
+        return f"{self.func}({self.column or '*'})"
+
+
+class AggregateSpec(BaseModel):
+    table: str = Field(description="元のテーブル")
+    group_by: str = Field(description="GROUP BY の列")
+    measures: list[Measure]
+
+    @property
+    def name(self) -> str:
+        return f"AGG_{self.table}_BY_{self.group_by}"
+
+    def create_sql(self, schema: str | None = None) -> str:
+        prefix = f"{schema}." if schema else ""
+        columns = ", ".join(f"{m.expr} AS {m.name}" for m in self.measures)
+        return (f"CREATE OR REPLACE TABLE {prefix}{self.name} AS "
+                f"SELECT {self.group_by}, {columns} FROM {prefix}{self.table} GROUP BY {self.group_by}")
+
+
+def aggregate_specs(semantic_model_path: str) -> list[AggregateSpec]:
+    """
+    セマンティックモデルの集計の形を列挙する
+    - GROUP BY: dimensions, time_dimensions と、複数のテーブルにある *_ID ファクト (結合キー。テーブル自身の最初の ID は除く)
+    - 集計: ID 以外の数値ファクトの SUM と COUNT(*)
+    """
+    with open(semantic_model_path, encoding="utf-8") as f:
+        model = yaml.safe_load(f)
+
+    tables = model.get("tables", [])
+    id_facts = {}
+    for table in tables:
+        id_facts[table["name"]] = [fact["name"] for fact in table.get("facts", []) if fact["name"].upper().endswith("_ID")]
+    shared_ids = {name for names in id_facts.values() for name in names
+                  if sum(name in other for other in id_facts.values()) > 1}
+
+    specs = []
+    for table in tables:
+        ids = id_facts[table["name"]]
+        keys = [d["name"] for d in table.get("dimensions", []) + table.get("time_dimensions", [])]
+        keys += [name for name in ids[1:] if name in shared_ids]
+        measures = [Measure(func="SUM", column=fact["name"], name=f"TOTAL_{fact['name']}")
+                    for fact in table.get("facts", []) if fact["name"] not in ids]
+        measures.append(Measure(func="COUNT", name="ROW_COUNT"))
+        specs += [AggregateSpec(table=table["base_table"]["table"].upper(), group_by=key.upper(), measures=measures)
+                  for key in keys]
+    return specs
+
+
+_AGGREGATE = re.compile(r"^(sum|count)\((\*|[a-z_][a-z0-9_$]*)\)(?: as ([a-z_][a-z0-9_$]*))?$")
+_SIMPLE = re.compile(
+    r"^select (?P<columns>.+?) from (?P<table>[a-z_][a-z0-9_$.]*)(?: as [a-z_][a-z0-9_$]*)?"
+    r" group by (?P<group>[a-z_][a-z0-9_$]*|1)(?P<tail>(?: order by .+?)?(?: limit \d+)?)$")
+_CTE = re.compile(
+    r"^with (?P<alias>[a-z_][a-z0-9_$]*) as \(select [a-z0-9_$, ]+ from (?P<table>[a-z_][a-z0-9_$.]*)\) (?P<body>select .+)$")
+_ORDER_TARGET = re.compile(r"(?:order by|,)\s*(sum|count)\((\*|[a-z_][a-z0-9_$]*)\)")
+
+
+class MaterializedAggregates:
+    def __init__(self, specs: list[AggregateSpec], schema: str | None = None):
+        self.specs = {(spec.table, spec.group_by): spec for spec in specs}
+        self.schema = schema
+        self._fresh: set[str] = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_semantic_model(cls, semantic_model_path: str, schema: str | None = None) -> "MaterializedAggregates":
+        return cls(aggregate_specs(semantic_model_path), schema)
+
+    @property
+    def tables(self) -> list[str]:
+        """集計テーブル名の一覧"""
+        return [spec.name for spec in self.specs.values()]
+
+    def refresh(self, connector, force: bool = False, last_altered: dict | None = None) -> list[str]:
+        """
+        元テーブルより古い (または未作成の) 集計テーブルを作り直し、作り直したテーブル名を返す
+        last_altered (テーブル名 → LAST_ALTERED) を渡した場合は問い合わせずにそれを使う
+        """
+        start = time.perf_counter()
+        if last_altered is None:
+            last_altered = self.last_altered(connector)
+        stale = [spec for spec in self.specs.values() if force or not _is_fresh(spec, last_altered)]
+        if stale:
+            cursor = connector.cursor()
+            try:
+                for spec in stale:
+                    cursor.execute(spec.create_sql(self.schema))
+                connector.commit()
+            finally:
+                cursor.close()
+            last_altered = self.last_altered(connector)
+        self.set_last_altered(last_altered)
+        logger.info(f"集計テーブルを更新しました ({len(stale)}/{len(self.specs)}件, {time.perf_counter() - start:.2f}s)")
+        return [spec.name for spec in stale]
+
+    def last_altered(self, connector) -> dict:
+        """元テーブルと集計テーブルの LAST_ALTERED"""
+        names = sorted({spec.table for spec in self.specs.values()} | set(self.tables))
+        cursor = connector.cursor()
+        try:
+            cursor.execute(f"""
+            SELECT TABLE_NAME, LAST_ALTERED FROM INFORMATION_SCHEMA.TABLES
+            WHERE TABLE_SCHEMA = CURRENT_SCHEMA() AND TABLE_NAME IN ({", ".join(f"'{name}'" for name in names)})
+            """)
+            return {str(name).upper(): altered for name, altered in cursor.fetchall()}
+        finally:
+            cursor.close()
+
+    def set_last_altered(self, last_altered: dict) -> None:
+        """LAST_ALTERED から、元テーブルより新しい集計テーブル (書き換えに使ってよいもの) を決める"""
+        fresh = {spec.name for spec in self.specs.values() if _is_fresh(spec, last_altered)}
+        with self._lock:
+            if fresh != self._fresh:
+                logger.info(f"利用できる集計テーブル: {len(fresh)}/{len(self.specs)}件")
+            self._fresh = fresh
+
+    def rewrite(self, normalized_sql: str) -> str | None:
+        """
+        正規化済みの SQL (normalize_sql の結果) が集計テーブルで答えられる形なら、集計テーブルを読む SQL を返す
+        列名は元の SQL の結果と同じになるようにする (別名なしの SUM(X) は "SUM(X)")
+        """
+        sql = normalized_sql
+        cte = _CTE.match(sql)
+        if cte:
+            # Cortex Analyst の「WITH __t AS (SELECT 列 FROM db.schema.t) SELECT ... FROM __t」の形
+            body = _SIMPLE.match(cte.group("body"))
+            if body is None or body.group("table") != cte.group("alias"):
+                return None
+            table = cte.group("table")
+        else:
+            body = _SIMPLE.match(sql)
+            if body is None:
+                return None
+            table = body.group("table")
+
+        qualifier, _, table_name = table.rpartition(".")
+        columns = [column.strip() for column in _split_columns(body.group("columns"))]
+        group = columns[0] if body.group("group") == "1" else body.group("group")
+        spec = self.specs.get((table_name.upper(), group.upper()))
+        if spec is None or columns[0] != group:
+            return None
+        with self._lock:
+            if spec.name not in self._fresh:
+                return None
+
+        measures = {m.expr.lower(): m.name for m in spec.measures}
+        projected = [group]
+        for column in columns[1:]:
+            match = _AGGREGATE.match(column)
+            if match is None:
+                return None
+            expr = f"{match.group(1)}({match.group(2)})"
+            if expr not in measures:
+                return None
+            alias = match.group(3) or f'"{expr.upper()}"'
+            projected.append(f"{measures[expr]} AS {alias}")
+
+        # ORDER BY SUM(X) は集計テーブルの列に置き換える
+        unknown = []
+
+        def order_target(match: re.Match) -> str:
+            expr = f"{match.group(1)}({match.group(2)})"
+            if expr not in measures:
+                unknown.append(expr)
+                return match.group(0)
+            return match.group(0).replace(expr, measures[expr])
+
+        tail = _ORDER_TARGET.sub(order_target, body.group("tail"))
+        if unknown:
+            return None
+        prefix = f"{qualifier}." if qualifier else (f"{self.schema}." if self.schema else "")
+        return f"SELECT {', '.join(projected)} FROM {prefix}{spec.name}{tail}"
+
+
+def _is_fresh(spec: AggregateSpec, last_altered: dict) -> bool:
+    base, aggregate = last_altered.get(spec.table), last_altered.get(spec.name)
+    return base is not None and aggregate is not None and aggregate >= base
+
+
+def _split_columns(text: str) -> list[str]:
+    """括弧の外のカンマで分ける"""
+    columns, depth, current = [], 0, ""
+    for char in text:
+        if char == "," and depth == 0:
+            columns.append(current)
+            current = ""
+            continue
+        depth += {"(": 1, ")": -1}.get(char, 0)
+        current += char
+    columns.append(current)
+    return columns
+
+
+if __name__ == "__main__":
+    from src.analyst.preprocess import Analyst_preprocess
+
+    analyst_preprocess = Analyst_preprocess()
+    try:
+        analyst_preprocess.refresh_aggregates(force=True)
+    finally:
+        analyst_preprocess.close()
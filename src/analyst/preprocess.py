@@ -1,10 +1,17 @@
-import snowflake.connector
 from dotenv import load_dotenv
 import os
+from pathlib import Path
 from logging import getLogger
 import logging
 from langchain_community.document_loaders import PyPDFLoader
 import pandas as pd
+from src.common.pool import ConnectionPool, get_pool, use_role
+from src.common.bulk_load import BulkLoader, dataframe_rows
+from src.common.provision import Reconciler, database_ddl, fingerprint, schema_ddl, warehouse_ddl
+from src.common.schema_cache import get_schema_cache
+from src.analyst.semantic_compiler import compile_semantic_model
+from src.search.ingest import file_hash
+from .aggregates import MaterializedAggregates
 
 logging.basicConfig(
     level=logging.INFO,
@@ -12,28 +19,70 @@ logging.basicConfig(
 )
 logger = getLogger(__name__)
 
+DATA_DIR = "src/analyst/semantic_model/data"
+AOAI_SQL = "ALTER ACCOUNT SET ENABLE_CORTEX_ANALYST_MODEL_AZURE_OPENAI = TRUE"
+
+# ファイルとテーブルの対応
+FILE_TABLE_MAP = {
+    "products.csv": "products",
+    "sales_summary_april.csv": "sales_summary_april",
+    "sales_transactions_april.csv": "sales_transactions_april"
+}
+
+# テーブル定義 (CSVの列順と一致させる)
+TABLE_SCHEMAS = {
+    "products": [
+        ("product_id", "INT"),
+        ("product_name", "STRING"),
+        ("category", "STRING"),
+        ("price", "FLOAT"),
+    ],
+    "sales_summary_april": [
+        ("department", "STRING"),
+        ("total_sales", "FLOAT"),
+        ("month", "STRING"),
+    ],
+    "sales_transactions_april": [
+        ("transaction_id", "INT"),
+        ("date", "DATE"),
+        ("product_id", "INT"),
+        ("quantity", "INT"),
+        ("total_price", "FLOAT"),
+        ("department", "STRING"),
+        ("channel", "STRING"),
+    ],
+}
+
 def load_pdf_document(file_path):
     loader = PyPDFLoader(file_path)
     return loader.load()
 
 
 class Analyst_preprocess:
-    def __init__(self):
+    semantic_model_path = "src/analyst/semantic_model/cortex_analyst_demo.yaml"
+    stage_name = "CORTEX_ANALYST_STAGE" # セマンティックモデルを置くステージ
+
+    def __init__(self, pool: ConnectionPool | None = None):
         load_dotenv(encoding='utf-8',override=True)
 
         self.warehouse = os.getenv('SNOWFLAKE_WAREHOUSE')
         self.database = os.getenv('SNOWFLAKE_DATABASE')
         self.schema = os.getenv('SNOWFLAKE_SCHEMA')
         self.tables = ["products","sales_summary_april","sales_transactions_april"] # Analyst用のテーブル名 複数必要な場合は、テーブル名を変更する
-        self.semantic_model_path = "src/analyst/semantic_model/cortex_analyst_demo.yaml"
 
-        self.connector = snowflake.connector.connect(
-        user=os.getenv('SNOWFLAKE_USER'),
-        password=os.getenv('SNOWFLAKE_PASSWORD'),
-        account=os.getenv('SNOWFLAKE_ACCOUNT'), 
-        warehouse=self.warehouse,
-        database=self.database,
-        schema=self.schema)
+        # 接続はプロセス共有のプールから借り、close() で返却する
+        self.pool = pool or get_pool()
+        self.connector = self.pool.acquire()
+        # 前回から変わった DDL・データ・セマンティックモデルだけを反映する
+        self.reconciler = Reconciler.from_env(self.database, self.schema)
+        # テーブル・列・ステージの有無は1回の問い合わせでまとめて取得し、キャッシュから答える
+        self.schema_cache = get_schema_cache(self.database, self.schema)
+
+    def close(self) -> None:
+        """借りている接続をプールに返却する"""
+        if self.connector is not None:
+            self.pool.release(self.connector)
+            self.connector = None
 
     def test_connection(self):
         try:
@@ -46,57 +95,86 @@ class Analyst_preprocess:
             logger.error(f"Failed to connect to Snowflake: {e}")
 
     def table_exists(self) -> bool:
-        """テーブルが既に存在するか確認する"""
-        cursor = self.connector.cursor()
-
+        """すべてのテーブルが TABLE_SCHEMAS の列を持って存在するか確認する (スキーマ情報のキャッシュから答える)"""
+        snapshot = self.schema_cache.get(self.connector)
+        exists = True
         for table in self.tables:
-            try:
-                check_query = f"""
-                SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES 
-                WHERE TABLE_SCHEMA = '{self.schema.upper()}' 
-                AND TABLE_NAME = '{table.upper()}'
-                """
-                cursor.execute(check_query)
-                exists = cursor.fetchone()[0] > 0
-                if not exists:
-                    logger.info(f"テーブル {table} は存在しません。")
-                    return False
-            except Exception as e:
-                logger.error(f"テーブル存在確認でエラー: {e}")
-                return False
-            else:
-                logger.info(f"テーブル {table} は存在します。")
-                return True
-
-    def run(self) -> None:
-        """Cortex Analystを使用する環境を構築"""
-        if not self.table_exists():
+            if not snapshot.table_exists(table):
+                logger.info(f"テーブル {table} は存在しません。")
+                exists = False
+                continue
+            missing = snapshot.missing_columns(table, [name for name, _ in TABLE_SCHEMAS[table]])
+            if missing:
+                logger.info(f"テーブル {table} に列 {', '.join(missing)} がありません。")
+                exists = False
+        return exists
+
+    def run(self, force: bool = False) -> None:
+        """
+        Cortex Analystを使用する環境を構築
+        DDL・データ・セマンティックモデルは前回の適用から変わったものだけを反映する (force=True の場合はすべて)
+        """
+        exists = self.table_exists()
+        if force:
+            # アカウント設定 (bootstrap のクロスリージョン推論を含む) もやり直す
+            self.reconciler.forget("database", "warehouse", "schema", "analyst.", "account.")
+        elif not exists:
             logger.info("テーブルは存在しません。")
-            self.create_db()
-            self.create_wh()
-            self.create_schema()
-            self.create_table()
-            self.insert_data()
+            self.reconciler.forget("database", "schema", "analyst.")
+        if not self.schema_cache.get(self.connector).stage_exists(self.stage_name):
+            # 記録があってもステージがなければ作り直す
+            self.reconciler.forget("analyst.stage", "analyst.semantic_model")
+
+        # テーブルがあれば、記録のないデータベース等は既にあるものとして作り直さない
+        adopt = exists and not force
+        self.reconciler.ensure("database", fingerprint(database_ddl(self.database)), self.create_db, adopt=adopt)
+        self.reconciler.ensure("warehouse", fingerprint(warehouse_ddl(self.warehouse)), self.create_wh, adopt=adopt)
+        self.reconciler.ensure("schema", fingerprint(schema_ddl(self.schema)), self.create_schema, adopt=adopt)
+        # テーブル定義かCSVが変わったらロードし直す
+        self.reconciler.ensure("analyst.tables", self.data_fingerprint(), self.load_tables, adopt=adopt)
 
-        self.enable_aoai()
-        self.create_stage()
-        # self.upload_file(self.semantic_model_path)
+        if self.reconciler.applied:
+            self.schema_cache.invalidate()
+        snapshot = self.schema_cache.get(self.connector)
+        # スキーマ情報を取得できなかった場合 (fetched_at が 0) は集計側で問い合わせ直す
+        self.refresh_aggregates(last_altered=snapshot.last_altered() if snapshot.fetched_at else None)
+        # 置く前にセマンティックモデルがテーブル・列と合っているか確かめる (食い違いはログに出す)
+        compile_semantic_model(self.semantic_model_path, snapshot)
+        self.reconciler.ensure("account.analyst_azure_openai", fingerprint(AOAI_SQL), self.enable_aoai)
+        if self.reconciler.ensure("analyst.stage", fingerprint(self.stage_ddl()), self.create_stage):
+            # ステージを作り直すとファイルが消えるので、セマンティックモデルも置き直す
+            self.reconciler.forget("analyst.semantic_model")
+        self.reconciler.ensure("analyst.semantic_model", self.semantic_model_fingerprint(),
+                               lambda: self.upload_file(self.semantic_model_path))
 
-        logger.info("Cortex Analyst Preprocessが完了しました")
+        if self.reconciler.applied:
+            self.schema_cache.invalidate()
+        logger.info(f"Cortex Analyst Preprocessが完了しました (DDL: {self.reconciler.summary()})")
         return None
+
+    def data_fingerprint(self) -> str:
+        """テーブル定義とCSVの内容のフィンガープリント"""
+        return fingerprint(TABLE_SCHEMAS, {file: file_hash(Path(DATA_DIR) / file) for file in FILE_TABLE_MAP})
+
+    def semantic_model_fingerprint(self) -> str:
+        return fingerprint(self.stage_name, file_hash(Path(self.semantic_model_path)))
+
+    def load_tables(self) -> None:
+        """テーブルを作り直してCSVをロードする"""
+        self.create_table()
+        self.insert_data()
     
     def enable_aoai(self) -> None:
         """Azure OpenAIを有効化する"""
-        cursor = self.connector.cursor()
-        cursor.execute("USE ROLE ACCOUNTADMIN")
-        cursor.execute("ALTER ACCOUNT SET ENABLE_CORTEX_ANALYST_MODEL_AZURE_OPENAI = TRUE")
-        self.connector.commit()
-        cursor.close()
+        # 接続はプールに戻るので、ACCOUNTADMIN は実行中だけ使う
+        with use_role(self.connector, "ACCOUNTADMIN") as cursor:
+            cursor.execute(AOAI_SQL)
+            self.connector.commit()
         logger.info(f"Azure OpenAIを有効化しました")
 
     def create_db(self) -> None:
         """データベースを作成する"""
-        query = f"""CREATE DATABASE IF NOT EXISTS {self.database}"""
+        query = database_ddl(self.database)
         self.connector.cursor().execute(query)
         self.connector.commit()  
         self.connector.cursor().close()
@@ -104,7 +182,7 @@ class Analyst_preprocess:
     
     def create_schema(self) -> None:
         """スキーマを作成する"""
-        query = f"""CREATE SCHEMA IF NOT EXISTS {self.schema}"""
+        query = schema_ddl(self.schema)
         cursor = self.connector.cursor()
         cursor.execute(query)
         self.connector.commit()
@@ -113,11 +191,7 @@ class Analyst_preprocess:
     
     def create_wh(self) -> None:
         """ウェアハウスを作成する"""
-        query = f"""CREATE OR REPLACE WAREHOUSE {self.warehouse} WITH
-            WAREHOUSE_SIZE='X-SMALL'
-            AUTO_SUSPEND = 120
-            AUTO_RESUME = TRUE
-            INITIALLY_SUSPENDED=TRUE"""
+        query = warehouse_ddl(self.warehouse)
         self.connector.cursor().execute(query)
         self.connector.commit()  
         self.connector.cursor().close()
@@ -129,71 +203,31 @@ class Analyst_preprocess:
         cursor = self.connector.cursor()
         for table in self.tables:
             cursor.execute(f"DROP TABLE IF EXISTS {table}")
-            if table == "products":
-                cursor.execute(f"""
-                CREATE TABLE {table} (
-                    product_id INT,
-                    product_name STRING,
-                    category STRING,
-                    price FLOAT
-                )
-                """)
-            elif table == "sales_summary_april":
-                cursor.execute(f"""
-                CREATE TABLE {table} (
-                    department STRING,
-                    total_sales FLOAT,
-                    month STRING
-                )
-                """)
-            elif table == "sales_transactions_april":
-                cursor.execute(f"""
-                CREATE TABLE {table} (
-                    transaction_id INT,
-                    date DATE,
-                    product_id INT,
-                    quantity INT,
-                    total_price FLOAT,
-                    department STRING,
-                    channel STRING
-                )
-                """)
+            columns = ",\n".join(f"    {name} {dtype}" for name, dtype in TABLE_SCHEMAS[table])
+            cursor.execute(f"CREATE TABLE {table} (\n{columns}\n)")
         self.connector.commit()
         cursor.close()
         logger.info("すべてのテーブルを作成しました。")
 
-    def insert_data(self) -> None:
-        """データをテーブルに挿入する"""
-
-        cursor = self.connector.cursor()
-
-        # ファイルとテーブルの対応
-        file_table_map = {
-            "products.csv": "products",
-            "sales_summary_april.csv": "sales_summary_april",
-            "sales_transactions_april.csv": "sales_transactions_april"
-        }
+    def insert_data(self, mode: str = "batch", batch_size: int = 10000, chunksize: int | None = None) -> None:
+        """
+        データをテーブルに挿入する
+        mode="batch" はバッチ単位のマルチロウINSERT、mode="stage" はCSV + PUT + COPY INTO
+        chunksize を指定するとCSVを分割して読み込み、一定のメモリでロードする
+        """
+        loader = BulkLoader(self.connector, batch_size=batch_size)
 
         try:
-            for file, table in file_table_map.items():
+            for file, table in FILE_TABLE_MAP.items():
                 logger.info(f"{file} を読み込み、テーブル {table} に挿入します。")
 
-                # CSV読み込み
-                df = pd.read_csv(f"src/analyst/semantic_model/data/{file}",encoding='utf-8',header=0)
-
+                frames = pd.read_csv(f"{DATA_DIR}/{file}", encoding='utf-8', header=0, chunksize=chunksize)
+                columns = [name for name, _ in TABLE_SCHEMAS[table]]
+                date_columns = [name for name, dtype in TABLE_SCHEMAS[table] if dtype == "DATE"]
+                rows = dataframe_rows(frames, columns=columns, date_columns=date_columns)
 
-                # SQLの構築
-                columns = ', '.join(df.columns)
-                placeholders = ', '.join(['%s'] * len(df.columns))
-                insert_sql = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
-
-                # データ挿入
-                for _, row in df.iterrows():
-                    # DATE型の処理が必要な場合、ここで文字列をdatetimeに変換して対応
-                    values = tuple(row)
-                    cursor.execute(insert_sql, values)
-
-                logger.info(f"{file} の {len(df)} 行をテーブル {table} に挿入しました。")
+                stats = loader.load(table, columns, rows, mode=mode)
+                logger.info(f"{file} の {stats.rows} 行をテーブル {table} に挿入しました。")
 
             self.connector.commit()
             logger.info("すべてのデータ挿入が完了しました。")
@@ -201,15 +235,20 @@ class Analyst_preprocess:
         except Exception as e:
             logger.error(f"エラー発生: {e}")
             self.connector.rollback()
+            raise
 
-        finally:
-            cursor.close()
+    def refresh_aggregates(self, force: bool = False, last_altered: dict | None = None) -> list[str]:
+        """セマンティックモデルの集計 (部署別・チャネル別・商品別・日付別の合計など) を集計テーブルとして作成・更新する"""
+        try:
+            aggregates = MaterializedAggregates.from_semantic_model(self.semantic_model_path)
+            return aggregates.refresh(self.connector, force=force, last_altered=last_altered)
+        except Exception as e:
+            logger.warning(f"集計テーブルを更新できませんでした: {e}")
+            self.connector.rollback()
+            return []
 
-    def create_stage(self) -> None:
-        """ステージを作成する"""
-        cursor = self.connector.cursor()
-        self.stage_name = "CORTEX_ANALYST_STAGE"
-        query = f"""
+    def stage_ddl(self) -> str:
+        return f"""
         CREATE OR REPLACE STAGE {self.stage_name}
         FILE_FORMAT = (
             TYPE = CSV
@@ -217,17 +256,24 @@ class Analyst_preprocess:
             SKIP_HEADER = 1
         ) DIRECTORY=(ENABLE=TRUE);
         """
-        cursor.execute(query)
+
+    def create_stage(self) -> None:
+        """ステージを作成する (作り直すとステージ上のファイルは消える)"""
+        cursor = self.connector.cursor()
+        cursor.execute(self.stage_ddl())
         self.connector.commit()
         cursor.close()
         logger.info(f"ステージ {self.stage_name} を作成しました")
 
     def upload_file(self, file_path: str) -> None:
-        """ファイルをステージにアップロードする"""
-        # ! snowflake-cli系でput コマンドを実行する
-        # ! あるいはsemantic model generatorを使う
-        # ! あるいはsnowsightから直接アップロード
-        return None
+        """ファイルをステージにアップロードする (Cortex Analyst が読めるよう圧縮せず、同名のファイルは上書きする)"""
+        path = Path(file_path).resolve().as_posix()
+        cursor = self.connector.cursor()
+        try:
+            cursor.execute(f"PUT 'file://{path}' @{self.stage_name} AUTO_COMPRESS=FALSE OVERWRITE=TRUE")
+        finally:
+            cursor.close()
+        logger.info(f"{Path(file_path).name} をステージ {self.stage_name} にアップロードしました")
 
 if __name__ == "__main__":
     logger.info("Analyst Preprocessを開始...")
@@ -0,0 +1,403 @@
+"""
+セマンティックモデル (cortex_analyst_demo.yaml) のローカルコンパイラと、単純な質問のルーター
+- compile_semantic_model() は YAML を1回だけ読み、スキーマ情報 (SchemaSnapshot) と突き合わせて検証する
+  (テーブル・列が実在するか、データ型の種類が合うか、シノニム・サンプル値が複数の列に当たらないか)
+- 検証を通った列から「語 (テーブル名・列名・シノニム) → テーブル / 列」と「サンプル値 → ディメンション」の索引を作る
+- LookupRouter は「部署はいくつ？」「チャネルの一覧」「スマート照明の価格は？」のような単純な質問を
+  パラメータ付きの SQL テンプレートに当てはめ、Cortex Analyst (LLM) を呼ばずに実行する
+  当てはまらない・語が曖昧・実行に失敗した質問はそのまま Cortex Analyst に回す
+python -m src.analyst.semantic_compiler で検証結果と索引を表示する
+"""
+import functools
+import re
+from logging import getLogger
+
+import yaml
+from pydantic import BaseModel, Field
+
+from src.agent.tool_cache import _invoke
+from src.common.provision import fingerprint
+from src.common.schema_cache import SchemaSnapshot
+
+logger = getLogger(__name__)
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_$]*$")
+# Snowflake のデータ型の種類 (名前の先頭で判定する)
+_TYPE_FAMILIES = [
+    (("VARCHAR", "CHAR", "STRING", "TEXT"), "text"),
+    (("NUMBER", "DECIMAL", "NUMERIC", "INT", "BIGINT", "SMALLINT", "FLOAT", "DOUBLE", "REAL"), "number"),
+    (("TIMESTAMP", "DATETIME", "DATE", "TIME"), "time"),
+    (("BOOLEAN",), "boolean"),
+]
+
+
+class SemanticColumn(BaseModel):
+    table: str = Field(description="論理テーブル名 (tables[].name)")
+    name: str
+    expr: str
+    kind: str = Field(description="dimension / time_dimension / fact")
+    data_type: str | None = None
+    synonyms: list[str] = Field(default_factory=list)
+    sample_values: list[str] = Field(default_factory=list)
+
+
+class SemanticTable(BaseModel):
+    name: str
+    base_table: str = Field(description="DATABASE.SCHEMA.TABLE")
+    synonyms: list[str] = Field(default_factory=list)
+    columns: dict[str, SemanticColumn] = Field(default_factory=dict)
+
+    @property
+    def is_entity(self) -> bool:
+        """1行が1つのもの (最初のファクトが自身の *_ID で、時間ディメンションがない) を表すテーブルか"""
+        facts = [c for c in self.columns.values() if c.kind == "fact"]
+        times = [c for c in self.columns.values() if c.kind == "time_dimension"]
+        return bool(facts) and facts[0].name.endswith("_ID") and not times
+
+
+class TermRef(BaseModel):
+    table: str
+    column: str | None = None # None はテーブル自体
+    exact: bool = Field(default=False, description="シノニムではなく名前そのものか")
+
+
+class ModelIssue(BaseModel):
+    level: str # error / warning
+    target: str # TABLE または TABLE.COLUMN
+    message: str
+
+
+class CompiledSemanticModel(BaseModel):
+    name: str
+    fingerprint: str
+    tables: dict[str, SemanticTable] = Field(default_factory=dict)
+    terms: dict[str, list[TermRef]] = Field(default_factory=dict, description="正規化した語 → テーブル / 列")
+    values: dict[str, list[TermRef]] = Field(default_factory=dict, description="サンプル値 → ディメンション")
+    issues: list[ModelIssue] = Field(default_factory=list)
+    validated: bool = Field(default=False, description="スキーマ情報と突き合わせたか")
+
+    @property
+    def errors(self) -> list[ModelIssue]:
+        return [issue for issue in self.issues if issue.level == "error"]
+
+    def column(self, ref: TermRef) -> SemanticColumn:
+        return self.tables[ref.table].columns[ref.column]
+
+    def resolve(self, term: str) -> list[TermRef]:
+        """語に当たるテーブル / 列 (名前そのものに当たるものがあればそれだけ)。英語の複数形は単数形でも引く"""
+        for candidate in _singulars(_term(term)):
+            refs = self.terms.get(candidate)
+            if refs:
+                exact = [ref for ref in refs if ref.exact]
+                return exact or refs
+        return []
+
+
+def compile_semantic_model(path: str, snapshot: SchemaSnapshot | None = None) -> CompiledSemanticModel:
+    """
+    セマンティックモデルを読み、検証して索引を作る
+    snapshot がない (または取得できなかった) 場合はテーブル・列の実在は確かめない
+    エラーのあるテーブル・列は索引に入れない (Cortex Analyst にはそのまま渡る)
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    raw = yaml.safe_load(text) or {}
+    validated = snapshot is not None and bool(snapshot.fetched_at)
+    model = CompiledSemanticModel(name=raw.get("name", ""), fingerprint=fingerprint(text), validated=validated)
+
+    def issue(level: str, target: str, message: str) -> None:
+        model.issues.append(ModelIssue(level=level, target=target, message=message))
+
+    if not validated:
+        issue("warning", model.name, "スキーマ情報がないため、テーブル・列の実在は確かめていません")
+
+    for raw_table in raw.get("tables", []):
+        name = str(raw_table.get("name") or "").upper()
+        base = raw_table.get("base_table") or {}
+        if not name or not base.get("table"):
+            issue("error", name or "?", "name と base_table.table は必須です")
+            continue
+        table = SemanticTable(
+            name=name,
+            base_table=".".join(str(base[key]) for key in ("database", "schema", "table") if base.get(key)).upper(),
+            synonyms=[str(s) for s in raw_table.get("synonyms", [])])
+        physical = str(base["table"])
+        check = validated
+        if check and base.get("schema") and str(base["schema"]).upper() != snapshot.schema_name:
+            issue("warning", name, f"スキーマ {base['schema']} は接続先 ({snapshot.schema_name}) と異なるため確かめていません")
+            check = False
+        if check and not snapshot.table_exists(physical):
+            issue("error", name, f"テーブル {physical} がありません")
+            continue
+        existing = snapshot.columns(physical) if check else {}
+
+        for kind, key in (("dimension", "dimensions"), ("time_dimension", "time_dimensions"), ("fact", "facts")):
+            for raw_column in raw_table.get(key, []):
+                column_name = str(raw_column.get("name") or "").upper()
+                target = f"{name}.{column_name or '?'}"
+                expr = str(raw_column.get("expr") or "")
+                if not column_name or not expr:
+                    issue("error", target, "name と expr は必須です")
+                    continue
+                if column_name in table.columns:
+                    issue("warning", target, "同じ名前の列が重複しています。最初のものを使います")
+                    continue
+                if not _IDENTIFIER.match(expr):
+                    # 式の列は Cortex Analyst に任せ、テンプレートでは使わない
+                    continue
+                if check:
+                    if expr.upper() not in existing:
+                        issue("error", target, f"列 {physical}.{expr} がありません")
+                        continue
+                    declared, actual = _type_family(raw_column.get("data_type")), _type_family(existing[expr.upper()])
+                    if declared and actual and declared != actual:
+                        issue("warning", target,
+                              f"データ型 {raw_column.get('data_type')} が実際の型 {existing[expr.upper()]} と合いません")
+                table.columns[column_name] = SemanticColumn(
+                    table=name, name=column_name, expr=expr.upper(), kind=kind, data_type=raw_column.get("data_type"),
+                    synonyms=[str(s) for s in raw_column.get("synonyms", [])],
+                    sample_values=[str(v) for v in raw_column.get("sample_values", [])])
+        model.tables[name] = table
+
+    _build_indexes(model)
+    for item in model.issues:
+        (logger.warning if item.level == "error" else logger.info)(f"セマンティックモデル {item.target}: {item.message}")
+    logger.info(f"セマンティックモデル {model.name} をコンパイルしました (テーブル {len(model.tables)}件, "
+                f"語 {len(model.terms)}件, サンプル値 {len(model.values)}件, エラー {len(model.errors)}件)")
+    return model
+
+
+def _build_indexes(model: CompiledSemanticModel) -> None:
+    def add(index: dict, key: str, ref: TermRef) -> None:
+        refs = index.setdefault(key, [])
+        if not any(r.table == ref.table and r.column == ref.column for r in refs):
+            refs.append(ref)
+
+    for table in model.tables.values():
+        add(model.terms, _term(table.name), TermRef(table=table.name, exact=True))
+        for synonym in table.synonyms:
+            add(model.terms, _term(synonym), TermRef(table=table.name))
+        for column in table.columns.values():
+            add(model.terms, _term(column.name), TermRef(table=table.name, column=column.name, exact=True))
+            for synonym in column.synonyms:
+                add(model.terms, _term(synonym), TermRef(table=table.name, column=column.name))
+            if column.kind != "fact":
+                for value in column.sample_values:
+                    add(model.values, value, TermRef(table=table.name, column=column.name))
+
+    # 名前の違う列に当たるシノニム・サンプル値は曖昧なので、ルーターは使わない
+    for index, label in ((model.terms, "語"), (model.values, "サンプル値")):
+        for key, refs in index.items():
+            candidates = [ref for ref in refs if ref.exact] or refs
+            if len({(ref.column or ref.table) for ref in candidates}) > 1:
+                targets = ", ".join(f"{ref.table}.{ref.column}" if ref.column else ref.table for ref in candidates)
+                model.issues.append(ModelIssue(level="warning", target=model.name,
+                                               message=f"{label} '{key}' は複数に当たります ({targets})"))
+
+
+def _term(text: str) -> str:
+    return " ".join(re.sub(r"[_\-]", " ", text.lower()).split())
+
+
+def _singulars(term: str) -> list[str]:
+    candidates = [term]
+    if term.isascii():
+        if term.endswith("ies"):
+            candidates.append(term[:-3] + "y")
+        if term.endswith("es"):
+            candidates.append(term[:-2])
+        if term.endswith("s"):
+            candidates.append(term[:-1])
+    return candidates
+
+
+def _select(column: SemanticColumn) -> str:
+    return column.expr if column.expr == column.name else f"{column.expr} AS {column.name}"
+
+
+def _type_family(data_type) -> str | None:
+    name = str(data_type or "").upper()
+    return next((family for prefixes, family in _TYPE_FAMILIES if name.startswith(prefixes)), None)
+
+
+# 質問の形 → 意図。term は語 (テーブル / 列)、value はサンプル値
+_PATTERNS = [
+    ("count", re.compile(r"^(?:how many|number of|count(?: of)?)\s+(?:the\s+)?(?:different\s+|distinct\s+|unique\s+)?"
+                         r"(?P<term>[\w ]+?)(?:\s+(?:are there|exist|do we have|there are))?$", re.IGNORECASE)),
+    ("count", re.compile(r"^(?P<term>.+?)(?:の(?:数|種類数?)は?|は)(?:全部で)?(?:いくつ|何種類|何個|何件)"
+                         r"(?:ありますか|ある|ですか)?$")),
+    ("count", re.compile(r"^(?P<term>.+?)の(?:数|種類数)(?:は|を教えて(?:ください)?)?$")),
+    ("list", re.compile(r"^(?:list|show(?: me)?|what are)(?:\s+all)?(?:\s+the)?\s+(?:different\s+|distinct\s+|unique\s+)?"
+                        r"(?P<term>[\w ]+?)(?:\s+(?:are there|values))?$", re.IGNORECASE)),
+    ("list", re.compile(r"^which\s+(?P<term>[\w ]+?)\s+(?:are there|exist)$", re.IGNORECASE)),
+    ("list", re.compile(r"^(?P<term>.+?)の(?:一覧|リスト)(?:を(?:教えて|見せて|表示して)(?:ください)?)?$")),
+    ("list", re.compile(r"^(?:どんな|どの)(?P<term>.+?)が(?:ありますか|ある)$")),
+    ("lookup", re.compile(r"^(?:what is|what's)?\s*(?:the\s+)?(?P<term>[\w ]+?)\s+(?:of|for)\s+(?P<value>.+)$",
+                          re.IGNORECASE)),
+    ("lookup", re.compile(r"^(?P<value>.+?)の(?P<term>[^の]+?)(?:は(?:いくら|何)?(?:ですか)?|を教えて(?:ください)?)?$")),
+]
+# CortexAnalystTool が max_results を指定したときに質問の末尾に足す文
+_MAX_RESULTS_SUFFIX = re.compile(r"\s*Only return up to (\d+) relevant records in the final results\.\s*$")
+_TRAILING = re.compile(r"[\s?？。.!！]+$")
+
+
+class Route:
+    __slots__ = ("intent", "sql", "params", "tables")
+
+    def __init__(self, intent: str, sql: str, params: tuple, tables: list[str]):
+        self.intent = intent
+        self.sql = sql
+        self.params = params
+        self.tables = tables
+
+
+class RouterMetrics(BaseModel):
+    routed: int = 0 # テンプレートの SQL で答えた回数
+    unrouted: int = 0 # Cortex Analyst に回した回数
+    fallbacks: int = Field(default=0, description="テンプレートの SQL が失敗・空で Cortex Analyst に回した回数")
+    intents: dict[str, int] = Field(default_factory=dict, description="意図 (count / list / lookup) ごとの回数")
+
+
+class LookupRouter:
+    def __init__(self, model: CompiledSemanticModel, max_rows: int = 100):
+        self.model = model
+        self.max_rows = max_rows
+        self._metrics = RouterMetrics()
+
+    def route(self, question: str) -> Route | None:
+        """質問がテンプレートに当てはまれば SQL とパラメータを返す (当てはまらない・曖昧なら None)"""
+        suffix = _MAX_RESULTS_SUFFIX.search(question)
+        limit = min(int(suffix.group(1)), self.max_rows) if suffix else self.max_rows
+        text = _TRAILING.sub("", _MAX_RESULTS_SUFFIX.sub("", question.strip()))
+        for intent, pattern in _PATTERNS:
+            match = pattern.match(text)
+            if match is None:
+                continue
+            if intent == "lookup":
+                route = self._lookup(match.group("term"), match.group("value").strip(), limit)
+            else:
+                route = self._distinct(intent, match.group("term"), limit)
+            if route is not None:
+                return route
+        return None
+
+    def _distinct(self, intent: str, term: str, limit: int) -> Route | None:
+        """count: 件数 (1行が1つのものを表すテーブル) / 値の種類数 (ディメンション)、list: ディメンションの値の一覧"""
+        refs = self.model.resolve(term)
+        if not refs:
+            return None
+        if all(ref.column is None for ref in refs):
+            if intent != "count" or len(refs) != 1:
+                return None
+            table = self.model.tables[refs[0].table]
+            if not table.is_entity:
+                # 取引・日次集計などの行数は聞かれた件数 (取引の件数・売上の回数など) と一致しないので Cortex Analyst に任せる
+                return None
+            return Route(intent, f"SELECT COUNT(*) AS ROW_COUNT FROM {table.base_table}", (), [table.base_table])
+
+        # 同じ名前の列が複数のテーブルにある場合 (部署など) は、それぞれの値を合わせる
+        columns = [self.model.column(ref) for ref in refs if ref.column is not None]
+        if len(columns) != len(refs) or len({c.name for c in columns}) != 1 or columns[0].kind == "fact":
+            return None
+        name = columns[0].name
+        tables = [self.model.tables[c.table].base_table for c in columns]
+        source = " UNION ".join(f"SELECT {_select(c)} FROM {self.model.tables[c.table].base_table}" for c in columns)
+        if intent == "count":
+            if len(columns) == 1:
+                return Route(intent, f"SELECT COUNT(DISTINCT {columns[0].expr}) AS {name}_COUNT FROM {tables[0]}", (), tables)
+            return Route(intent, f"SELECT COUNT(DISTINCT {name}) AS {name}_COUNT FROM ({source})", (), tables)
+        if len(columns) == 1:
+            sql = f"SELECT DISTINCT {_select(columns[0])} FROM {tables[0]} ORDER BY {name} LIMIT {limit}"
+        else:
+            sql = f"SELECT {name} FROM ({source}) ORDER BY {name} LIMIT {limit}"
+        return Route(intent, sql, (), tables)
+
+    def _lookup(self, term: str, value: str, limit: int) -> Route | None:
+        """サンプル値で絞り込んだ行の列の値 (ファクトは1行が1つのものを表すテーブルに限る)"""
+        keys = self.model.values.get(value, [])
+        targets = [ref for ref in self.model.resolve(term) if ref.column is not None]
+        matches = [(key, target) for key in keys for target in targets
+                   if key.table == target.table and key.column != target.column]
+        if len(matches) != 1:
+            return None
+        key, target = (self.model.column(ref) for ref in matches[0])
+        table = self.model.tables[key.table]
+        if target.kind == "fact" and not table.is_entity:
+            # 取引などの明細のファクトは合計などの集計が要るので Cortex Analyst に任せる
+            return None
+        sql = (f"SELECT DISTINCT {_select(key)}, {_select(target)} FROM {table.base_table} "
+               f"WHERE {key.expr} = %s ORDER BY {target.name} LIMIT {limit}")
+        return Route("lookup", sql, (value,), [table.base_table])
+
+    def wrap(self, tool):
+        """
+        CortexAnalystTool の func の前段に置く (ToolScheduler より内側に置き、ワーカースレッドで動かす)
+        SQL は tool.connection で実行するので、結果キャッシュ・SQL のスパンもそのまま効く
+        返り値は CortexAnalystTool と同じ {"output": "...", "sources": {...}} の形
+        """
+        func = tool.func
+
+        @functools.wraps(func)
+        async def routed(*args, **kwargs):
+            question = str(kwargs.get("query", args[0] if args else ""))
+            route = self.route(question)
+            if route is None:
+                self._metrics.unrouted += 1
+                return await _invoke(func, *args, **kwargs)
+            try:
+                cursor = tool.connection.cursor()
+                # パラメータのない count / list は SQL だけを渡す
+                table = (cursor.execute(route.sql, route.params) if route.params else cursor.execute(route.sql)).fetch_arrow_all()
+            except Exception as e:
+                logger.warning(f"テンプレートの SQL に失敗しました。Cortex Analyst に回します: {e}")
+                table = None
+            if not table:
+                self._metrics.fallbacks += 1
+                return await _invoke(func, *args, **kwargs)
+            self._metrics.routed += 1
+            self._metrics.intents[route.intent] = self._metrics.intents.get(route.intent, 0) + 1
+            logger.info(f"Cortex Analyst を呼ばずにテンプレートで答えました ({route.intent}): {route.sql}")
+            return {
+                "output": str(table.to_pydict()),
+                "sources": {
+                    "tool_type": "cortex_analyst",
+                    "tool_name": tool.name,
+                    "metadata": [{"Table": name} for name in route.tables],
+                },
+            }
+
+        tool.func = routed
+        return tool
+
+    def metrics(self) -> RouterMetrics:
+        return self._metrics.model_copy(deep=True)
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    from dotenv import load_dotenv
+
+    from src.analyst.preprocess import Analyst_preprocess
+    from src.common.pool import get_pool
+    from src.common.schema_cache import get_schema_cache
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("questions", nargs="*", help="ルーティングを試す質問")
+    args = parser.parse_args()
+
+    load_dotenv(encoding="utf-8", override=True)
+    pool = get_pool()
+    connector = pool.acquire()
+    try:
+        snapshot = get_schema_cache(os.getenv("SNOWFLAKE_DATABASE"), os.getenv("SNOWFLAKE_SCHEMA")).get(connector)
+    finally:
+        pool.release(connector)
+    compiled = compile_semantic_model(Analyst_preprocess.semantic_model_path, snapshot)
+    for item in compiled.issues:
+        print(f"[{item.level}] {item.target}: {item.message}")
+    router = LookupRouter(compiled)
+    for question in args.questions:
+        route = router.route(question)
+        print(f"{question} -> {f'{route.intent}: {route.sql} {route.params}' if route else 'Cortex Analyst'}")
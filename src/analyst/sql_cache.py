@@ -0,0 +1,189 @@
+"""
+Cortex Analyst が生成した SQL の結果キャッシュ
+- キーは正規化した SQL (コメント・空白・大文字小文字の違いを吸収) + バインドパラメータ + データバージョン (テーブルの LAST_ALTERED とセマンティックモデルのハッシュ)
+- CortexAnalystTool は self.connection.cursor().execute(sql).fetch_arrow_all() で SQL を実行するので、
+  wrap() で tool.connection をキャッシュ付きの接続に差し替える
+- キャッシュにない集計 SQL は、集計テーブル (MaterializedAggregates) で答えられる形なら書き換えて実行する
+- ヒット時は、その SQL を最初に実行したときの所要時間をウェアハウス秒の節約として数える
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from logging import getLogger
+
+from pydantic import BaseModel, Field
+
+from .aggregates import MaterializedAggregates
+
+logger = getLogger(__name__)
+
+_LINE_COMMENT = re.compile(r"--[^\n]*")
+_BLOCK_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+_QUOTED = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+_WHITESPACE = re.compile(r"\s+")
+_INNER_PAREN_SPACE = re.compile(r"(?<=\()\s+|\s+(?=\))")
+_COMMA_SPACE = re.compile(r"\s*,\s*")
+
+
+def normalize_sql(sql: str) -> str:
+    """コメント・余分な空白・末尾の ; を除き、引用符の外を小文字にする (文字列リテラルと引用識別子はそのまま)"""
+    parts = _QUOTED.split(sql)
+    normalized = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            normalized.append(part)
+            continue
+        part = _WHITESPACE.sub(" ", _BLOCK_COMMENT.sub(" ", _LINE_COMMENT.sub(" ", part)).lower())
+        normalized.append(_COMMA_SPACE.sub(", ", _INNER_PAREN_SPACE.sub("", part)))
+    return "".join(normalized).strip().rstrip(";").strip()
+
+
+class SqlCacheMetrics(BaseModel):
+    size: int = 0
+    hits: int = 0
+    misses: int = 0
+    rewrites: int = Field(default=0, description="集計テーブルに書き換えて実行した回数")
+    executions: int = Field(default=0, description="ウェアハウスで実行した回数")
+    warehouse_seconds: float = Field(default=0.0, description="ウェアハウスでの実行時間の合計")
+    warehouse_seconds_saved: float = Field(default=0.0, description="キャッシュヒットで省いた実行時間の合計")
+    invalidations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class _Entry:
+    __slots__ = ("table", "seconds", "created")
+
+    def __init__(self, table, seconds: float, created: float):
+        self.table = table
+        self.seconds = seconds
+        self.created = created
+
+
+class AnalystSqlCache:
+    def __init__(self, max_entries: int = 256, ttl: float = 3600.0,
+                 aggregates: MaterializedAggregates | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.aggregates = aggregates
+        self.version = ""
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._metrics = SqlCacheMetrics()
+        self._lock = threading.Lock()
+
+    def wrap(self, tool):
+        """CortexAnalystTool の SQL 実行をキャッシュ経由にする"""
+        tool.connection = CachingConnection(tool.connection, self)
+        return tool
+
+    def set_version(self, version: str) -> bool:
+        """データのバージョンを設定する。変わっていれば全件破棄して True を返す"""
+        with self._lock:
+            if version == self.version:
+                return False
+            changed = bool(self.version)
+            self.version = version
+            if changed:
+                self._entries.clear()
+                self._metrics.invalidations += 1
+        if changed:
+            logger.info("データが更新されたため、SQL結果キャッシュを破棄しました")
+        return changed
+
+    def key(self, normalized: str) -> str:
+        return hashlib.sha256(f"{self.version}\x1f{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, normalized: str):
+        key = self.key(normalized)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry.created > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self._metrics.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._metrics.hits += 1
+            self._metrics.warehouse_seconds_saved += entry.seconds
+            return entry.table
+
+    def put(self, normalized: str, table, seconds: float) -> None:
+        key = self.key(normalized)
+        with self._lock:
+            self._entries[key] = _Entry(table, seconds, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def execute(self, cursor, sql: str, params=None):
+        """
+        SELECT はキャッシュ → 集計テーブルへの書き換え → ウェアハウス の順に試し、Arrow テーブルを返す
+        params (バインドパラメータ) がある SQL はパラメータごとにキャッシュし、集計テーブルへは書き換えない
+        """
+        normalized = normalize_sql(sql)
+        key = f"{normalized}\x1f{json.dumps(params, ensure_ascii=False, sort_keys=True, default=str)}" if params else normalized
+        table = self.get(key)
+        if table is not None:
+            return table
+
+        rewritten = self.aggregates.rewrite(normalized) if self.aggregates is not None and not params else None
+        start = time.perf_counter()
+        table = (cursor.execute(sql, params) if params else cursor.execute(rewritten or sql)).fetch_arrow_all()
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self._metrics.executions += 1
+            self._metrics.warehouse_seconds += seconds
+            if rewritten:
+                self._metrics.rewrites += 1
+        if rewritten:
+            logger.info(f"集計テーブルで実行しました: {rewritten}")
+        if table is not None:
+            self.put(key, table, seconds)
+        return table
+
+    def metrics(self) -> SqlCacheMetrics:
+        with self._lock:
+            return self._metrics.model_copy(update={"size": len(self._entries)})
+
+
+class CachingConnection:
+    """cursor() だけを差し替え、それ以外 (host, database, schema, rest など) は元の接続に委ねる"""
+
+    def __init__(self, connection, cache: AnalystSqlCache):
+        self._connection = connection
+        self._cache = cache
+
+    def cursor(self, *args, **kwargs):
+        return CachingCursor(self._connection.cursor(*args, **kwargs), self._cache)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class CachingCursor:
+    """execute(sql[, params]).fetch_arrow_all() をキャッシュ経由にする。SELECT / WITH 以外はそのまま実行する"""
+
+    def __init__(self, cursor, cache: AnalystSqlCache):
+        self._cursor = cursor
+        self._cache = cache
+        self._table = None
+
+    def execute(self, sql: str, params=None, *args, **kwargs):
+        if args or kwargs or not sql.lstrip().lower().startswith(("select", "with")):
+            self._cursor.execute(sql, *(() if params is None else (params,)), *args, **kwargs)
+            return self._cursor
+        self._table = self._cache.execute(self._cursor, sql, params)
+        return self
+
+    def fetch_arrow_all(self):
+        return self._table
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
@@ -0,0 +1,113 @@
+"""
+AgentGateway のクエリあたりオーバーヘッドのベンチマーク (LLM・ツールはスタブ)
+python -m src.benchmark.agent_bench --queries 50 --concurrency 10
+"""
+import argparse
+import asyncio
+import time
+
+from src.agent.agent import AgentGateway
+from src.benchmark.fake_snowflake import FakeConnection
+from src.common.pool import ConnectionPool
+
+
+class StubPool(ConnectionPool):
+    """Snowpark Session の代わりに接続をそのまま返すプール"""
+
+    def session(self, connection):
+        return connection
+
+
+class StubAgent:
+    """agent_gateway.Agent のスタブ。生成コスト (プランナー・ツール登録) と応答遅延を模擬する"""
+
+    init_delay = 0.05
+    call_delay = 0.02
+
+    def __init__(self, snowflake_connection, tools, **kwargs):
+        time.sleep(self.init_delay)
+        self.tools = tools
+
+    async def acall(self, query):
+        await asyncio.sleep(self.call_delay)
+        return {
+            "output": f"answer: {query}",
+            "sources": [{
+                "tool_type": "cortex_search",
+                "tool_name": "cortex_search_svc_cortexsearch",
+                "metadata": [{"file_name": "plan.pdf", "chunk_id": 1}],
+            }],
+        }
+
+
+class StubGateway(AgentGateway):
+    """
+    ツールなしのゲートウェイ
+    スタブの接続は INFORMATION_SCHEMA を引けないので、Analyst のルーター (スキーマ情報でのコンパイル) と
+    SQL 結果キャッシュ (データバージョンの確認) は .env の ANALYST_ROUTER_ENABLED / ANALYST_SQL_CACHE_ENABLED によらず無効にする
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.sql_cache = None
+
+    def initialize_tools(self) -> list:
+        return []
+
+    def _compile_router(self):
+        return None
+
+
+def bench_construct_per_call(queries: list[str]) -> float:
+    """従来の動作: クエリごとに Agent を生成して直列に実行する"""
+    start = time.perf_counter()
+    for query in queries:
+        agent = StubAgent(snowflake_connection=None, tools=[])
+        asyncio.run(agent.acall(query))
+    return time.perf_counter() - start
+
+
+def bench_reuse(gateway: AgentGateway, queries: list[str], concurrency: int) -> float:
+    async def worker(queue):
+        while queue:
+            await gateway.arun(queue.pop())
+
+    async def main():
+        queue = list(queries)
+        await asyncio.gather(*(worker(queue) for _ in range(concurrency)))
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--init-delay", type=float, default=0.05, help="Agent生成コスト(秒)")
+    parser.add_argument("--call-delay", type=float, default=0.02, help="1クエリの応答時間(秒)")
+    args = parser.parse_args()
+
+    StubAgent.init_delay = args.init_delay
+    StubAgent.call_delay = args.call_delay
+    queries = [f"部署はいくつありますか？ ({i})" for i in range(args.queries)]
+
+    gateway = StubGateway(pool=StubPool(connect=lambda: FakeConnection(latency=0)), agent_factory=StubAgent,
+                          enable_response_cache=False)
+    gateway.run("warmup")
+
+    results = {
+        "construct-per-call": bench_construct_per_call(queries),
+        "reuse (sequential)": bench_reuse(gateway, queries, 1),
+        f"reuse (concurrency={args.concurrency})": bench_reuse(gateway, queries, args.concurrency),
+    }
+    gateway.close()
+
+    baseline = results["construct-per-call"]
+    for name, elapsed in results.items():
+        print(f"{name:>26}: {elapsed:7.3f}s  {elapsed / len(queries) * 1000:7.1f} ms/query  x{baseline / elapsed:.1f}")
+
+
+if __name__ == "__main__":
+    main()
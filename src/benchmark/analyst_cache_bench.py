@@ -0,0 +1,162 @@
+"""
+Analyst の生成SQLの結果キャッシュと集計テーブルのベンチマーク (SQLite をウェアハウスの代わりに使う)
+sales_transactions_april を --rows 行に増やし、1回の実行に --latency 秒の固定遅延を足したウェアハウスに対して、
+Cortex Analyst が生成する形の SQL を Zipf 分布で繰り返し実行する
+- none: キャッシュなし
+- cache: 正規化SQL + データバージョンの結果キャッシュ
+- cache+aggregates: さらにキャッシュにない集計SQLを集計テーブルに書き換える
+書き換えた SQL の結果が元の SQL と一致することも確認する
+python -m src.benchmark.analyst_cache_bench --rows 200000 --requests 300
+"""
+import argparse
+import random
+import sqlite3
+import statistics
+import time
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+
+from src.analyst.aggregates import MaterializedAggregates
+from src.analyst.preprocess import DATA_DIR, FILE_TABLE_MAP, Analyst_preprocess
+from src.analyst.sql_cache import AnalystSqlCache
+
+WORKLOAD = [
+    """WITH __sales_transactions_april AS (
+  SELECT channel, total_price FROM main.sales_transactions_april
+)
+SELECT channel, SUM(total_price) AS total_sales FROM __sales_transactions_april
+GROUP BY channel ORDER BY total_sales DESC NULLS LAST
+ -- Generated by Cortex Analyst""",
+    "SELECT department, SUM(total_price), COUNT(*) FROM sales_transactions_april GROUP BY 1 ORDER BY SUM(total_price) DESC",
+    "SELECT product_id, SUM(quantity) AS units FROM sales_transactions_april GROUP BY product_id ORDER BY units DESC LIMIT 5",
+    "SELECT date, SUM(total_price) AS daily_sales FROM sales_transactions_april GROUP BY date ORDER BY date",
+    "SELECT category, COUNT(*) AS products FROM products GROUP BY category",
+    "SELECT department, SUM(total_sales) AS total FROM sales_summary_april GROUP BY department ORDER BY total DESC",
+    # 集計テーブルでは答えられない形 (キャッシュだけが効く)
+    "SELECT channel, SUM(total_price) AS total FROM sales_transactions_april WHERE department = '国内–関東' GROUP BY channel",
+    "SELECT channel, AVG(total_price) AS average FROM sales_transactions_april GROUP BY channel",
+]
+
+
+class FakeWarehouse:
+    """connection.cursor().execute(sql).fetch_arrow_all() と INFORMATION_SCHEMA.TABLES の LAST_ALTERED だけを持つ"""
+
+    def __init__(self, rows: int, latency: float, seed: int = 0):
+        self.db = sqlite3.connect(":memory:", check_same_thread=False)
+        self.latency = latency
+        self.last_altered: dict[str, datetime] = {}
+        self.seconds = 0.0
+        self.executions = 0
+        for file, table in FILE_TABLE_MAP.items():
+            df = pd.read_csv(f"{DATA_DIR}/{file}", encoding="utf-8")
+            if table == "sales_transactions_april":
+                rng = random.Random(seed)
+                df = df.sample(n=rows, replace=True, random_state=seed).reset_index(drop=True)
+                df["transaction_id"] = range(1, len(df) + 1)
+                df["quantity"] = [rng.randint(1, 20) for _ in range(len(df))]
+            df.to_sql(table, self.db, index=False)
+            self.last_altered[table.upper()] = datetime.now()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
+
+
+class FakeCursor:
+    def __init__(self, warehouse: FakeWarehouse):
+        self.warehouse = warehouse
+        self.rows = []
+        self.columns = []
+
+    def execute(self, sql: str):
+        warehouse = self.warehouse
+        text = " ".join(sql.split())
+        if "INFORMATION_SCHEMA.TABLES" in text:
+            self.rows = list(warehouse.last_altered.items())
+            return self
+        start = time.perf_counter()
+        time.sleep(warehouse.latency)
+        if text.upper().startswith("CREATE OR REPLACE TABLE"):
+            name = text.split()[4]
+            warehouse.db.execute(f"DROP TABLE IF EXISTS {name}")
+            warehouse.db.execute("CREATE TABLE" + text[len("CREATE OR REPLACE TABLE"):])
+            warehouse.last_altered[name.split(".")[-1].upper()] = datetime.now()
+            self.rows = []
+        else:
+            result = warehouse.db.execute(sql)
+            self.columns = [d[0].upper() for d in result.description]
+            self.rows = result.fetchall()
+        warehouse.seconds += time.perf_counter() - start
+        warehouse.executions += 1
+        return self
+
+    def fetchall(self):
+        return self.rows
+
+    def fetch_arrow_all(self):
+        if not self.rows:
+            return None
+        return pa.table({name: [row[i] for row in self.rows] for i, name in enumerate(self.columns)})
+
+    def close(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.05, help="ウェアハウスの1回あたりの固定遅延(秒)")
+    args = parser.parse_args()
+
+    warehouse = FakeWarehouse(args.rows, args.latency)
+    aggregates = MaterializedAggregates.from_semantic_model(Analyst_preprocess.semantic_model_path, schema="main")
+    start = time.perf_counter()
+    aggregates.refresh(warehouse)
+    print(f"sales_transactions_april={args.rows}行  集計テーブル {len(aggregates.tables)}件を作成 "
+          f"({time.perf_counter() - start:.2f}s)")
+
+    # 書き換えた SQL が同じ結果を返すか
+    cache = AnalystSqlCache(aggregates=aggregates)
+    for sql in WORKLOAD:
+        expected = warehouse.cursor().execute(sql).fetch_arrow_all()
+        actual = cache.execute(warehouse.cursor(), sql)
+        assert expected.column_names == actual.column_names, (sql, expected.column_names, actual.column_names)
+        assert expected.to_pylist() == actual.to_pylist(), sql
+
+    rng = random.Random(1)
+    weights = [1 / (i + 1) for i in range(len(WORKLOAD))]
+    requests = rng.choices(WORKLOAD, weights=weights, k=args.requests)
+    for label in ("none", "cache", "cache+aggregates"):
+        cache = None
+        if label != "none":
+            cache = AnalystSqlCache(aggregates=aggregates if label == "cache+aggregates" else None)
+            cache.set_version("v1")
+        warehouse.seconds = 0.0
+        latencies = []
+        for sql in requests:
+            start = time.perf_counter()
+            if cache is None:
+                warehouse.cursor().execute(sql).fetch_arrow_all()
+            else:
+                cache.execute(warehouse.cursor(), sql)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        line = (f"{label:>16}: warehouse {warehouse.seconds:6.2f}s  p50 {statistics.median(latencies) * 1000:7.2f} ms  "
+                f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:7.2f} ms")
+        if cache is not None:
+            metrics = cache.metrics()
+            line += (f"  hit {metrics.hit_rate:.2f}  rewrites {metrics.rewrites}  "
+                     f"saved {metrics.warehouse_seconds_saved:6.2f}s")
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+セマンティックモデルのルーター (LookupRouter) のベンチマーク (FakeSnowflake / FakeCortex で資格情報なしに実行できる)
+Analyst_preprocess で環境を作り、CortexAnalystTool を AgentGateway と同じ引数で生成して質問を1件ずつ実行する
+- unrouted: すべて Cortex Analyst (SQL 生成の LLM 呼び出し + SQL の実行)
+- routed: 単純な質問 (件数・値の一覧・サンプル値での絞り込み) はテンプレートの SQL だけで答える
+プランナー・回答生成の LLM 呼び出しはどちらも同じなので、ツール単体の差がそのまま1回答あたりの差になる
+SQL の結果キャッシュは入れない (ルーティングだけの効果を測る)
+python -m src.benchmark.analyst_router_bench --repeat 5 --scale 0.1
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from agent_gateway.tools import CortexAnalystTool
+from dotenv import load_dotenv
+
+from src.agent.tool_cache import _invoke
+from src.analyst.preprocess import Analyst_preprocess
+from src.analyst.semantic_compiler import LookupRouter, compile_semantic_model
+from src.benchmark.fake_cortex import FakeCortex, install
+from src.benchmark.fake_snowflake import FakePool, FakeSnowflake
+from src.benchmark.suite import DEFAULT_LATENCY, isolate, percentile
+from src.common.schema_cache import get_schema_cache
+
+# テンプレートで答えられる質問
+SIMPLE = [
+    "部署はいくつありますか?",
+    "how many departments?",
+    "チャネルの一覧",
+    "list the categories",
+    "商品はいくつ?",
+    "スマート照明の価格は?",
+    "ワイヤレスイヤホンのカテゴリは?",
+]
+# Cortex Analyst に回す質問 (集計・絞り込みの組み合わせと、明細のテーブルの件数)
+COMPLEX = [
+    "チャネル別の売上を教えて",
+    "部署別の取引件数は?",
+    "取引は何件ありますか",
+    "how many sales?",
+    "ECサイトの売上は?",
+    "日別の売上の推移は?",
+]
+
+
+def analyst_tool(pool: FakePool) -> CortexAnalystTool:
+    return CortexAnalystTool(
+        semantic_model=Analyst_preprocess.semantic_model_path.replace("src/analyst/semantic_model/", ""),
+        stage=Analyst_preprocess.stage_name,
+        service_topic="サンプルテック社の商品売り上げデータ",
+        data_description="商品名、売り上げ、売上地域、件数",
+        snowflake_connection=pool.session(pool.acquire()),
+        max_results=5)
+
+
+async def measure(tool, questions: list[str]) -> dict[str, list[float]]:
+    seconds: dict[str, list[float]] = {"simple": [], "complex": []}
+    for question in questions:
+        start = time.perf_counter()
+        result = await _invoke(tool.func, question)
+        seconds["simple" if question in SIMPLE else "complex"].append(time.perf_counter() - start)
+        if not result or not result.get("output"):
+            raise AssertionError(f"回答がありません: {question}")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5, help="質問の一覧を繰り返す回数")
+    parser.add_argument("--scale", type=float, default=0.1, help="DEFAULT_LATENCY に掛ける倍率 (0 で遅延なし)")
+    args = parser.parse_args()
+
+    load_dotenv(encoding="utf-8", override=True)
+    isolate(Path(tempfile.mkdtemp(prefix="agent-gateway-router-")))
+    latency = DEFAULT_LATENCY.scaled(args.scale)
+    backend = FakeSnowflake(os.environ["SNOWFLAKE_DATABASE"], os.environ["SNOWFLAKE_SCHEMA"], latency=latency)
+    pool = FakePool(backend)
+    preprocess = Analyst_preprocess(pool=pool)
+    try:
+        preprocess.run()
+    finally:
+        preprocess.close()
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("AgentGatewayLogger").setLevel(logging.WARNING)
+
+    start = time.perf_counter()
+    connector = pool.acquire()
+    snapshot = get_schema_cache(os.environ["SNOWFLAKE_DATABASE"], os.environ["SNOWFLAKE_SCHEMA"]).get(connector, force=True)
+    pool.release(connector)
+    model = compile_semantic_model(Analyst_preprocess.semantic_model_path, snapshot)
+    print(f"コンパイル {(time.perf_counter() - start) * 1000:.1f} ms  (語 {len(model.terms)}件, "
+          f"サンプル値 {len(model.values)}件, エラー {len(model.errors)}件)")
+    router = LookupRouter(model)
+    unroutable = [q for q in SIMPLE if router.route(q) is None]
+    if unroutable:
+        raise AssertionError(f"テンプレートに当てはまりません: {unroutable}")
+    routed = [q for q in COMPLEX if router.route(q) is not None]
+    if routed:
+        raise AssertionError(f"Cortex Analyst に回すべき質問がテンプレートに当てはまりました: {routed}")
+
+    questions = (SIMPLE + COMPLEX) * args.repeat
+    with install(FakeCortex(backend)) as cortex:
+        for label in ("unrouted", "routed"):
+            tool = analyst_tool(pool)
+            if label == "routed":
+                router = LookupRouter(model)
+                tool = router.wrap(tool)
+            calls = cortex.calls["analyst"]
+            seconds = asyncio.run(measure(tool, questions))
+            print(f"{label:>8}: Cortex Analyst {cortex.calls['analyst'] - calls}回")
+            for kind, values in seconds.items():
+                print(f"          {kind:>7} {len(values)}件  p50 {percentile(values, 0.5) * 1000:7.1f} ms  "
+                      f"p95 {percentile(values, 0.95) * 1000:7.1f} ms  mean {statistics.mean(values) * 1000:7.1f} ms")
+            if label == "routed":
+                print(f"          {router.metrics()}")
+
+
+if __name__ == "__main__":
+    main()
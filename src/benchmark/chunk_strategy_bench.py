@@ -0,0 +1,148 @@
+"""
+チャンク分割方式のベンチマーク (recursive: 100文字 / 重なり20文字 と structured: 見出し・文境界 + トークン上限)
+条文形式のダミーPDF (第X条（見出し）+ 本文) を生成し、チャンク数・保存する文字数・チャンク化と索引作成の時間、
+答えを含むチャンクが top-1 / top-k に入る割合と、top-k で返すトークン数を比べる
+- 条文 (見出しから離れた答え): 「第X条（見出し）の基準額」を問う。基準額の文は条の後半にあり、見出しの語を含まない
+- 条文 (同じ文の答え): 「品目XXの発注単位」を問う。答えはクエリの語 (品目コード) と同じ文にある
+- サンプルPDF: src/search/data の実際の経営計画PDFに対する質問と答え (QUESTIONS)
+python -m src.benchmark.chunk_strategy_bench --files 2 --pages 50
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from src.search.chunking import iter_pdf_chunks
+from src.search.embedder import HashingEmbedder
+from src.search.embedding_pipeline import estimate_tokens
+from src.search.hybrid import HybridRetriever
+from src.search.keyword_index import KeywordIndex
+from src.search.vector_index import VectorIndex
+
+TITLES = ["目的", "適用範囲", "定義", "販売目標", "予算管理", "在庫管理", "品質保証", "労務管理", "報告義務", "改廃"]
+SENTENCES = [
+    "本規程は、当社の経営計画を円滑に実行するために必要な事項を定める。",
+    "各部署の責任者は、四半期ごとに進捗を取締役会へ報告しなければならない。",
+    "国内外の販売拠点は、本社の定める手順に従って売上と在庫を管理する。",
+    "前項の規定にかかわらず、特別な事情がある場合は社長の承認を得て例外とすることができる。",
+    "従業員の時間外労働は36協定の範囲内で管理し、月間の上限を超えないようにする。",
+    "海外向け製品は現地の法令と認証基準に適合していることを出荷前に確認する。",
+]
+# サンプルPDF (src/search/data) への質問と、答えのチャンクに含まれるべき文字列 (空白を除いて比べる)
+QUESTIONS = [
+    ("従業員数は何名ですか", "従業員数：120名"),
+    ("会社の設立はいつですか", "設立：2010年6月"),
+    ("本社の所在地はどこですか", "所在地：東京都渋谷区"),
+    ("IoT対応家電市場の成長率は?", "年率15%"),
+    ("4月の月間売上高の実績は?", "¥511,000"),
+    ("海外売上比率はどのくらいですか", "海外売上比率：32%"),
+    ("ECサイトのユニーク訪問者数は?", "15,000人"),
+    ("海外パートナーとの契約締結はいつの予定ですか", "海外パートナー契約締結"),
+    ("ショールーム第2号店のオープン時期は?", "ショールーム第2号店オープン"),
+    ("為替変動リスクへの対応は?", "ヘッジ戦略"),
+    ("物流遅延リスクにはどう対応しますか", "複数ルートの確保"),
+    ("会社のビジョンは何ですか", "生活を豊かにするスマートソリューションの提供"),
+    ("海外展開施策の内容は?", "アジア新興国での代理店網構築"),
+    ("国内市場強化施策は何ですか", "体験型ショールーム"),
+    ("事業内容を教えてください", "スマート家電・生活用品の製造・販売"),
+]
+SAMPLE_DIR = Path(__file__).resolve().parents[1] / "search" / "data"
+
+
+def make_pdf(path: Path, pages: int, first_article: int, rng: random.Random) -> list[tuple[int, str, str, str, str]]:
+    """1ページに3条ずつ書いたPDFを作り、(条番号, 見出し, 基準額, 品目コード, 発注単位) のリストを返す"""
+    from reportlab.pdfgen import canvas
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+
+    pdfmetrics.registerFont(UnicodeCIDFont("HeiseiMin-W3"))
+    c = canvas.Canvas(str(path))
+    facts = []
+    article = first_article
+    for _ in range(pages):
+        text = c.beginText(40, 800)
+        text.setFont("HeiseiMin-W3", 10)
+        for _ in range(3):
+            title = rng.choice(TITLES)
+            amount = f"{rng.randrange(100, 999)},{rng.randrange(100, 999)}円"
+            body = rng.sample(SENTENCES, 4)
+            # 基準額の文は条の後半に置く (条番号・見出しから離れた位置)
+            body.insert(rng.randrange(2, 5), f"この条の基準額は{amount}とする。")
+            # 発注単位の文は品目コードと答えが同じ文にある (位置は問わない)
+            code, unit = f"K{article:04d}", f"{rng.randrange(10, 99)}箱"
+            body.insert(rng.randrange(0, 6), f"品目{code}の発注単位は{unit}とする。")
+            text.textLine(f"第{article}条（{title}）")
+            for sentence in body:
+                text.textLine(sentence)
+            text.textLine("")
+            facts.append((article, title, amount, code, unit))
+            article += 1
+        c.drawText(text)
+        c.showPage()
+    c.save()
+    return facts
+
+
+def evaluate(label: str, paths: list[Path], queries: list[tuple[str, str]], strategies: dict, k: int) -> None:
+    """方式ごとにチャンク化・索引作成し、答えを含むチャンクが top-1 / top-k に入る割合を出す"""
+    print(f"{label}: {len(queries)} queries")
+    for name, options in strategies.items():
+        start = time.perf_counter()
+        chunks = list(iter_pdf_chunks(paths, 100, 20, max_workers=1, **options))
+        chunking = time.perf_counter() - start
+        rows = [(i, chunk.file_name, chunk.text) for i, chunk in enumerate(chunks)]
+
+        start = time.perf_counter()
+        embedder = HashingEmbedder()
+        retriever = HybridRetriever(VectorIndex.build(rows, embedder, "BENCH", batch_size=1024),
+                                    KeywordIndex.build(rows, "BENCH"), embedder)
+        indexing = time.perf_counter() - start
+
+        top1, hits, returned = 0, 0, []
+        for query, answer in queries:
+            found = [("".join(r.text.split()), r.text) for r in retriever.search(query, k).results]
+            top1 += bool(found) and answer in found[0][0]
+            hits += any(answer in text for text, _ in found)
+            returned.append(sum(estimate_tokens(text) for _, text in found))
+        stored = sum(len(chunk.text) for chunk in chunks)
+        print(f"  {name:>16}: {len(chunks):6d} chunks  {stored:8d} 文字  chunking {chunking:5.2f}s  "
+              f"index {indexing:5.2f}s  hit@1 {top1 / len(queries):.2f}  hit@{k} {hits / len(queries):.2f}  "
+              f"top-{k} tokens {statistics.mean(returned):6.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=2)
+    parser.add_argument("--pages", type=int, default=50, help="1ファイルあたりのページ数")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--max-tokens", type=int, default=300)
+    args = parser.parse_args()
+
+    strategies = {
+        "recursive 100/20": dict(strategy="recursive"),
+        f"structured {args.max_tokens}": dict(strategy="structured", max_tokens=args.max_tokens),
+    }
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths, facts = [], []
+        for i in range(args.files):
+            path = Path(tmp) / f"rules_{i}.pdf"
+            facts += make_pdf(path, args.pages, len(facts) + 1, rng)
+            paths.append(path)
+        sampled = rng.sample(facts, args.queries)
+        print(f"{args.files} files / {args.files * args.pages} pages / {len(facts)} 条")
+        evaluate("条文 (見出しから離れた答え)",
+                 paths, [(f"第{n}条（{title}）の基準額はいくらですか", amount) for n, title, amount, _, _ in sampled],
+                 strategies, args.k)
+        evaluate("条文 (同じ文の答え)",
+                 paths, [(f"品目{code}の発注単位はいくつですか", unit) for _, _, _, code, unit in sampled],
+                 strategies, args.k)
+    samples = sorted(SAMPLE_DIR.glob("*.pdf"))
+    evaluate(f"サンプルPDF ({', '.join(path.name for path in samples)})", samples, QUESTIONS, strategies, args.k)
+
+
+if __name__ == "__main__":
+    main()
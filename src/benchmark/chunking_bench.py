@@ -0,0 +1,69 @@
+"""
+PDFチャンク化の並列度ごとのベンチマーク
+python -m src.benchmark.chunking_bench --files 4 --pages 100 --workers 1 2 4
+"""
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from src.search.chunking import iter_pdf_chunks
+
+LINES = [
+    "第{page}条 本ドキュメントは、2025年度第1四半期における当社の経営計画を示すものである。",
+    "製造小売業としての強みを活かし、国内外での販売拡大を図るとともに、",
+    "非構造化データを活用した意思決定基盤の整備を推進する。",
+    "国内–関東、国内–関西、海外–北米の各部署で売上目標を設定し、ECサイトと直営店の販売比率を見直す。",
+    "従業員の時間外労働は36協定の範囲内で管理し、月間の上限を超えないよう勤怠を確認する。",
+]
+
+
+def make_pdf(path: Path, pages: int) -> None:
+    """reportlab で日本語のダミーPDFを生成する"""
+    from reportlab.pdfgen import canvas
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+
+    pdfmetrics.registerFont(UnicodeCIDFont("HeiseiMin-W3"))
+    c = canvas.Canvas(str(path))
+    for page in range(pages):
+        text = c.beginText(40, 800)
+        text.setFont("HeiseiMin-W3", 10)
+        for i in range(40):
+            text.textLine(LINES[i % len(LINES)].format(page=page + 1))
+        c.drawText(text)
+        c.showPage()
+    c.save()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=100, help="1ファイルあたりのページ数")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument("--chunk-size", type=int, default=100)
+    parser.add_argument("--chunk-overlap", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [Path(tmp) / f"plan_{i}.pdf" for i in range(args.files)]
+        for path in paths:
+            make_pdf(path, args.pages)
+        total_pages = args.files * args.pages
+        print(f"{args.files} files / {total_pages} pages")
+
+        baseline = None
+        for workers in sorted(set(args.workers)):
+            start = time.perf_counter()
+            chunks = sum(1 for _ in iter_pdf_chunks(paths, args.chunk_size, args.chunk_overlap, max_workers=workers))
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(
+                f"workers={workers:>2}: {elapsed:7.2f}s  {total_pages / elapsed:8.1f} pages/sec  "
+                f"{chunks} chunks  x{baseline / elapsed:.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+検索結果の圧縮 (隣接チャンクの結合・重複除去・並べ替え・トークン上限) のベンチマーク
+サンプルPDFのチャンク + 合成チャンクをハイブリッド検索 (k=10) し、CortexSearchTool と同じ形の結果を圧縮して
+観測のトークン数・件数・正解キーワードが残る割合・圧縮にかかる時間と、
+LLM の処理時間を「固定時間 + 入力トークン数 × トークンあたりの時間」とみなした場合の応答時間の差を出す
+python -m src.benchmark.context_compression_bench --chunks 2000 --max-tokens 1500
+"""
+import argparse
+import statistics
+import time
+
+from src.agent.context_compression import ContextCompressor
+from src.agent.local_search import to_search_response
+from src.benchmark.hybrid_bench import QUERIES, squash
+from src.benchmark.vector_index_bench import corpus
+from src.search.embedder import HashingEmbedder
+from src.search.embedding_pipeline import estimate_tokens
+from src.search.hybrid import HybridRetriever
+from src.search.keyword_index import KeywordIndex
+from src.search.vector_index import VectorIndex
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--max-tokens", type=int, nargs="+", default=[1500, 600, 300])
+    parser.add_argument("--llm-base-ms", type=float, default=500.0, help="LLM 呼び出しの固定時間(ミリ秒)")
+    parser.add_argument("--llm-ms-per-token", type=float, default=0.5, help="入力1トークンあたりの処理時間(ミリ秒)")
+    parser.add_argument("--llm-calls", type=int, default=2, help="1回の検索結果が入るプロンプトの数 (計画 + 回答)")
+    args = parser.parse_args()
+
+    rows = corpus(args.chunks)
+    embedder = HashingEmbedder()
+    retriever = HybridRetriever(VectorIndex.build(rows, embedder, "BENCH", batch_size=1024),
+                                KeywordIndex.build(rows, "BENCH"), embedder)
+    results = [(query, answer, to_search_response(retriever.search(query, args.k).results, "bench_cortexsearch"))
+               for query, answer in QUERIES]
+
+    def llm_ms(tokens: float) -> float:
+        return args.llm_calls * (args.llm_base_ms + tokens * args.llm_ms_per_token)
+
+    raw_tokens = statistics.mean(estimate_tokens(str(result)) for _, _, result in results)
+    raw_rows = statistics.mean(len(result["output"]) for _, _, result in results)
+    raw_answers = sum(any(squash(answer) in squash(r["text"]) for r in result["output"]) for _, answer, result in results)
+    print(f"chunks={len(rows)}  queries={len(results)}  k={args.k}")
+    print(f"{'raw':>16}: {raw_rows:5.1f} 件  {raw_tokens:6.0f} tokens  正解を含む {raw_answers / len(results):.2f}  "
+          f"LLM {llm_ms(raw_tokens):7.0f} ms")
+
+    for max_tokens in args.max_tokens:
+        compressor = ContextCompressor(max_tokens=max_tokens)
+        tokens, kept_rows, answers, seconds = [], [], 0, []
+        for query, answer, result in results:
+            start = time.perf_counter()
+            compressed = compressor.compress(query, result)
+            seconds.append(time.perf_counter() - start)
+            tokens.append(estimate_tokens(str(compressed)))
+            kept_rows.append(len(compressed["output"]))
+            answers += any(squash(answer) in squash(r["text"]) for r in compressed["output"])
+        mean_tokens = statistics.mean(tokens)
+        delta = llm_ms(mean_tokens) - llm_ms(raw_tokens) + statistics.mean(seconds) * 1000
+        print(f"{f'max_tokens={max_tokens}':>16}: {statistics.mean(kept_rows):5.1f} 件  {mean_tokens:6.0f} tokens "
+              f"({1 - mean_tokens / raw_tokens:4.0%} 削減)  正解を含む {answers / len(results):.2f}  "
+              f"LLM {llm_ms(mean_tokens):7.0f} ms  圧縮 {statistics.mean(seconds) * 1000:5.2f} ms  "
+              f"応答時間の差 {delta:+7.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+html_crawl ツールのベンチマーク (ローカルHTTPサーバーに対して実行)
+サーバーは新しい接続ごとに --connect-latency だけ待つ (実際のサイトへの TCP / TLS ハンドシェイクの往復を模擬する)
+- requests.get (従来の html_crawl): リクエストごとに接続する
+- HtmlCrawler (キャッシュなし): keep-alive の接続を使い回す (接続の再利用だけの効果)
+- HtmlCrawler (キャッシュあり): さらに ETag による条件付き GET (同じ URL の2回目以降は 304)
+それぞれの所要時間・req/s と、サーバーが受け付けた接続数を出す
+python -m src.benchmark.crawl_bench --requests 100 --concurrency 8 --connect-latency 0.05
+"""
+import argparse
+import hashlib
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from src.agent.tools import HtmlCrawler, html_to_text
+
+
+def make_page(paragraphs: int) -> bytes:
+    body = "".join(
+        f"<div class='p'><h2>第{i}条</h2><p>従業員の時間外労働は36協定の範囲内で管理する。"
+        f"<a href='/page/{i}'>詳細</a></p><script>var x{i} = {'0' * 200};</script></div>"
+        for i in range(paragraphs)
+    )
+    return (
+        "<html><head><meta charset='utf-8'><title>モデル就業規則</title>"
+        f"<style>{'.p{margin:0}' * 500}</style></head><body>{body}</body></html>"
+    ).encode("utf-8")
+
+
+class Server(ThreadingHTTPServer):
+    """新しい接続ごとに connect_latency だけ待ってから応答を始める"""
+    daemon_threads = True
+    connect_latency = 0.05
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def finish_request(self, request, client_address):
+        with self._lock:
+            self.connections += 1
+        time.sleep(self.connect_latency)
+        super().finish_request(request, client_address)
+
+    def take_connections(self) -> int:
+        with self._lock:
+            count, self.connections = self.connections, 0
+        return count
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive を有効にする
+    page = make_page(200)
+    etag = '"' + hashlib.md5(page).hexdigest() + '"'
+    latency = 0.01
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(self.page)))
+        self.send_header("ETag", self.etag)
+        self.end_headers()
+        self.wfile.write(self.page)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.01, help="サーバー側の応答遅延(秒)")
+    parser.add_argument("--connect-latency", type=float, default=0.05, help="新しい接続の確立にかかる時間(秒)")
+    args = parser.parse_args()
+
+    Handler.latency = args.latency
+    Server.connect_latency = args.connect_latency
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = [f"{base}/page/{i % 10}" for i in range(args.requests)]
+
+    def legacy(url):
+        # 従来の html_crawl (セッションなし・タイムアウトなし) + 同じテキスト抽出
+        response = requests.get(url)
+        return html_to_text(response.text) if response.status_code == 200 else None
+
+    def measure(fetch) -> tuple[float, int, list]:
+        """urls を concurrency 並行で取得し、(秒, 新しい接続数, 結果) を返す"""
+        server.take_connections()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            results = list(executor.map(fetch, urls))
+        return time.perf_counter() - start, server.take_connections(), results
+
+    def warmup(crawler: HtmlCrawler) -> HtmlCrawler:
+        """concurrency 本の接続を張っておく (常駐するゲートウェイでは接続の確立は初回だけなので計測に含めない)"""
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            list(executor.map(crawler.crawl, [f"{base}/warmup"] * args.concurrency))
+        return crawler
+
+    raw_chars = len(requests.get(urls[0]).text)
+    timings = {"requests.get (no session)": measure(legacy)}
+
+    # 接続の再利用だけの効果を見るため、まずディスクキャッシュなしで測る
+    crawler = warmup(HtmlCrawler(cache_dir=None, per_host_limit=args.concurrency))
+    timings["HtmlCrawler (no cache)"] = measure(crawler.crawl)
+    crawler.close()
+    cold = timings["HtmlCrawler (no cache)"][2]
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        crawler = warmup(HtmlCrawler(cache_dir=cache_dir, per_host_limit=args.concurrency))
+        timings["HtmlCrawler (disk cache)"] = measure(crawler.crawl)
+
+        revalidated = crawler.crawl(urls[0])
+        crawler.max_bytes = 4096
+        truncated = crawler.crawl(f"{base}/uncached")
+        crawler.close()
+
+    server.shutdown()
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, "
+          f"connect {args.connect_latency * 1000:.0f} ms, response {args.latency * 1000:.0f} ms")
+    for label, (elapsed, connections, _) in timings.items():
+        print(f"{label:<27}: {elapsed:6.3f}s  {args.requests / elapsed:7.1f} req/s  new connections {connections}")
+    print(f"chars sent to agent        : {raw_chars:,} -> {len(cold[0].text):,}")
+    print(f"conditional GET            : from_cache={revalidated.from_cache} ({revalidated.elapsed * 1000:.1f} ms)")
+    print(f"max_bytes cutoff           : truncated={truncated.truncated} bytes_read={truncated.bytes_read:,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+チャンク埋め込みのスループットのベンチマーク (ローカルの偽埋め込みサーバーに対して実行)
+サーバーは OpenAI 互換の POST /embeddings で、1リクエストあたりの遅延と、秒あたりのリクエスト数の上限 (超えると 429) を持つ
+- per-chunk: 従来想定の1チャンク1リクエスト (直列)
+- pipeline (cold): EmbeddingPipeline (トークン数でバッチ化・並行・流量制御・再試行)
+- pipeline (warm): 同じチャンクの再取り込み (ディスクキャッシュから。API 呼び出し 0 回)
+python -m src.benchmark.embedding_bench --chunks 2000
+"""
+import argparse
+import json
+import tempfile
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+
+from src.benchmark.vector_index_bench import corpus
+from src.search.embedder import HashingEmbedder
+from src.search.embedding_pipeline import EmbeddingCache, EmbeddingPipeline, estimate_tokens
+
+
+class FakeEmbeddingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.05 # 1リクエストの固定遅延(秒)
+    per_token = 0.00001 # トークンあたりの遅延(秒)
+    max_rps = 20 # 秒あたりのリクエスト数の上限
+    embedder = HashingEmbedder(dim=256)
+    calls = 0
+    rejected = 0
+    _window: deque = deque()
+    _lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        texts = body["input"]
+        cls = type(self)
+        with cls._lock:
+            now = time.monotonic()
+            while cls._window and now - cls._window[0] > 1.0:
+                cls._window.popleft()
+            if len(cls._window) >= cls.max_rps:
+                cls.rejected += 1
+                self._send(429, {"error": "rate limited"}, [("Retry-After", "1")])
+                return
+            cls._window.append(now)
+            cls.calls += 1
+        time.sleep(self.latency + self.per_token * sum(estimate_tokens(t) for t in texts))
+        vectors = self.embedder.embed_documents(texts)
+        self._send(200, {"data": [{"index": i, "embedding": v} for i, v in enumerate(vectors)]})
+
+    def _send(self, status, payload, headers=()):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpEmbedder:
+    """偽サーバーを呼ぶ埋め込み (429 は httpx.HTTPStatusError として上げる)"""
+
+    name = "fake:256"
+
+    def __init__(self, base_url: str):
+        self.client = httpx.Client(base_url=base_url, timeout=30)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        response = self.client.post("/embeddings", json={"input": texts, "model": "fake"})
+        response.raise_for_status()
+        return [item["embedding"] for item in sorted(response.json()["data"], key=lambda d: d["index"])]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+
+def per_chunk(embedder: HttpEmbedder, texts: list[str]) -> float:
+    start = time.perf_counter()
+    for text in texts:
+        for attempt in range(10):
+            try:
+                embedder.embed_documents([text])
+                break
+            except httpx.HTTPStatusError:
+                time.sleep(1)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--baseline-chunks", type=int, default=200, help="1チャンク1リクエストで計測する件数")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--max-rps", type=int, default=20, help="サーバー側の秒あたりリクエスト上限")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--batch-tokens", type=int, default=4000)
+    args = parser.parse_args()
+
+    FakeEmbeddingHandler.latency = args.latency
+    FakeEmbeddingHandler.max_rps = args.max_rps
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeEmbeddingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    embedder = HttpEmbedder(f"http://127.0.0.1:{server.server_address[1]}")
+
+    texts = [text for _, _, text in corpus(args.chunks)]
+
+    baseline = texts[:args.baseline_chunks]
+    elapsed = per_chunk(embedder, baseline)
+    print(f"        per-chunk: {len(baseline) / elapsed:8.1f} chunks/s  ({len(baseline)}件, "
+          f"API {FakeEmbeddingHandler.calls}回)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label in ("pipeline (cold)", "pipeline (warm)"):
+            cache = EmbeddingCache(Path(tmp) / "embeddings.sqlite")
+            pipeline = EmbeddingPipeline(
+                embedder, cache=cache, max_batch_tokens=args.batch_tokens, concurrency=args.concurrency,
+                rpm=args.max_rps * 60, backoff=0.5)
+            FakeEmbeddingHandler.calls = FakeEmbeddingHandler.rejected = 0
+            start = time.perf_counter()
+            matrix = pipeline.embed_matrix(texts)
+            elapsed = time.perf_counter() - start
+            metrics = pipeline.metrics()
+            print(f"{label:>17}: {len(texts) / elapsed:8.1f} chunks/s  ({len(texts)}件, {matrix.shape}, "
+                  f"API {metrics.api_calls}回, キャッシュヒット {metrics.cache_hits}, 再試行 {metrics.retries}, "
+                  f"429 {FakeEmbeddingHandler.rejected}回)")
+            cache.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+ベンチマーク用の Cortex REST API (complete / Cortex Search / Cortex Analyst) の代わり
+agent_gateway は post_cortex_request で REST を呼ぶので、install() でそれを FakeCortex に差し替える
+(回答生成を SSE で読む src.agent.answer_stream.stream_cortex_request も差し替える)
+- complete: プランナーには質問の語で Analyst / Search のどちらか1つのツールと fuse() の計画を返し、
+  回答生成には最後の Observation を Finish(...) で返す
+- search: FakeSnowflake に作られた Cortex Search Service を検索する
+- analyst: 質問の語 (チャネル・部署・商品・日付・数量・件数など) から Cortex Analyst が生成する形の SQL を返す
+  SQL の実行はツール側 (FakeSnowflake の接続) で行う
+遅延は FakeSnowflake と同じ Latency で指定する (LLM は1回の固定時間 + 入力1トークンあたり + 出力1トークンあたり)
+"""
+import asyncio
+import json
+import re
+from contextlib import contextmanager
+from typing import AsyncIterator
+
+from src.benchmark.fake_snowflake import FakeSnowflake, Latency
+from src.search.embedding_pipeline import estimate_tokens
+
+_SEARCH_URL = re.compile(r"/cortex-search-services/(\w+):query$")
+_CHARS_PER_TOKEN = 4 # ストリームで1回に返す文字数
+_ANALYST_WORDS = ("売上", "売り上げ", "件数", "合計", "数量", "個数", "チャネル", "部署", "部門", "商品別", "日別", "カテゴリ")
+
+# (質問に含まれる語, GROUP BY の列)。先に一致したものを使う
+_DIMENSIONS = [
+    (("チャネル", "販路"), "channel"),
+    (("部署", "部門", "地域"), "department"),
+    (("商品", "製品"), "product_id"),
+    (("日別", "日付", "日ごと"), "date"),
+]
+
+
+class FakeCortex:
+    def __init__(self, backend: FakeSnowflake, latency: Latency | None = None):
+        self.backend = backend
+        self.latency = latency or backend.latency
+        self.calls = {"complete": 0, "search": 0, "analyst": 0}
+        self.tokens = 0 # complete に渡した入力トークン数の合計
+
+    async def post_cortex_request(self, url: str, headers: dict, data: dict) -> str:
+        if url.endswith(":complete"):
+            return await self.complete(data)
+        match = _SEARCH_URL.search(url)
+        if match:
+            return await self.search(match.group(1), data)
+        if url.endswith("/cortex/analyst/message"):
+            return await self.analyst(data)
+        raise ValueError(f"未対応の Cortex エンドポイントです: {url}")
+
+    async def stream_cortex_request(self, url: str, headers: dict, data: dict) -> AsyncIterator[str]:
+        """complete の SSE を読む場合。最初の出力まで固定時間 + 入力分を待ち、以降は少しずつ返す"""
+        if not url.endswith(":complete"):
+            raise ValueError(f"ストリームに未対応の Cortex エンドポイントです: {url}")
+        text = await self._completion(data)
+        # 出力全体の待ち時間は complete と同じにし、文字数で按分する
+        per_char = self.latency.per_output_token * estimate_tokens(text) / max(1, len(text))
+        for start in range(0, len(text), _CHARS_PER_TOKEN):
+            piece = text[start:start + _CHARS_PER_TOKEN]
+            await _sleep(per_char * len(piece))
+            yield piece
+
+    async def complete(self, data: dict) -> str:
+        text = await self._completion(data)
+        await _sleep(self.latency.per_output_token * estimate_tokens(text))
+        return "data: " + json.dumps({"choices": [{"delta": {"content": text}}]}, ensure_ascii=False)
+
+    async def _completion(self, data: dict) -> str:
+        prompt = data["messages"][0]["content"]
+        tokens = estimate_tokens(prompt)
+        self.calls["complete"] += 1
+        self.tokens += tokens
+        await _sleep(self.latency.complete + self.latency.per_token * tokens)
+        return fusion(prompt) if "Observation:" in prompt else plan(prompt)
+
+    async def search(self, service_name: str, data: dict) -> str:
+        self.calls["search"] += 1
+        service = self.backend.services.get(service_name.upper())
+        if service is None:
+            return json.dumps({"message": f"Cortex Search Service {service_name} does not exist"})
+        results = await asyncio.to_thread(service.search, self.backend, data["query"], data["columns"], data.get("limit", 10))
+        await _sleep(self.latency.search)
+        return json.dumps({"results": results}, ensure_ascii=False, default=str)
+
+    async def analyst(self, data: dict) -> str:
+        self.calls["analyst"] += 1
+        question = data["messages"][-1]["content"][0]["text"]
+        await _sleep(self.latency.analyst)
+        content = [{"type": "text", "text": f"This is our interpretation of your question: {question}"},
+                   {"type": "sql", "statement": analyst_sql(question, self.backend.database, self.backend.schema)}]
+        return json.dumps({"message": {"role": "analyst", "content": content}}, ensure_ascii=False)
+
+
+def plan(prompt: str) -> str:
+    """プロンプトのツール一覧と質問から、ツール1つ + fuse() の計画を作る"""
+    question = prompt.rsplit("Question:", 1)[-1].strip().splitlines()[0]
+    search_tools = re.findall(r"(\w+_cortexsearch)\(", prompt)
+    analyst_tools = re.findall(r"(\w+_cortexanalyst)\(", prompt)
+    tools = analyst_tools if analyst_tools and any(word in question for word in _ANALYST_WORDS) else search_tools
+    tools = tools or analyst_tools
+    argument = re.sub(r"[()\"\\]", " ", question)
+    return (f"Thought: {tools[0]} で調べる\n"
+            f"1. {tools[0]}(\"{argument}\")\n"
+            f"2. fuse()<END_OF_PLAN>")
+
+
+def fusion(prompt: str) -> str:
+    """最後の Observation の先頭を回答にする (括弧は回答の区切りと紛れるので除く)"""
+    observation = prompt.rsplit("Observation:", 1)[-1].strip()
+    answer = re.sub(r"[()]", " ", " ".join(observation.split()))[:200]
+    return f"Thought: 観測結果から回答できる\n\nAction: Finish({answer})\n<END_OF_RESPONSE>"
+
+
+def analyst_sql(question: str, database: str, schema: str) -> str:
+    """Cortex Analyst が生成する形 (WITH で元テーブルの列を選び、外側で集計する) の SQL"""
+    prefix = f"{database}.{schema}".lower()
+    if "カテゴリ" in question:
+        return (f"WITH __products AS (\n  SELECT category FROM {prefix}.products\n)\n"
+                "SELECT category, COUNT(*) AS product_count FROM __products GROUP BY category "
+                "ORDER BY product_count DESC NULLS LAST\n -- Generated by Cortex Analyst")
+    dimension = next((column for words, column in _DIMENSIONS if any(word in question for word in words)), "channel")
+    if "件数" in question:
+        selected, measure = dimension, "COUNT(*) AS transaction_count"
+    elif "数量" in question or "個数" in question:
+        selected, measure = f"{dimension}, quantity", "SUM(quantity) AS total_quantity"
+    else:
+        selected, measure = f"{dimension}, total_price", "SUM(total_price) AS total_sales"
+    alias = measure.rsplit(" ", 1)[-1]
+    order = f"{dimension}" if dimension == "date" else f"{alias} DESC NULLS LAST"
+    return (f"WITH __sales_transactions_april AS (\n  SELECT {selected} FROM {prefix}.sales_transactions_april\n)\n"
+            f"SELECT {dimension}, {measure} FROM __sales_transactions_april GROUP BY {dimension} ORDER BY {order}\n"
+            " -- Generated by Cortex Analyst")
+
+
+async def _sleep(seconds: float) -> None:
+    if seconds > 0:
+        await asyncio.sleep(seconds)
+
+
+@contextmanager
+def install(cortex: FakeCortex):
+    """agent_gateway が import した post_cortex_request と、回答生成の stream_cortex_request を FakeCortex に差し替える"""
+    from agent_gateway.gateway import gateway, planner
+    from agent_gateway.tools import snowflake_tools
+    from src.agent import answer_stream
+
+    modules = (gateway, planner, snowflake_tools)
+    originals = [module.post_cortex_request for module in modules]
+    original_stream = answer_stream.stream_cortex_request
+    for module in modules:
+        module.post_cortex_request = cortex.post_cortex_request
+    answer_stream.stream_cortex_request = cortex.stream_cortex_request
+    try:
+        yield cortex
+    finally:
+        for module, original in zip(modules, originals):
+            module.post_cortex_request = original
+        answer_stream.stream_cortex_request = original_stream
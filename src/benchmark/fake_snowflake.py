@@ -0,0 +1,658 @@
+"""
+ベンチマーク用の Snowflake の代わり
+- FakeConnection: SQL を実行せず、ラウンドトリップの遅延だけを模擬するスタブ
+- FakeSnowflake: SQLite で SQL を実際に実行するアカウント相当のバックエンド
+  snowflake.connector の接続・カーソル (execute / executemany / fetch* / fetch_arrow_all / DictCursor)、
+  Snowpark Session の sql().collect()、INFORMATION_SCHEMA、ステージへの PUT と COPY INTO、MERGE、
+  Cortex Search Service (CREATE / SHOW / search) の、このリポジトリで使う範囲を持つ
+  FakePool で接続プールとして差し込む (set_pool(FakePool(backend)) または pool= に渡す)
+遅延は Latency で指定する (SQL 1文ごとのラウンドトリップ・1行ごと・Cortex Search の1回ごと)
+"""
+import csv
+import io
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+from logging import getLogger
+from pathlib import Path
+
+import pyarrow as pa
+from pydantic import BaseModel
+
+from src.common.pool import ConnectionPool
+from src.search.keyword_index import KeywordIndex
+
+logger = getLogger(__name__)
+
+
+class FakeCursor:
+    """snowflake.connector のカーソル互換。1回の execute / executemany を1ラウンドトリップとして遅延を入れる"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._result = []
+
+    def execute(self, query, params=None):
+        self.connection._round_trip(query, 1 if params is not None else 0)
+        self._result = [(0,)]
+        return self
+
+    def executemany(self, query, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        self.connection._round_trip(query, len(seq_of_params))
+        return self
+
+    def fetchone(self):
+        return self._result[0] if self._result else None
+
+    def fetchall(self):
+        return list(self._result)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """
+    ベンチマーク用のSnowflake接続スタブ
+    latency: 1ラウンドトリップあたりの遅延(秒)
+    per_row: 1行あたりの追加遅延(秒)
+    """
+
+    def __init__(self, latency: float = 0.005, per_row: float = 0.0):
+        self.latency = latency
+        self.per_row = per_row
+        self.round_trips = 0
+        self.rows = 0
+        self.statements = []
+
+    def _round_trip(self, query, rows):
+        self.round_trips += 1
+        self.rows += rows
+        self.statements.append(" ".join(query.split())[:80])
+        time.sleep(self.latency + self.per_row * rows)
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class Latency(BaseModel):
+    """FakeSnowflake / FakeCortex に入れる遅延 (秒)"""
+    sql: float = 0.0 # SQL 1文のラウンドトリップ
+    per_row: float = 0.0 # 読み書きした1行あたり
+    search: float = 0.0 # Cortex Search 1回
+    analyst: float = 0.0 # Cortex Analyst の SQL 生成1回
+    complete: float = 0.0 # LLM 呼び出し1回の固定時間
+    per_token: float = 0.0 # LLM の入力1トークンあたり
+    per_output_token: float = 0.0 # LLM の出力1トークンあたり
+
+    def scaled(self, factor: float) -> "Latency":
+        return Latency(**{name: value * factor for name, value in self.model_dump().items()})
+
+
+class Result:
+    __slots__ = ("columns", "rows", "rowcount")
+
+    def __init__(self, columns: list[str], rows: list[tuple], rowcount: int | None = None):
+        self.columns = columns
+        self.rows = rows
+        self.rowcount = len(rows) if rowcount is None else rowcount
+
+
+class SearchService:
+    """CREATE CORTEX SEARCH SERVICE の定義。検索は定義の SELECT の結果に BM25 (文字 bi-gram) をかける"""
+
+    def __init__(self, name: str, search_column: str, attributes: list[str], query: str, created: datetime):
+        self.name = name
+        self.search_column = search_column
+        self.attributes = attributes
+        self.query = query
+        self.created = created
+        self._version = -1
+        self._rows: list[dict] = []
+        self._index: KeywordIndex | None = None
+
+    def search(self, backend: "FakeSnowflake", query: str, columns: list[str], limit: int = 10) -> list[dict]:
+        with backend._lock:
+            if self._version != backend.writes:
+                result = backend._run(self.query, None, record=False)
+                self._rows = [dict(zip(result.columns, row)) for row in result.rows]
+                texts = [(i, "", str(row.get(self.search_column.upper()) or "")) for i, row in enumerate(self._rows)]
+                self._index = KeywordIndex.build(texts, self.name)
+                self._version = backend.writes
+            rows, index = self._rows, self._index
+        hits = index.search(query, limit) if rows else []
+        return [{column: rows[hit.chunk_id].get(column.upper()) for column in columns} for hit in hits]
+
+
+_WRITE = re.compile(
+    r"^(?:INSERT\s+(?:OVERWRITE\s+)?INTO|UPDATE|DELETE\s+FROM|TRUNCATE\s+TABLE(?:\s+IF\s+EXISTS)?|MERGE\s+INTO|COPY\s+INTO"
+    r"|CREATE\s+(?:OR\s+REPLACE\s+)?(?:TEMP(?:ORARY)?\s+)?TABLE(?:\s+IF\s+NOT\s+EXISTS)?|ALTER\s+TABLE)\s+([\w.$]+)",
+    re.IGNORECASE)
+_DROP_TABLE = re.compile(r"^DROP\s+TABLE\s+(?:IF\s+EXISTS\s+)?([\w.$]+)", re.IGNORECASE)
+_NOOP = re.compile(
+    r"^(?:CREATE\s+(?:OR\s+REPLACE\s+)?(?:DATABASE|SCHEMA|WAREHOUSE|PROCEDURE)|USE\s|ALTER\s+(?:ACCOUNT|SESSION|WAREHOUSE)"
+    r"|CALL\s|GRANT\s|BEGIN$)", re.IGNORECASE)
+_KIND = re.compile(r"^(CREATE|ALTER|DROP|SHOW)\s+(?:OR\s+REPLACE\s+)?(?:TEMP(?:ORARY)?\s+)?(CORTEX\s+SEARCH\s+SERVICES?|\w+)")
+_FLAGS = re.IGNORECASE | re.DOTALL
+
+
+class FakeSnowflake:
+    """
+    SQLite (既定はメモリ上) で SQL を実行する Snowflake アカウントの代わり
+    - database.schema. の修飾は外して SQLite のテーブル名にする
+    - INFORMATION_SCHEMA.TABLES / COLUMNS / STAGES / CORTEX_SEARCH_SERVICES を参照時に作り直す (LAST_ALTERED は書き込み時刻)
+    - 実行した文は statements に残す (種類ごとの件数は statement_counts)
+    接続はすべて1つの SQLite 接続を共有する。遅延はロックの外で入れるので、並行した問い合わせは重なる
+    """
+
+    def __init__(self, database: str = "CORTEX_AGENTS_DB", schema: str = "CORTEX_AGENTS_SCHEMA",
+                 latency: Latency | None = None, path: str = ":memory:"):
+        self.database = database.upper()
+        self.schema = schema.upper()
+        self.warehouse = "COMPUTE_WH"
+        self.role = "SYSADMIN" # USE ROLE で変わる (接続ごとではなくアカウント全体で1つ)
+        self.host = "fake-account.snowflakecomputing.com"
+        self.latency = latency or Latency()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None,
+                                  detect_types=sqlite3.PARSE_DECLTYPES)
+        self.stages: dict[str, dict[str, bytes]] = {}
+        self.stage_created: dict[str, datetime] = {}
+        self.services: dict[str, SearchService] = {}
+        self.last_altered: dict[str, datetime] = {}
+        self.created: dict[str, datetime] = {}
+        self.statements: list[str] = []
+        self.round_trips = 0
+        self.rows = 0
+        self.writes = 0 # 書き込みのたびに増える (検索サービスの再読み込みに使う)
+        self._clock = datetime.now()
+        self._lock = threading.RLock()
+        self._qualifier = re.compile(rf"\b(?:{re.escape(self.database)}\.)?{re.escape(self.schema)}\.", re.IGNORECASE)
+        self._handlers = [
+            (re.compile(r"^SELECT\s+CURRENT_VERSION\(\)\s*$", _FLAGS), self._current_version),
+            (re.compile(r"^SELECT\s+CURRENT_ROLE\(\)\s*$", _FLAGS), self._current_role),
+            (re.compile(r"^USE\s+ROLE\s+(\w+)\s*$", _FLAGS), self._use_role),
+            (_NOOP, self._noop),
+            (re.compile(r"^CREATE\s+(?:OR\s+REPLACE\s+)?STAGE\s+(?:IF\s+NOT\s+EXISTS\s+)?([\w.$]+)", _FLAGS), self._create_stage),
+            (re.compile(r"^DROP\s+STAGE\s+(?:IF\s+EXISTS\s+)?([\w.$]+)", _FLAGS), self._drop_stage),
+            (re.compile(r"^CREATE\s+(OR\s+REPLACE\s+)?CORTEX\s+SEARCH\s+SERVICE\s+(IF\s+NOT\s+EXISTS\s+)?([\w.$]+)\s+ON\s+(\w+)\s+"
+                        r"(?:ATTRIBUTES\s+(.+?)\s+)?WAREHOUSE\s*=\s*\S+\s+TARGET_LAG\s*=\s*'[^']*'\s+AS\s+(.+)$", _FLAGS),
+             self._create_search_service),
+            (re.compile(r"^DROP\s+CORTEX\s+SEARCH\s+SERVICE\s+(?:IF\s+EXISTS\s+)?([\w.$]+)", _FLAGS), self._drop_search_service),
+            (re.compile(r"^SHOW\s+CORTEX\s+SEARCH\s+SERVICES", _FLAGS), self._show_search_services),
+            (re.compile(r"^PUT\s+'?file://(.+?)'?\s+(@\S+)", _FLAGS), self._put),
+            (re.compile(r"^COPY\s+INTO\s+([\w.$]+)\s*\(([^)]*)\)\s+FROM\s+(@\S+)\s+FILES\s*=\s*\('([^']+)'\)", _FLAGS), self._copy_into),
+            (re.compile(r"^CREATE\s+(?:OR\s+REPLACE\s+)?TEMP(?:ORARY)?\s+TABLE\s+([\w.$]+)\s+LIKE\s+([\w.$]+)\s*$", _FLAGS),
+             self._create_table_like),
+            (re.compile(r"^CREATE\s+OR\s+REPLACE\s+TABLE\s+([\w.$]+)\s+(.+)$", _FLAGS), self._create_or_replace_table),
+            (re.compile(r"^ALTER\s+TABLE\s+([\w.$]+)\s+ADD\s+COLUMN\s+IF\s+NOT\s+EXISTS\s+(\w+)\s+(\w+)", _FLAGS), self._add_column),
+            (re.compile(r"^MERGE\s+INTO\s+([\w.$]+)\s+(\w+)\s+USING\s+([\w.$]+)\s+(\w+)\s+ON\s+(.+?)\s+"
+                        r"WHEN\s+MATCHED\s+THEN\s+UPDATE\s+SET\s+(.+?)\s+"
+                        r"WHEN\s+NOT\s+MATCHED\s+THEN\s+INSERT\s*\(([^)]*)\)\s*VALUES\s*\(([^)]*)\)\s*$", _FLAGS), self._merge),
+        ]
+
+    def connect(self) -> "FakeSnowflakeConnection":
+        return FakeSnowflakeConnection(self)
+
+    def root(self) -> "FakeRoot":
+        return FakeRoot(self)
+
+    def statement_counts(self) -> dict[str, int]:
+        """実行した文の種類 (先頭の語。CREATE / ALTER / DROP は対象の種類まで) ごとの件数"""
+        counts: dict[str, int] = {}
+        for statement in self.statements:
+            match = _KIND.match(statement)
+            kind = " ".join(match.group(1, 2)) if match else statement.split(" ", 1)[0]
+            counts[kind] = counts.get(kind, 0) + 1
+        return counts
+
+    def reset_statistics(self) -> None:
+        with self._lock:
+            self.statements.clear()
+            self.round_trips = 0
+            self.rows = 0
+
+    def execute(self, sql: str, params=None) -> Result:
+        text = sql.strip().rstrip(";").strip()
+        for pattern, handler in self._handlers:
+            match = pattern.match(text)
+            if match:
+                with self._lock:
+                    self._record(text)
+                    result = handler(match)
+                break
+        else:
+            with self._lock:
+                self._record(text)
+                result = self._run(text, params)
+        self._wait(result.rowcount if result.rowcount and result.rowcount > 0 else len(result.rows))
+        return result
+
+    def executemany(self, sql: str, seq_of_params) -> Result:
+        seq_of_params = list(seq_of_params)
+        text = sql.strip().rstrip(";").strip()
+        with self._lock:
+            self._record(text)
+            self.db.execute("BEGIN")
+            try:
+                cursor = self.db.executemany(self._translate(text, seq_of_params[0] if seq_of_params else None),
+                                             [self._params(p) for p in seq_of_params])
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+            self._touch_written(text)
+        self._wait(len(seq_of_params))
+        return Result([], [], cursor.rowcount)
+
+    def _record(self, text: str) -> None:
+        self.statements.append(" ".join(text.split())[:200].upper())
+        self.round_trips += 1
+
+    def _wait(self, rows: int) -> None:
+        self.rows += rows
+        delay = self.latency.sql + self.latency.per_row * rows
+        if delay > 0:
+            time.sleep(delay)
+
+    def _now(self) -> datetime:
+        """書き込みの時刻 (同じ時刻にならないように単調に増やす)"""
+        now = datetime.now()
+        self._clock = max(now, self._clock + timedelta(microseconds=1))
+        return self._clock
+
+    def _name(self, qualified: str) -> str:
+        return qualified.rsplit(".", 1)[-1].strip('"').upper()
+
+    def _touch(self, table: str) -> None:
+        name = self._name(table)
+        now = self._now()
+        self.created.setdefault(name, now)
+        self.last_altered[name] = now
+        self.writes += 1
+
+    def _touch_written(self, text: str) -> None:
+        match = _WRITE.match(text)
+        if match:
+            self._touch(match.group(1))
+            return
+        match = _DROP_TABLE.match(text)
+        if match:
+            self.last_altered.pop(self._name(match.group(1)), None)
+            self.created.pop(self._name(match.group(1)), None)
+            self.writes += 1
+
+    def _translate(self, text: str, params=None) -> str:
+        sql = self._qualifier.sub("", text)
+        sql = re.sub(r"\bINFORMATION_SCHEMA\.(\w+)", lambda m: f"_information_schema_{m.group(1).lower()}", sql, flags=re.I)
+        sql = re.sub(r"\bCURRENT_SCHEMA\(\)", f"'{self.schema}'", sql, flags=re.I)
+        sql = re.sub(r"\bCURRENT_DATABASE\(\)", f"'{self.database}'", sql, flags=re.I)
+        if isinstance(params, dict):
+            sql = re.sub(r"%\((\w+)\)s", r":\1", sql)
+        elif params is not None:
+            sql = sql.replace("%s", "?")
+        return sql
+
+    def _params(self, params):
+        if params is None or isinstance(params, dict):
+            return params or ()
+        return tuple(params)
+
+    def _run(self, text: str, params, record: bool = True) -> Result:
+        sql = self._translate(text, params)
+        if "_information_schema_" in sql.lower():
+            self._refresh_information_schema()
+        cursor = self.db.execute(sql, self._params(params))
+        rows = cursor.fetchall() if cursor.description else []
+        columns = [d[0].upper() for d in cursor.description] if cursor.description else []
+        if record:
+            self._touch_written(text)
+        return Result(columns, rows, cursor.rowcount if not cursor.description else None)
+
+    def _user_tables(self) -> list[tuple[str, str]]:
+        return self.db.execute(
+            "SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view') "
+            "AND name NOT LIKE 'sqlite_%' AND name NOT LIKE '\\_information\\_schema\\_%' ESCAPE '\\' ORDER BY name").fetchall()
+
+    def _refresh_information_schema(self) -> None:
+        """INFORMATION_SCHEMA の各ビューを SQLite のテーブルとして作り直す"""
+        db = self.db
+        for name in ("tables", "columns", "stages", "cortex_search_services"):
+            db.execute(f"DROP TABLE IF EXISTS _information_schema_{name}")
+        db.execute("CREATE TABLE _information_schema_tables (TABLE_CATALOG TEXT, TABLE_SCHEMA TEXT, TABLE_NAME TEXT, "
+                   "TABLE_TYPE TEXT, ROW_COUNT INTEGER, CREATED TIMESTAMP, LAST_ALTERED TIMESTAMP)")
+        db.execute("CREATE TABLE _information_schema_columns (TABLE_CATALOG TEXT, TABLE_SCHEMA TEXT, TABLE_NAME TEXT, "
+                   "COLUMN_NAME TEXT, ORDINAL_POSITION INTEGER, DATA_TYPE TEXT, IS_NULLABLE TEXT)")
+        db.execute("CREATE TABLE _information_schema_stages (STAGE_CATALOG TEXT, STAGE_SCHEMA TEXT, STAGE_NAME TEXT, "
+                   "STAGE_TYPE TEXT, CREATED TIMESTAMP)")
+        db.execute("CREATE TABLE _information_schema_cortex_search_services (SERVICE_CATALOG TEXT, SERVICE_SCHEMA TEXT, "
+                   "SERVICE_NAME TEXT, SEARCH_COLUMN TEXT, ATTRIBUTE_COLUMNS TEXT, DEFINITION TEXT, CREATED TIMESTAMP)")
+        tables, columns = [], []
+        for name, type_ in self._user_tables():
+            upper = name.upper()
+            count = db.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+            tables.append((self.database, self.schema, upper, "VIEW" if type_ == "view" else "BASE TABLE", count,
+                           self.created.get(upper, self._clock), self.last_altered.get(upper, self._clock)))
+            for position, column in enumerate(db.execute(f'PRAGMA table_info("{name}")').fetchall(), start=1):
+                columns.append((self.database, self.schema, upper, column[1].upper(), position,
+                                (column[2] or "TEXT").upper(), "NO" if column[3] else "YES"))
+        db.executemany("INSERT INTO _information_schema_tables VALUES (?, ?, ?, ?, ?, ?, ?)", tables)
+        db.executemany("INSERT INTO _information_schema_columns VALUES (?, ?, ?, ?, ?, ?, ?)", columns)
+        db.executemany("INSERT INTO _information_schema_stages VALUES (?, ?, ?, ?, ?)",
+                       [(self.database, self.schema, name, "Internal Named", created)
+                        for name, created in self.stage_created.items()])
+        db.executemany("INSERT INTO _information_schema_cortex_search_services VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       [(self.database, self.schema, s.name, s.search_column, ",".join(s.attributes), s.query, s.created)
+                        for s in self.services.values()])
+
+    def _current_version(self, match) -> Result:
+        return Result(["CURRENT_VERSION()"], [("8.0.0-fake",)])
+
+    def _current_role(self, match) -> Result:
+        return Result(["CURRENT_ROLE()"], [(self.role,)])
+
+    def _use_role(self, match) -> Result:
+        self.role = match.group(1).upper()
+        return self._noop(match)
+
+    def _noop(self, match) -> Result:
+        return Result(["status"], [("Statement executed successfully.",)], 0)
+
+    def _create_stage(self, match) -> Result:
+        name = self._name(match.group(1))
+        if "REPLACE" in match.group(0).upper() or name not in self.stages:
+            self.stages[name] = {}
+            self.stage_created[name] = self._now()
+        return Result(["status"], [(f"Stage area {name} successfully created.",)], 0)
+
+    def _drop_stage(self, match) -> Result:
+        name = self._name(match.group(1))
+        self.stages.pop(name, None)
+        self.stage_created.pop(name, None)
+        return Result(["status"], [(f"{name} successfully dropped.",)], 0)
+
+    def _create_search_service(self, match) -> Result:
+        replace, if_not_exists, qualified, column, attributes, query = match.groups()
+        name = self._name(qualified)
+        if name in self.services and if_not_exists and not replace:
+            return Result(["status"], [(f"{name} already exists, statement succeeded.",)], 0)
+        self.services[name] = SearchService(
+            name, column, [a.strip() for a in (attributes or "").split(",") if a.strip()], " ".join(query.split()), self._now())
+        return Result(["status"], [(f"Cortex search service {name} successfully created.",)], 0)
+
+    def _drop_search_service(self, match) -> Result:
+        name = self._name(match.group(1))
+        self.services.pop(name, None)
+        return Result(["status"], [(f"{name} successfully dropped.",)], 0)
+
+    def _show_search_services(self, match) -> Result:
+        columns = ["created_on", "name", "database_name", "schema_name", "search_column", "attribute_columns", "definition"]
+        rows = [(s.created, s.name, self.database, self.schema, s.search_column, ",".join(s.attributes), s.query)
+                for s in self.services.values()]
+        return Result(columns, rows)
+
+    def _put(self, match) -> Result:
+        path, stage = Path(match.group(1)), match.group(2)
+        # AUTO_COMPRESS=FALSE でなければ .gz を付けて置く (中身は圧縮しない)
+        target = path.name if re.search(r"AUTO_COMPRESS\s*=\s*FALSE", match.string, re.IGNORECASE) else path.name + ".gz"
+        self.stages.setdefault(stage.upper(), {})[target] = path.read_bytes()
+        return Result(["source", "target", "status"], [(path.name, target, "UPLOADED")])
+
+    def _copy_into(self, match) -> Result:
+        table, columns, stage, file_name = match.groups()
+        data = self.stages.get(stage.upper(), {}).pop(file_name, None)
+        if data is None:
+            raise sqlite3.OperationalError(f"Remote file '{file_name}' was not found in {stage}")
+        # EMPTY_FIELD_AS_NULL = TRUE
+        rows = [tuple(value if value != "" else None for value in row)
+                for row in csv.reader(io.StringIO(data.decode("utf-8")))]
+        names = [c.strip() for c in columns.split(",")]
+        self.db.execute("BEGIN")
+        self.db.executemany(f"INSERT INTO {self._translate(table)} ({', '.join(names)}) "
+                            f"VALUES ({', '.join('?' * len(names))})", rows)
+        self.db.execute("COMMIT")
+        self._touch(table)
+        return Result(["file", "status", "rows_loaded"], [(file_name, "LOADED", len(rows))], len(rows))
+
+    def _create_table_like(self, match) -> Result:
+        table, source = (self._translate(name) for name in match.groups())
+        self.db.execute(f"DROP TABLE IF EXISTS {table}")
+        self.db.execute(f"CREATE TEMP TABLE {table} AS SELECT * FROM {source} WHERE 0")
+        return Result(["status"], [(f"Table {self._name(table)} successfully created.",)], 0)
+
+    def _create_or_replace_table(self, match) -> Result:
+        table, body = match.groups()
+        self.db.execute(f"DROP TABLE IF EXISTS {self._translate(table)}")
+        self.db.execute(f"CREATE TABLE {self._translate(table)} {self._translate(body)}")
+        self._touch(table)
+        return Result(["status"], [(f"Table {self._name(table)} successfully created.",)], 0)
+
+    def _add_column(self, match) -> Result:
+        table, column, type_ = match.groups()
+        existing = {row[1].upper() for row in self.db.execute(f"PRAGMA table_info({self._name(table)})")}
+        if column.upper() not in existing:
+            self.db.execute(f"ALTER TABLE {self._translate(table)} ADD COLUMN {column} {type_}")
+            self._touch(table)
+        return Result(["status"], [("Statement executed successfully.",)], 0)
+
+    def _merge(self, match) -> Result:
+        """MERGE (一致すれば UPDATE、なければ INSERT) を UPDATE ... FROM と INSERT ... SELECT に分けて実行する"""
+        target, t, source, s, on, assignments, columns, values = match.groups()
+        target, source = self._translate(target), self._translate(source)
+        assignments = re.sub(rf"\b{t}\.(\w+)\s*=", r"\1 =", assignments)
+        self.db.execute("BEGIN")
+        try:
+            updated = self.db.execute(f"UPDATE {target} AS {t} SET {assignments} FROM {source} AS {s} WHERE {on}").rowcount
+            inserted = self.db.execute(
+                f"INSERT INTO {target} ({columns}) SELECT {values} FROM {source} AS {s} "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {target} AS {t} WHERE {on})").rowcount
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        self._touch(target)
+        return Result(["number of rows inserted", "number of rows updated"], [(inserted, updated)], inserted + updated)
+
+
+class FakeSnowflakeCursor:
+    """snowflake.connector のカーソル互換 (DictCursor を指定すると行を dict で返す)"""
+
+    def __init__(self, connection: "FakeSnowflakeConnection", as_dict: bool = False):
+        self.connection = connection
+        self.as_dict = as_dict
+        self.description = None
+        self.rowcount = -1
+        self.sfqid = None
+        self._columns: list[str] = []
+        self._rows: list = []
+        self._position = 0
+
+    def execute(self, command: str, params=None, **kwargs):
+        self._set(self.connection.backend.execute(command, params))
+        return self
+
+    def executemany(self, command: str, seq_of_params):
+        self._set(self.connection.backend.executemany(command, seq_of_params))
+        return self
+
+    def _set(self, result: Result) -> None:
+        self._columns = result.columns
+        self._rows = [dict(zip(result.columns, row)) for row in result.rows] if self.as_dict else list(result.rows)
+        self._position = 0
+        self.rowcount = result.rowcount
+        self.description = [(name, None, None, None, None, None, True) for name in result.columns] or None
+        self.sfqid = f"fake-{self.connection.backend.round_trips}"
+
+    def fetchone(self):
+        if self._position >= len(self._rows):
+            return None
+        row = self._rows[self._position]
+        self._position += 1
+        return row
+
+    def fetchmany(self, size: int = 1):
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return rows
+
+    def fetch_arrow_all(self):
+        """Snowflake と同じく、結果が0行なら None を返す"""
+        rows = self.fetchall()
+        if not rows:
+            return None
+        if self.as_dict:
+            rows = [tuple(row.values()) for row in rows]
+        return pa.table({name: [row[i] for row in rows] for i, name in enumerate(self._columns)})
+
+    def fetch_pandas_all(self):
+        import pandas as pd
+
+        return pd.DataFrame(self.fetchall(), columns=self._columns)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        pass
+
+
+class _Rest:
+    token = "fake-token"
+
+
+class _DataFrame:
+    """Snowpark の session.sql(...) の戻り値の代わり (collect だけ)"""
+
+    def __init__(self, connection: "FakeSnowflakeConnection", query: str):
+        self.connection = connection
+        self.query = query
+
+    def collect(self) -> list[tuple]:
+        return self.connection.cursor().execute(self.query).fetchall()
+
+
+class FakeSnowflakeConnection:
+    """
+    snowflake.connector の接続と Snowpark Session (sql().collect()) を兼ねる
+    CortexEndpointBuilder が使う host / rest.token / database / schema も持つ
+    """
+    scheme = "https"
+
+    def __init__(self, backend: FakeSnowflake):
+        self.backend = backend
+        self.host = backend.host
+        self.database = backend.database
+        self.schema = backend.schema
+        self.warehouse = backend.warehouse
+        self.rest = _Rest()
+        self._closed = False
+
+    def cursor(self, cursor_class=None) -> FakeSnowflakeCursor:
+        return FakeSnowflakeCursor(self, as_dict=cursor_class is not None and cursor_class.__name__ == "DictCursor")
+
+    def sql(self, query: str) -> _DataFrame:
+        return _DataFrame(self, query)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self._closed = True
+
+    def is_closed(self) -> bool:
+        return self._closed
+
+
+class _Lookup:
+    def __init__(self, get):
+        self._get = get
+
+    def __getitem__(self, key):
+        return self._get(key)
+
+
+class _SearchResponse:
+    def __init__(self, results: list[dict]):
+        self.results = results
+
+
+class FakeSearchServiceResource:
+    """snowflake.core の CortexSearchServiceResource の代わり (search だけ)"""
+
+    def __init__(self, backend: FakeSnowflake, name: str):
+        self.backend = backend
+        self.name = name.upper()
+
+    def search(self, query: str, columns: list[str], limit: int = 10, filter=None, **kwargs) -> _SearchResponse:
+        return _SearchResponse(search(self.backend, self.name, query, columns, limit))
+
+
+class FakeRoot:
+    """Root(session).databases[..].schemas[..].cortex_search_services[..] の代わり"""
+
+    def __init__(self, backend: FakeSnowflake):
+        self.databases = _Lookup(lambda database: _FakeDatabase(backend))
+
+
+class _FakeDatabase:
+    def __init__(self, backend: FakeSnowflake):
+        self.schemas = _Lookup(lambda schema: _FakeSchema(backend))
+
+
+class _FakeSchema:
+    def __init__(self, backend: FakeSnowflake):
+        self.cortex_search_services = _Lookup(lambda name: FakeSearchServiceResource(backend, name))
+
+
+def search(backend: FakeSnowflake, service_name: str, query: str, columns: list[str], limit: int = 10) -> list[dict]:
+    """Cortex Search Service の検索 (Latency.search の遅延を入れる)"""
+    service = backend.services.get(service_name.upper())
+    if service is None:
+        raise KeyError(f"Cortex Search Service {service_name} does not exist")
+    results = service.search(backend, query, columns, limit)
+    if backend.latency.search > 0:
+        time.sleep(backend.latency.search)
+    return results
+
+
+class FakePool(ConnectionPool):
+    """FakeSnowflake の接続を貸し出すプール (Session は接続そのもの、Root は FakeRoot)"""
+
+    def __init__(self, backend: FakeSnowflake, **kwargs):
+        super().__init__(connect=backend.connect, **kwargs)
+        self.backend = backend
+
+    def session(self, connection):
+        return connection
+
+    def root(self, session):
+        return self.backend.root()
+
+
+def _adapt_datetime(value: datetime) -> str:
+    return value.isoformat(" ")
+
+
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_converter("DATE", lambda value: date.fromisoformat(value.decode()[:10]))
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
@@ -0,0 +1,100 @@
+"""
+ハイブリッド検索 (BM25 + ベクトル) の検索品質とレイテンシのベンチマーク (埋め込みは HashingEmbedder で外部APIなし)
+サンプルPDFのチャンク + 合成チャンク + 条番号つきのチャンクに対して、固定のクエリ集合で
+BM25 / ベクトル / ハイブリッド (weighted, rrf) の hit@k, MRR@k と検索レイテンシを出す
+正解は「空白を除いた本文に正解キーワードを含むチャンク」
+python -m src.benchmark.hybrid_bench --chunks 20000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from src.benchmark.chunking_bench import LINES
+from src.benchmark.vector_index_bench import corpus
+from src.search.embedder import HashingEmbedder
+from src.search.hybrid import HybridRetriever
+from src.search.keyword_index import KeywordIndex
+from src.search.vector_index import VectorIndex
+
+# (クエリ, 正解キーワード)
+QUERIES = [
+    ("海外売上比率はいくつですか", "海外売上比率"),
+    ("従業員数は何名ですか", "従業員数"),
+    ("会社の設立はいつですか", "設立"),
+    ("IoT対応家電の市場はどのくらい成長していますか", "IoT対応家電"),
+    ("為替変動リスクへの対策は", "為替変動リスク"),
+    ("ショールーム第2号店のオープン時期", "ショールーム第2号店"),
+    ("ECサイト訪問者数の実績", "ECサイト訪問者数"),
+    ("4月の月間売上高", "月間売上高"),
+    ("物流遅延リスクにどう対応するか", "物流遅延リスク"),
+    ("競合製品リスクへの対応", "競合製品リスク"),
+    ("アジア新興国での代理店網", "代理店網"),
+    ("会社のビジョン", "ビジョン"),
+    ("36協定の上限", "36協定"),
+    # 言い換え (正解キーワードそのものを含まない)
+    ("海外での売上の割合", "海外売上比率"),
+    ("社員の人数", "従業員数"),
+    ("為替の変動に対するヘッジ", "為替変動リスク"),
+]
+ARTICLES = 500 # 条番号つきのチャンク数 (完全一致が必要なクエリ用)
+ARTICLE_QUERIES = 10
+
+
+def build_corpus(size: int, seed: int = 0) -> tuple[list[tuple[int, str, str]], list[tuple[str, str]]]:
+    rows = corpus(size - ARTICLES, seed)
+    rng = random.Random(seed)
+    numbers = rng.sample(range(1, 10000), ARTICLES)
+    for n in numbers:
+        rows.append((len(rows), "articles.pdf", f"第{n}条 " + rng.choice(LINES[1:])))
+    queries = QUERIES + [(f"第{n}条には何が書いてありますか", f"第{n}条") for n in rng.sample(numbers, ARTICLE_QUERIES)]
+    return rows, queries
+
+
+def squash(text: str) -> str:
+    return "".join(text.split())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--alpha", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=5, help="レイテンシ計測の繰り返し回数")
+    args = parser.parse_args()
+
+    rows, queries = build_corpus(args.chunks)
+    embedder = HashingEmbedder()
+    start = time.perf_counter()
+    vector_index = VectorIndex.build(rows, embedder, "BENCH", batch_size=1024)
+    vector_build = time.perf_counter() - start
+    start = time.perf_counter()
+    keyword_index = KeywordIndex.build(rows, "BENCH")
+    keyword_build = time.perf_counter() - start
+    print(f"chunks={len(rows)}  queries={len(queries)}  build: vector {vector_build:.2f}s / bm25 {keyword_build:.2f}s "
+          f"({keyword_index.manifest.terms}語, postings {len(keyword_index.doc_ids)})")
+
+    retrievers = {
+        "bm25": HybridRetriever(keyword_index=keyword_index),
+        "vector": HybridRetriever(vector_index=vector_index, embedder=embedder),
+        "hybrid (weighted)": HybridRetriever(vector_index, keyword_index, embedder, alpha=args.alpha),
+        "hybrid (rrf)": HybridRetriever(vector_index, keyword_index, embedder, method="rrf"),
+    }
+    for label, retriever in retrievers.items():
+        hits, reciprocal, latencies = 0, 0.0, []
+        for query, answer in queries:
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                found = retriever.search(query, args.k)
+                latencies.append(time.perf_counter() - start)
+            rank = next((i + 1 for i, r in enumerate(found.results) if squash(answer) in squash(r.text)), None)
+            hits += rank is not None
+            reciprocal += 1.0 / rank if rank else 0.0
+        latencies.sort()
+        print(f"{label:>18}: hit@{args.k} {hits / len(queries):.2f}  MRR@{args.k} {reciprocal / len(queries):.2f}  "
+              f"p50 {statistics.median(latencies) * 1000:6.2f} ms  "
+              f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+差分取り込み (IncrementalIngest) の回帰チェック (FakeSnowflake で資格情報なしに実行できる)
+既にテーブルとマニフェストがある状態でチャンク設定を変えたとき、テーブルが新しいチャンクだけになることを確かめる
+- recursive で取り込んだあと既定 (CHUNK_STRATEGY 未設定 = structured) で再起動する: recursive の行が残らない
+- チャンクのトークン上限を変える: 余剰の古いチャンク (chunk_id が新しいチャンク数以上) が残らない
+- 設定を変えると同時に PDF を1つ消す: そのファイルの行が残らない
+- マニフェストにないファイル名の行 (以前の取り込み方式の行): 残らない
+どれかが満たされなければ AssertionError で終了する
+python -m src.benchmark.ingest_check
+"""
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from src.benchmark.fake_snowflake import FakePool, FakeSnowflake
+from src.benchmark.suite import isolate, search_preprocess
+from src.search.preprocess import Search_preprocess
+
+
+def ingest(pool: FakePool, work_dir: Path, data_dir: Path, **settings) -> int:
+    """Search_preprocess.run() を実行し、新しい設定でのチャンク数を返す"""
+    preprocess = search_preprocess(pool, work_dir)
+    preprocess.data_dir = data_dir
+    for name, value in settings.items():
+        setattr(preprocess, name, value)
+    try:
+        preprocess.run()
+        return sum(1 for _ in preprocess.iter_chunks(sorted(data_dir.glob("*.pdf"))))
+    finally:
+        preprocess.close()
+
+
+def rows(backend: FakeSnowflake) -> list[tuple]:
+    return backend.execute(f"SELECT file_name, chunk_id, text FROM {Search_preprocess.table}").rows
+
+
+def check(label: str, backend: FakeSnowflake, expected: int, files: set[str]) -> None:
+    actual = rows(backend)
+    names = {name for name, _, _ in actual}
+    assert len(actual) == expected, f"{label}: 行数 {len(actual)} がチャンク数 {expected} と一致しません"
+    assert names == files, f"{label}: ファイル {sorted(names)} が {sorted(files)} と一致しません"
+    print(f"  OK {label}: {len(actual)}行 ({len(files)}ファイル)")
+
+
+def main():
+    load_dotenv(encoding="utf-8", override=True)
+    work_dir = Path(tempfile.mkdtemp(prefix="agent-gateway-ingest-"))
+    isolate(work_dir)
+    os.environ.pop("CHUNK_STRATEGY", None)
+    logging.getLogger().setLevel(logging.WARNING)
+    backend = FakeSnowflake(os.environ["SNOWFLAKE_DATABASE"], os.environ["SNOWFLAKE_SCHEMA"])
+    pool = FakePool(backend)
+
+    # 同じ PDF を2つ置き、片方をあとで消す
+    data_dir = work_dir / "data"
+    data_dir.mkdir()
+    source = sorted((Path(__file__).resolve().parents[1] / "search" / "data").glob("*.pdf"))[0]
+    shutil.copy(source, data_dir / "a.pdf")
+    shutil.copy(source, data_dir / "b.pdf")
+
+    print("ingest_check")
+    expected = ingest(pool, work_dir, data_dir, chunk_strategy="recursive")
+    check("初回 (recursive)", backend, expected, {"a.pdf", "b.pdf"})
+
+    expected = ingest(pool, work_dir, data_dir)
+    check("既定の設定で再起動 (recursive → structured)", backend, expected, {"a.pdf", "b.pdf"})
+    preprocess = search_preprocess(pool, work_dir)
+    try:
+        chunks = {chunk.text for chunk in preprocess.iter_chunks([data_dir / "a.pdf"])}
+    finally:
+        preprocess.close()
+    assert {text for _, _, text in rows(backend)} == chunks, "structured のチャンク以外の行が残っています"
+
+    expected = ingest(pool, work_dir, data_dir, chunk_strategy="structured", chunk_max_tokens=80)
+    check("トークン上限の変更 (既定 → 80)", backend, expected, {"a.pdf", "b.pdf"})
+
+    expected = ingest(pool, work_dir, data_dir, chunk_strategy="structured", chunk_max_tokens=400)
+    check("トークン上限の変更 (80 → 400)", backend, expected, {"a.pdf", "b.pdf"})
+
+    backend.execute(f"INSERT INTO {Search_preprocess.table} (chunk_id, file_name, text) VALUES (0, 'legacy.pdf', 'old')")
+    (data_dir / "b.pdf").unlink()
+    expected = ingest(pool, work_dir, data_dir, chunk_strategy="structured", chunk_max_tokens=80)
+    check("設定の変更と同時にファイルを削除・以前の方式の行", backend, expected, {"a.pdf"})
+
+    expected = ingest(pool, work_dir, data_dir, chunk_strategy="structured", chunk_max_tokens=80)
+    check("変更なしの再実行", backend, expected, {"a.pdf"})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+プロンプトを繰り返したときのログ取得のメモリ・処理時間を比較するベンチマーク
+- legacy: 従来の main.py。プロンプトごとに StreamlitLogHandler をルートロガーに追加し、外さない
+- capture: LogCapture。ハンドラは1つで、セッションごとのリングバッファに保持する
+python -m src.benchmark.log_capture_bench --prompts 200 --lines 20
+"""
+import argparse
+import io
+import logging
+import time
+import tracemalloc
+import uuid
+
+from src.common.log_capture import LogCapture
+
+
+class LegacyLogHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.log_buffer = io.StringIO()
+        self.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+
+    def emit(self, record):
+        self.log_buffer.write(self.format(record) + "\n")
+
+
+def emit_prompt_logs(logger: logging.Logger, lines: int, prompt: int) -> None:
+    for i in range(lines - 1):
+        logger.info(f"prompt {prompt} planner output line {i}")
+    logger.info("running cortex_search_svc_cortexsearch task")
+
+
+def bench_legacy(logger: logging.Logger, prompts: int, lines: int) -> tuple[float, int, int]:
+    handlers = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    for prompt in range(prompts):
+        handler = LegacyLogHandler()
+        logger.addHandler(handler)
+        handlers.append(handler)
+        emit_prompt_logs(logger, lines, prompt)
+    elapsed = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    for handler in handlers:
+        logger.removeHandler(handler)
+    return elapsed, memory, len(handlers)
+
+
+def bench_capture(logger: logging.Logger, prompts: int, lines: int, sessions: int) -> tuple[float, int, int]:
+    capture = LogCapture()
+    logger.addHandler(capture)
+    session_ids = [str(uuid.uuid4()) for _ in range(sessions)]
+    tracemalloc.start()
+    start = time.perf_counter()
+    for prompt in range(prompts):
+        with capture.request(session_ids[prompt % sessions], str(prompt)):
+            emit_prompt_logs(logger, lines, prompt)
+    elapsed = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    logger.removeHandler(capture)
+    return elapsed, memory, 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prompts", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=20, help="1プロンプトで出るログ行数")
+    parser.add_argument("--sessions", type=int, default=10)
+    args = parser.parse_args()
+
+    logger = logging.getLogger("log_capture_bench")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    # プロンプト数を増やしてもメモリが増えないことを確認する
+    # (legacy は1行あたりの処理がハンドラ数に比例するので、大きい回数では計測しない)
+    for prompts in (args.prompts // 4, args.prompts, args.prompts * 10):
+        results = [("capture", bench_capture(logger, prompts, args.lines, args.sessions))]
+        if prompts <= args.prompts:
+            results.insert(0, ("legacy", bench_legacy(logger, prompts, args.lines)))
+        for name, (elapsed, memory, handlers) in results:
+            print(f"{name:>8} prompts={prompts:6d}: {elapsed:7.3f}s  memory {memory / 1024 / 1024:8.2f} MiB"
+                  f"  handlers {handlers}")
+
+if __name__ == "__main__":
+    main()
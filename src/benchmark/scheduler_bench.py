@@ -0,0 +1,99 @@
+"""
+プラン内の独立したツール呼び出しの実行時間を比較するベンチマーク (ツールは遅延を入れたスタブ)
+agent_gateway の TaskProcessor で、Search 2件 + Analyst 1件 (互いに独立) のプランを実行する
+- direct: ツールの func をそのまま呼ぶ (同期処理がイベントループを止める)
+- scheduled: ToolScheduler 経由 (専用スレッドで実行、同時実行数の上限・タイムアウト付き)
+python -m src.benchmark.scheduler_bench --blocking 0.3 --waiting 0.3
+"""
+import argparse
+import asyncio
+import time
+
+from agent_gateway.gateway.task_processor import Task, TaskProcessor
+
+from src.agent.scheduler import ToolLimits, ToolScheduler, tracing
+
+
+class DelayedTool:
+    """
+    Cortex のツールを模したスタブ
+    blocking 秒の同期処理 (メタデータ取得・SQL 実行) のあと、waiting 秒の非同期待ち (REST 呼び出し) をする
+    """
+
+    def __init__(self, name: str, blocking: float, waiting: float):
+        self.name = name
+        self.blocking = blocking
+        self.waiting = waiting
+
+    def func(self, query: str):
+        async def call():
+            time.sleep(self.blocking)
+            await asyncio.sleep(self.waiting)
+            return {"output": f"{self.name}: {query}", "sources": {"tool_type": self.name, "tool_name": self.name}}
+        return call()
+
+
+def plan(tools: list[DelayedTool]) -> dict[str, Task]:
+    return {
+        str(i): Task(idx=str(i), name=tool.name, tool=tool.func, args=(f"質問 {i}",), kwargs={}, dependencies=[])
+        for i, tool in enumerate(tools, start=1)
+    }
+
+
+async def run_plan(tools: list[DelayedTool]) -> tuple[float, dict[str, Task]]:
+    processor = TaskProcessor()
+    tasks = plan(tools)
+    processor.set_tasks(tasks)
+    start = time.perf_counter()
+    await processor.schedule()
+    return time.perf_counter() - start, tasks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocking", type=float, default=0.3, help="1呼び出しの同期処理の時間(秒)")
+    parser.add_argument("--waiting", type=float, default=0.3, help="1呼び出しの非同期待ちの時間(秒)")
+    parser.add_argument("--timeout", type=float, default=0.2, help="タイムアウトの確認に使う上限(秒)")
+    args = parser.parse_args()
+
+    def tools():
+        return [
+            DelayedTool("cortex_search_svc_cortexsearch", args.blocking, args.waiting),
+            DelayedTool("cortex_search_svc_cortexsearch", args.blocking, args.waiting),
+            DelayedTool("sales_cortexanalyst", args.blocking, args.waiting),
+        ]
+
+    async def bench():
+        direct, _ = await run_plan(tools())
+        print(f"   direct: {direct:6.3f}s")
+
+        scheduler = ToolScheduler()
+        scheduled_tools = [scheduler.wrap(tool, ToolLimits(max_concurrency=4)) for tool in tools()]
+        with tracing() as trace:
+            scheduled, _ = await run_plan(scheduled_tools)
+        print(f"scheduled: {scheduled:6.3f}s  x{direct / scheduled:.1f}  {trace.summary()}")
+        print(trace.render())
+
+        # 同時実行数 1 にすると同じツールの呼び出しは順番待ちになる
+        capped_tools = [scheduler.wrap(tool, ToolLimits(max_concurrency=1)) for tool in tools()]
+        with tracing() as trace:
+            capped, _ = await run_plan(capped_tools)
+        print(f"   capped: {capped:6.3f}s  (search の同時実行数 1)  {trace.summary()}")
+        print(trace.render())
+
+        # タイムアウトしたツールはエラーの observation になり、他のツールの結果は残る
+        timeout_tools = [scheduler.wrap(tool, ToolLimits()) for tool in tools()[:2]]
+        timeout_tools.append(scheduler.wrap(DelayedTool("sales_cortexanalyst", 0, 5.0), ToolLimits(timeout=args.timeout)))
+        with tracing() as trace:
+            elapsed, tasks = await run_plan(timeout_tools)
+        print(f"  timeout: {elapsed:6.3f}s  (analyst のみ {args.timeout}s でタイムアウト)  {trace.summary()}")
+        print(trace.render())
+        for task in tasks.values():
+            print(f"    {task.name}: {str(task.observation)[:80]}")
+        scheduler.close()
+
+    asyncio.run(bench())
+
+
+if __name__ == "__main__":
+    main()
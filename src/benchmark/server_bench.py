@@ -0,0 +1,105 @@
+"""
+API サーバーの負荷試験 (LLM・ツールはスタブ、HTTP は httpx の ASGITransport でプロセス内に閉じる)
+決まった数のクライアントが /query を繰り返し叩き、レイテンシの p50/p95/p99 と QPS、拒否数を出す
+python -m src.benchmark.server_bench --requests 500 --clients 32 --tenants 8
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+
+from src.benchmark.agent_bench import StubAgent, StubGateway, StubPool
+from src.benchmark.fake_snowflake import FakeConnection
+from src.server.app import GatewayApp
+from src.server.limits import AdmissionController, RateLimiter
+
+
+class JitterStubAgent(StubAgent):
+    """応答時間にばらつきのあるスタブ"""
+
+    async def acall(self, query):
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self.call_delay)
+        return {"output": f"answer: {query}", "sources": []}
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+async def run_load(app: GatewayApp, requests: int, clients: int, tenants: int) -> dict:
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    remaining = iter(range(requests))
+
+    async def client(client_id: int, http: httpx.AsyncClient):
+        tenant = f"tenant-{client_id % tenants}"
+        for i in remaining:
+            start = time.perf_counter()
+            response = await http.post("/query", json={"query": f"部署はいくつありますか？ ({i})"},
+                                       headers={"X-Tenant-ID": tenant})
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            elif "retry-after" in response.headers:
+                await asyncio.sleep(min(float(response.headers["retry-after"]), 0.1))
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(c, http) for c in range(clients)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "elapsed": elapsed,
+        "ok": len(latencies),
+        "statuses": dict(sorted(statuses.items())),
+        "qps": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--clients", type=int, default=32, help="同時に叩くクライアント数")
+    parser.add_argument("--tenants", type=int, default=8)
+    parser.add_argument("--call-delay", type=float, default=0.05, help="1クエリの応答時間(秒)")
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--max-queue", type=int, default=32)
+    parser.add_argument("--tenant-rate", type=float, default=1000.0, help="テナントごとの上限(件/秒)")
+    args = parser.parse_args()
+
+    StubAgent.init_delay = 0
+    StubAgent.call_delay = args.call_delay
+    gateway = StubGateway(pool=StubPool(connect=lambda: FakeConnection(latency=0)),
+                          agent_factory=JitterStubAgent, enable_response_cache=False)
+    app = GatewayApp(
+        gateway=gateway,
+        admission=AdmissionController(max_concurrency=args.max_concurrency, max_queue=args.max_queue),
+        rate_limiter=RateLimiter(rate=args.tenant_rate, burst=max(1, int(args.tenant_rate))),
+    )
+    gateway.run("warmup")
+
+    result = asyncio.run(run_load(app, args.requests, args.clients, args.tenants))
+    gateway.close()
+
+    print(f"requests={args.requests} clients={args.clients} tenants={args.tenants} "
+          f"max_concurrency={args.max_concurrency} max_queue={args.max_queue}")
+    print(f"  elapsed {result['elapsed']:.2f}s  ok {result['ok']}  statuses {result['statuses']}")
+    print(f"  QPS {result['qps']:.1f}  p50 {result['p50'] * 1000:.1f} ms  p95 {result['p95'] * 1000:.1f} ms"
+          f"  p99 {result['p99'] * 1000:.1f} ms")
+    admission = app.metrics()["admission"]
+    print(f"  admitted {admission['admitted']}  rejected(queue full) {admission['rejected_queue_full']}"
+          f"  rejected(timeout) {admission['rejected_timeout']}  rate limited {app.rate_limiter.rejected}")
+
+
+if __name__ == "__main__":
+    main()
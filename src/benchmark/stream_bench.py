@@ -0,0 +1,180 @@
+"""
+Streamlit の進捗表示の「最初の更新までの時間」と、ログ解析の回数を比較するベンチマーク
+(プランナー・ツールはスタブ。回答生成は CortexCompleteAgent を FakeCortex の complete で動かす)
+- polling: 従来の process_message。queue.get(timeout=1) で待ち、毎回ログ全体を解析し直す
+- event: AgentGateway.stream。イベントが届いた時点で通知され、1行は1回だけ解析する
+  回答生成の出力は answer イベントで逐次届くので、最初の回答表示までの時間と最終回答までの時間も出す
+python -m src.benchmark.stream_bench --queries 5 --log-lines 200 --answer-delay 1.0 --output-tps 50
+"""
+import argparse
+import asyncio
+import io
+import logging
+import queue
+import statistics
+import threading
+import time
+
+from agent_gateway import Agent
+from agent_gateway.gateway.gateway import CortexCompleteAgent
+from agent_gateway.tools.logger import gateway_logger
+from agent_gateway.tools.utils import parse_log_message
+
+from src.agent import events
+from src.benchmark.agent_bench import StubAgent, StubGateway
+from src.benchmark.fake_cortex import FakeCortex, install
+from src.benchmark.fake_snowflake import FakePool, FakeSnowflake, Latency
+
+# 検索結果の本文 (回答生成はこの先頭を回答として少しずつ返す)
+PASSAGE = ("今期の重点施策は、海外売上比率を30%に引き上げること、主力商品の粗利率を2ポイント改善すること、"
+           "国内の直販チャネルを強化して販売管理費を抑えることの3点である。"
+           "各部署は四半期ごとに進捗を報告し、未達の場合は翌四半期の計画に対策を盛り込む。")
+
+
+class StubTool:
+    name = "cortex_search_svc_cortexsearch"
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    async def func(self, query):
+        await asyncio.sleep(self.delay)
+        return {"output": PASSAGE, "sources": {}}
+
+
+class StreamingStubAgent(StubAgent):
+    """ツール選択ログ → ツール呼び出し → 回答生成 (CortexCompleteAgent) の順に進むスタブ"""
+
+    log_lines = 200
+    tool_delay = 0.3
+
+    def __init__(self, snowflake_connection, tools, **kwargs):
+        super().__init__(snowflake_connection, tools, **kwargs)
+        self.agent = CortexCompleteAgent(session=snowflake_connection, llm="stub")
+
+    async def acall(self, query):
+        for i in range(self.log_lines):
+            gateway_logger.log("INFO", f"planner output line {i}")
+        tool = self.tools[0]
+        gateway_logger.log("INFO", f"running {tool.name} task")
+        result = await tool.func(query)
+        raw_answer = await self.agent.arun(f"Question: {query}\n\nObservation: {result['output']}")
+        return {**await super().acall(query), "output": Agent._extract_answer(raw_answer)}
+
+
+class StreamingStubGateway(StubGateway):
+    def initialize_tools(self) -> list:
+        return [self._resolve_tool("search", lambda: StubTool(StreamingStubAgent.tool_delay))]
+
+
+class LegacyLogHandler(logging.Handler):
+    """従来の StreamlitLogHandler と同じく、バッファ全体を毎回解析する"""
+
+    def __init__(self):
+        super().__init__()
+        self.buffer = io.StringIO()
+        self.parsed_lines = 0
+        self.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+
+    def emit(self, record):
+        self.buffer.write(self.format(record) + "\n")
+
+    def process_logs(self) -> str:
+        lines = [line for line in self.buffer.getvalue().strip().split("\n") if line.strip()]
+        self.parsed_lines += len(lines)
+        return "\n".join(line for line in map(parse_log_message, lines) if line is not None)
+
+
+def bench_polling(gateway, query: str) -> tuple[float, int]:
+    handler = LegacyLogHandler()
+    logger = logging.getLogger("AgentGatewayLogger")
+    logger.addHandler(handler)
+    message_queue = queue.Queue()
+    start = time.perf_counter()
+    first_update = None
+    thread = threading.Thread(target=lambda: message_queue.put(gateway.run(query)))
+    thread.start()
+    try:
+        while True:
+            try:
+                message_queue.get(timeout=1)
+                break
+            except queue.Empty:
+                if handler.process_logs() and first_update is None:
+                    first_update = time.perf_counter() - start
+        if first_update is None:
+            first_update = time.perf_counter() - start
+    finally:
+        thread.join()
+        logger.removeHandler(handler)
+    return first_update, handler.parsed_lines
+
+
+def bench_event(gateway, query: str) -> tuple[float, int, float, float]:
+    parsed_lines = 0
+    original_emit = events.ProgressLogHandler.emit
+
+    def counting_emit(self, record):
+        nonlocal parsed_lines
+        if events.current_stream.get() is not None:
+            parsed_lines += 1
+        original_emit(self, record)
+
+    events.ProgressLogHandler.emit = counting_emit
+    start = time.perf_counter()
+    first_update = first_answer = None
+    try:
+        for event in gateway.stream(query):
+            if first_update is None:
+                first_update = time.perf_counter() - start
+            if event.kind == "answer" and first_answer is None:
+                first_answer = time.perf_counter() - start
+    finally:
+        events.ProgressLogHandler.emit = original_emit
+    final = time.perf_counter() - start
+    return first_update, parsed_lines, final if first_answer is None else first_answer, final
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=5)
+    parser.add_argument("--log-lines", type=int, default=200, help="1クエリで出るツール選択以外のログ行数")
+    parser.add_argument("--tool-delay", type=float, default=0.3)
+    parser.add_argument("--answer-delay", type=float, default=1.0, help="回答生成の最初の出力までの時間(秒)")
+    parser.add_argument("--output-tps", type=float, default=50, help="回答生成の出力トークン/秒")
+    args = parser.parse_args()
+
+    StubAgent.init_delay = 0
+    StubAgent.call_delay = 0
+    StreamingStubAgent.log_lines = args.log_lines
+    StreamingStubAgent.tool_delay = args.tool_delay
+    # ベンチマーク中は標準出力へのログを止める
+    logging.getLogger("AgentGatewayLogger").propagate = False
+    for handler in logging.getLogger("AgentGatewayLogger").handlers:
+        handler.setLevel(logging.CRITICAL)
+
+    backend = FakeSnowflake()
+    cortex = FakeCortex(backend, Latency(complete=args.answer_delay, per_output_token=1 / args.output_tps))
+    gateway = StreamingStubGateway(pool=FakePool(backend), agent_factory=StreamingStubAgent, enable_response_cache=False)
+    gateway.agent  # Agent の生成は計測に含めない
+
+    with install(cortex):
+        for name, bench in [("polling", bench_polling), ("event", bench_event)]:
+            firsts, parsed, answers, finals = [], [], [], []
+            for i in range(args.queries):
+                first_update, parsed_lines, *answer = bench(gateway, f"経営計画の重点施策は？ ({name} {i})")
+                firsts.append(first_update)
+                parsed.append(parsed_lines)
+                if answer:
+                    answers.append(answer[0])
+                    finals.append(answer[1])
+            print(f"{name:>8}: time-to-first-update median {statistics.median(firsts) * 1000:7.1f} ms"
+                  f"  max {max(firsts) * 1000:7.1f} ms  parsed lines/query {statistics.mean(parsed):8.0f}")
+            if answers:
+                print(f"{'':>8}  time-to-first-answer median {statistics.median(answers) * 1000:7.1f} ms"
+                      f"  final answer median {statistics.median(finals) * 1000:7.1f} ms")
+    gateway.close()
+
+
+if __name__ == "__main__":
+    main()
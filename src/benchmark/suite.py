@@ -0,0 +1,251 @@
+"""
+オフラインのベンチマークスイート (Snowflake / Cortex の資格情報なしで実行できる)
+FakeSnowflake (SQLite) と FakeCortex を FakePool と post_cortex_request の差し替えで入れ、実際の
+Search_preprocess / Analyst_preprocess / AgentGateway を動かす。遅延は Latency (既定の値 × --scale) で入れる
+- ingest: 環境構築 (初回・2回目) の所要時間と文・DDL の数、BulkLoader の batch / stage の rows/sec
+- cold_start: AgentGateway の生成から最初の回答まで
+- latency: 1件ずつ実行したときの p50 / p95 (レスポンスキャッシュなし。ツール結果キャッシュに当たらないよう質問は毎回変える)
+- throughput: --concurrency 件ずつ並行して実行したときの queries/sec
+結果は JSON に保存し、--compare に前回の JSON を渡すと差分を表示する (--threshold を超えて悪化した指標があれば終了コード 1)
+python -m src.benchmark.suite --queries 40 --concurrency 8 --compare .cache/benchmark/previous.json
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pydantic import BaseModel, Field
+
+from src.agent.agent import AgentGateway
+from src.analyst.preprocess import Analyst_preprocess
+from src.benchmark.fake_cortex import FakeCortex, install
+from src.benchmark.fake_snowflake import FakePool, FakeSnowflake, Latency
+from src.common.bulk_load import BulkLoader
+from src.search.preprocess import Search_preprocess
+
+# 実環境に近い遅延 (秒)。--scale で全体を縮める
+DEFAULT_LATENCY = Latency(sql=0.05, per_row=0.00002, search=0.3, analyst=1.5, complete=1.0, per_token=0.0002)
+
+DDL = ("CREATE", "ALTER", "DROP", "USE", "GRANT")
+
+WORKLOAD = [
+    "チャネル別の売上を教えて",
+    "部署別の売上合計は?",
+    "商品別の販売数量は?",
+    "部署別の取引件数は?",
+    "日別の売上の推移は?",
+    "第1四半期の重点KPIは何ですか",
+    "海外売上比率の目標は?",
+    "今期の主な施策を教えて",
+]
+
+
+class SuiteResult(BaseModel):
+    meta: dict = Field(default_factory=dict, description="実行日時・コミット・遅延・引数")
+    metrics: dict[str, float] = Field(default_factory=dict, description="指標名 → 値 (*_per_sec は大きいほど良く、それ以外は小さいほど良い)")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return ""
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q * len(values)) - 1))]
+
+
+def isolate(work_dir: Path) -> None:
+    """索引・マニフェストなどの保存先を一時ディレクトリにし、外部 API を使わない設定にする"""
+    Search_preprocess.index_dir = work_dir / "vector_index"
+    Search_preprocess.keyword_index_dir = work_dir / "keyword_index"
+    os.environ["SEARCH_EMBEDDER"] = "hashing"
+    os.environ["PROVISION_STATE_PATH"] = str(work_dir / "provision_state.json")
+    os.environ.pop("RESPONSE_CACHE_PATH", None)
+    os.environ.pop("TRACE_JSONL_PATH", None)
+    for name, default in (("SNOWFLAKE_DATABASE", "CORTEX_AGENTS_DB"), ("SNOWFLAKE_SCHEMA", "CORTEX_AGENTS_SCHEMA"),
+                          ("SNOWFLAKE_WAREHOUSE", "CORTEX_AGENTS_WH")):
+        os.environ.setdefault(name, default)
+
+
+def search_preprocess(pool: FakePool, work_dir: Path) -> Search_preprocess:
+    preprocess = Search_preprocess(pool=pool)
+    preprocess.manifest_path = work_dir / "ingest_manifest.json"
+    preprocess.embedding_cache_path = work_dir / "embedding_cache.sqlite"
+    return preprocess
+
+
+def provision(backend: FakeSnowflake, pool: FakePool, work_dir: Path, metrics: dict, label: str) -> None:
+    """Search / Analyst の環境構築を実行し、所要時間と文の数を記録する"""
+    backend.reset_statistics()
+    start = time.perf_counter()
+    preprocess = search_preprocess(pool, work_dir)
+    try:
+        preprocess.run()
+    finally:
+        preprocess.close()
+    metrics[f"ingest.search_{label}_seconds"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    preprocess = Analyst_preprocess(pool=pool)
+    try:
+        preprocess.run()
+    finally:
+        preprocess.close()
+    metrics[f"ingest.analyst_{label}_seconds"] = time.perf_counter() - start
+    counts = backend.statement_counts()
+    metrics[f"ingest.{label}_statements"] = backend.round_trips
+    metrics[f"ingest.{label}_ddl"] = sum(n for kind, n in counts.items() if kind.split()[0] in DDL)
+    print(f"  環境構築 ({label}): search {metrics[f'ingest.search_{label}_seconds']:.2f}s  "
+          f"analyst {metrics[f'ingest.analyst_{label}_seconds']:.2f}s  文 {backend.round_trips}件 "
+          f"(DDL {metrics[f'ingest.{label}_ddl']:.0f}件)  {counts}")
+
+
+def bulk_load(backend: FakeSnowflake, rows: int, metrics: dict) -> None:
+    connection = backend.connect()
+    columns = ["id", "file_name", "text"]
+    data = [(i, f"file_{i % 50}.pdf", f"チャンク {i} の本文 " * 8) for i in range(rows)]
+    for mode in ("batch", "stage"):
+        connection.cursor().execute("CREATE OR REPLACE TABLE BULK_LOAD_BENCH (id NUMBER, file_name VARCHAR, text VARCHAR)")
+        stats = BulkLoader(connection, batch_size=1000).load("BULK_LOAD_BENCH", columns, data, mode=mode)
+        metrics[f"ingest.bulk_{mode}_rows_per_sec"] = stats.rows_per_sec
+        print(f"  BulkLoader {mode:>5}: {stats.rows}行 {stats.elapsed:.2f}s  {stats.rows_per_sec:,.0f} rows/sec")
+    connection.cursor().execute("DROP TABLE IF EXISTS BULK_LOAD_BENCH")
+
+
+def cold_start(pool: FakePool, metrics: dict) -> None:
+    start = time.perf_counter()
+    gateway = AgentGateway(pool=pool, enable_response_cache=False)
+    constructed = time.perf_counter() - start
+    try:
+        gateway.run(WORKLOAD[0])
+    finally:
+        gateway.close()
+    metrics["cold_start.construct_seconds"] = constructed
+    metrics["cold_start.first_answer_seconds"] = time.perf_counter() - start
+    print(f"  起動 {constructed * 1000:.1f} ms  最初の回答まで {metrics['cold_start.first_answer_seconds'] * 1000:.1f} ms")
+
+
+def single_query(gateway: AgentGateway, queries: int, metrics: dict) -> None:
+    latencies = []
+    for i in range(queries):
+        start = time.perf_counter()
+        gateway.run(f"{WORKLOAD[i % len(WORKLOAD)]} #{i}")
+        latencies.append(time.perf_counter() - start)
+    metrics["latency.p50_ms"] = statistics.median(latencies) * 1000
+    metrics["latency.p95_ms"] = percentile(latencies, 0.95) * 1000
+    metrics["latency.mean_ms"] = statistics.mean(latencies) * 1000
+    print(f"  {queries}件  p50 {metrics['latency.p50_ms']:.1f} ms  p95 {metrics['latency.p95_ms']:.1f} ms  "
+          f"mean {metrics['latency.mean_ms']:.1f} ms")
+
+
+def concurrent(gateway: AgentGateway, queries: int, concurrency: int, metrics: dict) -> None:
+    async def run() -> float:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i: int):
+            async with semaphore:
+                await gateway.arun(f"{WORKLOAD[i % len(WORKLOAD)]} (並行) #{i}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(queries)))
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(run())
+    metrics["throughput.queries_per_sec"] = queries / elapsed
+    print(f"  {queries}件 (並行 {concurrency})  {elapsed:.2f}s  {metrics['throughput.queries_per_sec']:.2f} queries/sec")
+
+
+def compare(previous: SuiteResult, current: SuiteResult, threshold: float) -> list[str]:
+    """前回との差分を表示し、threshold を超えて悪化した指標の名前を返す"""
+    print(f"\n前回 ({previous.meta.get('timestamp')}, {previous.meta.get('commit')}) との比較")
+    regressions = []
+    for name, value in current.metrics.items():
+        before = previous.metrics.get(name)
+        if before is None:
+            print(f"  {name:<36} {value:12.3f}  (新規)")
+            continue
+        change = (value - before) / before if before else 0.0
+        worse = -change if name.endswith("_per_sec") else change
+        mark = ""
+        if worse > threshold:
+            mark = "  << 悪化"
+            regressions.append(name)
+        elif worse < -threshold:
+            mark = "  改善"
+        print(f"  {name:<36} {before:12.3f} → {value:12.3f}  {change:+7.1%}{mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=40, help="1件ずつ・並行それぞれのクエリ数")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rows", type=int, default=20000, help="BulkLoader で読み込む行数")
+    parser.add_argument("--scale", type=float, default=0.05, help="DEFAULT_LATENCY に掛ける倍率 (0 で遅延なし)")
+    parser.add_argument("--output", default=None, help="結果の JSON (省略時は .cache/benchmark/suite-日時.json)")
+    parser.add_argument("--compare", default=None, help="比較する前回の結果の JSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="悪化とみなす変化率")
+    args = parser.parse_args()
+
+    load_dotenv(encoding="utf-8", override=True)
+    work_dir = Path(tempfile.mkdtemp(prefix="agent-gateway-suite-"))
+    isolate(work_dir)
+    latency = DEFAULT_LATENCY.scaled(args.scale)
+    backend = FakeSnowflake(os.environ["SNOWFLAKE_DATABASE"], os.environ["SNOWFLAKE_SCHEMA"], latency=latency)
+    pool = FakePool(backend)
+    metrics: dict[str, float] = {}
+
+    # 環境構築のログは残し、クエリ実行中のログ (応答本文・"running X task" など) は測定から除く
+    print("ingest")
+    provision(backend, pool, work_dir, metrics, "cold")
+    provision(backend, pool, work_dir, metrics, "restart")
+    bulk_load(backend, args.rows, metrics)
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("AgentGatewayLogger").setLevel(logging.WARNING)
+
+    with install(FakeCortex(backend)):
+        print("cold_start")
+        cold_start(pool, metrics)
+        gateway = AgentGateway(pool=pool, enable_response_cache=False)
+        try:
+            gateway.run(WORKLOAD[0]) # ツール・Agent の生成を済ませる
+            print("latency")
+            single_query(gateway, args.queries, metrics)
+            print("throughput")
+            concurrent(gateway, args.queries, args.concurrency, metrics)
+        finally:
+            gateway.close()
+
+    result = SuiteResult(meta={
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "latency": latency.model_dump(),
+        "args": vars(args),
+    }, metrics=metrics)
+    output = Path(args.output or f".cache/benchmark/suite-{datetime.now():%Y%m%d-%H%M%S}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(result.model_dump_json(indent=2), encoding="utf-8")
+    print(f"\n結果を保存しました: {output}")
+
+    if args.compare:
+        previous = SuiteResult.model_validate_json(Path(args.compare).read_text(encoding="utf-8"))
+        regressions = compare(previous, result, args.threshold)
+        if regressions:
+            print(f"{len(regressions)}件の指標が {args.threshold:.0%} を超えて悪化しました: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
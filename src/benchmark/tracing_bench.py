@@ -0,0 +1,157 @@
+"""
+リクエストのトレースのオーバーヘッドのベンチマーク
+agent_gateway の Task / TaskProcessor を使い、プランナー (LLM) → 並行するツール呼び出し (SQLite に SQL を投げる) → 回答生成 (LLM)
+という形のスタブのエージェントを、遅延なしで繰り返し実行する
+- off: Telemetry なし (何も仕込まない)
+- idle: スパンを仕込むが、リクエストのトレースを始めない (span() は no-op)
+- memory+prometheus: ゲートウェイの既定のエクスポーター
+- +jsonl: さらに JSON Lines に書き出す
+最後に1リクエスト分のスパンの木と Prometheus テキストの先頭を表示する
+python -m src.benchmark.tracing_bench --requests 2000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from agent_gateway.gateway.task_processor import Task, TaskProcessor
+
+from src.agent.telemetry import DEFAULT_BUCKETS, InMemoryExporter, JsonlExporter, PrometheusExporter, Telemetry
+
+# スタブは1区間がミリ秒未満なので、既定のバケットの下に細かいバケットを足す
+FINE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025) + DEFAULT_BUCKETS
+
+
+class StubTool:
+    def __init__(self, name: str, connection):
+        self.name = name
+        self.connection = connection
+        self.func = self.run
+
+    async def run(self, query: str):
+        rows = self.connection.cursor().execute("SELECT channel, SUM(total) FROM sales GROUP BY channel").fetchall()
+        return {"output": [list(row) for row in rows], "sources": {"tool_type": "stub", "tool_name": self.name}}
+
+
+class StubPlanner:
+    system_prompt = "You are a planner. " * 50
+    system_prompt_replan = system_prompt
+    llm = "stub"
+
+    def __init__(self, tools):
+        self.tools = tools
+
+    async def run_llm(self, inputs: dict, is_replan: bool = False) -> str:
+        return "\n".join(f"{i + 1}. {tool.name}(\"{inputs['input']}\")" for i, tool in enumerate(self.tools))
+
+    async def plan(self, inputs: dict, is_replan: bool, **kwargs) -> dict:
+        await self.run_llm(inputs=inputs, is_replan=is_replan)
+        return {str(i + 1): Task(idx=str(i + 1), name=tool.name, tool=tool.func, args=(inputs["input"],),
+                                 dependencies=[], kwargs={}) for i, tool in enumerate(self.tools)}
+
+
+class StubCompletion:
+    llm = "stub"
+
+    async def arun(self, prompt: str) -> str:
+        return "Answer: " + prompt[-40:]
+
+
+class StubAgent:
+    def __init__(self, tools):
+        self.planner = StubPlanner(tools)
+        self.agent = StubCompletion()
+
+    async def acall(self, query: str) -> dict:
+        processor = TaskProcessor()
+        processor.set_tasks(await self.planner.plan(inputs={"input": query}, is_replan=False))
+        await processor.schedule()
+        scratchpad = "".join(task.get_thought_action_observation() for task in processor.tasks.values())
+        return {"output": await self.agent.arun(f"Question: {query}\n{scratchpad}")}
+
+
+def build(telemetry: Telemetry | None, tools: int) -> StubAgent:
+    db = sqlite3.connect(":memory:", check_same_thread=False)
+    db.execute("CREATE TABLE sales (channel TEXT, total INTEGER)")
+    db.executemany("INSERT INTO sales VALUES (?, ?)", [(f"ch{i % 4}", i) for i in range(200)])
+    stubs = []
+    for i in range(tools):
+        tool = StubTool(f"tool_{i}", db)
+        if telemetry is not None:
+            tool = telemetry.wrap_tool(telemetry.wrap_connection(tool))
+        stubs.append(tool)
+    agent = StubAgent(stubs)
+    if telemetry is not None:
+        telemetry.instrument_agent(agent)
+    return agent
+
+
+async def run(agent: StubAgent, telemetry: Telemetry | None, requests: int, trace: bool) -> list[float]:
+    latencies = []
+    for i in range(requests):
+        start = time.perf_counter()
+        if telemetry is not None and trace:
+            with telemetry.request(query_tokens=4):
+                await agent.acall(f"query {i}")
+        else:
+            await agent.acall(f"query {i}")
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def print_tree(trace: list[dict]) -> None:
+    children: dict = {}
+    for span in trace:
+        children.setdefault(span["parent_id"], []).append(span)
+
+    def walk(parent_id, depth):
+        for span in children.get(parent_id, []):
+            attributes = {k: v for k, v in span["attributes"].items() if k != "statement"}
+            print(f"  {'  ' * depth}{span['kind']}/{span['name']:<16} {span['seconds'] * 1000:7.3f} ms  {attributes}")
+            walk(span["span_id"], depth + 1)
+
+    walk(None, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--tools", type=int, default=3, help="1リクエストのツール呼び出し数")
+    args = parser.parse_args()
+    # "running X task" の標準出力への書き出しを測定から除く
+    logging.getLogger("AgentGatewayLogger").setLevel(logging.WARNING)
+
+    jsonl_path = os.path.join(tempfile.mkdtemp(), "traces.jsonl")
+    configs = {
+        "off": (None, False),
+        "idle": (Telemetry([InMemoryExporter(), PrometheusExporter(FINE_BUCKETS)]), False),
+        "memory+prometheus": (Telemetry([InMemoryExporter(), PrometheusExporter(FINE_BUCKETS)]), True),
+        "+jsonl": (Telemetry([InMemoryExporter(), PrometheusExporter(FINE_BUCKETS), JsonlExporter(jsonl_path)]), True),
+    }
+    baseline = None
+    for label, (telemetry, trace) in configs.items():
+        agent = build(telemetry, args.tools)
+        asyncio.run(run(agent, telemetry, 50, trace)) # ウォームアップ
+        latencies = asyncio.run(run(agent, telemetry, args.requests, trace))
+        mean = statistics.mean(latencies) * 1e6
+        baseline = baseline or mean
+        spans = telemetry.metrics().spans if telemetry is not None else 0
+        print(f"{label:>18}: mean {mean:8.1f} us  p50 {statistics.median(latencies) * 1e6:8.1f} us  "
+              f"overhead {mean - baseline:+8.1f} us ({mean / baseline - 1:+6.1%})  spans {spans}")
+
+    telemetry = configs["+jsonl"][0]
+    print(f"\n1リクエストのスパン (JSON Lines: {os.path.getsize(jsonl_path) / 1024:.0f} KiB)")
+    print_tree(telemetry.exporter(InMemoryExporter).traces()[-1])
+    print()
+    print("\n".join(telemetry.exporter(PrometheusExporter).render().splitlines()[:6]))
+    for name, stats in telemetry.exporter(PrometheusExporter).stats().items():
+        print(f"  {name:<20} n={stats.count:6d}  p50 {stats.p50 * 1000:6.3f} ms  p95 {stats.p95 * 1000:6.3f} ms  {stats.tokens}")
+    telemetry.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+チャンクアップロードのベンチマーク
+python -m src.benchmark.upload_bench --chunks 2000 --latency 0.005
+"""
+import argparse
+import time
+from logging import getLogger
+import logging
+
+from src.common.bulk_load import BulkLoader
+from src.benchmark.fake_snowflake import FakeConnection
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = getLogger(__name__)
+
+TABLE = "CORTEX_AGENTS_SCHEMA.SAMPLE_TECH_1Q_MANAGEMENT_PLAN"
+COLUMNS = ["chunk_id", "file_name", "text"]
+
+
+def make_rows(n: int) -> list[tuple]:
+    return [(i, "サンプルテック_2025年度_第1四半期_経営計画.pdf", "経営計画のダミーテキスト" * 8) for i in range(n)]
+
+
+def bench_row_by_row(rows, latency) -> float:
+    """従来の1行1INSERTのループ"""
+    connector = FakeConnection(latency=latency)
+    cursor = connector.cursor()
+    start = time.perf_counter()
+    for row in rows:
+        cursor.execute(f"INSERT INTO {TABLE} ({', '.join(COLUMNS)}) VALUES (%s, %s, %s)", row)
+    connector.commit()
+    return time.perf_counter() - start
+
+
+def bench_loader(rows, latency, mode, batch_size) -> float:
+    connector = FakeConnection(latency=latency)
+    stats = BulkLoader(connector, batch_size=batch_size).load(TABLE, COLUMNS, rows, mode=mode)
+    return stats.elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.005, help="1ラウンドトリップの遅延(秒)")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.chunks)
+    results = {
+        "row": bench_row_by_row(rows, args.latency),
+        "batch": bench_loader(rows, args.latency, "batch", args.batch_size),
+        "stage": bench_loader(rows, args.latency, "stage", args.batch_size),
+    }
+
+    baseline = results["row"]
+    for mode, elapsed in results.items():
+        print(f"{mode:>6}: {elapsed:8.3f}s  {len(rows) / elapsed:10.0f} rows/sec  x{baseline / elapsed:.1f}")
+
+
+if __name__ == "__main__":
+    main()
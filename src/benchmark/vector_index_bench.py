@@ -0,0 +1,82 @@
+"""
+ローカルベクトルインデックスのベンチマーク (埋め込みは HashingEmbedder で外部APIなし)
+サンプルPDFのチャンク + 合成チャンクで N 件のインデックスを作り、float32 / int8 (mmap 読み込み) の
+検索レイテンシ、サイズ、top-k の一致率、自己検索のヒット率を出す
+python -m src.benchmark.vector_index_bench --chunks 20000 --queries 200
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from src.benchmark.chunking_bench import LINES
+from src.search.chunking import iter_pdf_chunks
+from src.search.embedder import HashingEmbedder
+from src.search.preprocess import Search_preprocess
+from src.search.vector_index import VectorIndex
+
+
+def corpus(size: int, seed: int = 0) -> list[tuple[int, str, str]]:
+    """サンプルPDFのチャンクに、実チャンクの断片をつないだ合成チャンクを足して size 件にする"""
+    pdfs = sorted((Path(Search_preprocess.index_dir).parent / "data").glob("*.pdf"))
+    rows = [(chunk.num, chunk.file_name, chunk.text) for chunk in iter_pdf_chunks(pdfs, 100, 20, max_workers=1)]
+    texts = [text for _, _, text in rows] + [line.format(page=i) for i, line in enumerate(LINES)]
+    rng = random.Random(seed)
+    while len(rows) < size:
+        a, b = rng.sample(texts, 2)
+        i, j = rng.randrange(len(a) // 2 + 1), rng.randrange(len(b) // 2 + 1)
+        rows.append((len(rows), "synthetic.pdf", a[i:i + 50] + b[j:j + 50]))
+    return rows[:size]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=256)
+    args = parser.parse_args()
+
+    rows = corpus(args.chunks)
+    embedder = HashingEmbedder(dim=args.dim)
+    rng = random.Random(1)
+    targets = rng.sample(range(len(rows)), args.queries)
+    # チャンクの一部分をクエリにして、それを含むチャンクが top-k に入るかを見る (合成チャンクは断片を共有する)
+    queries = [rows[i][2][: max(8, len(rows[i][2]) // 2)] for i in targets]
+    query_vectors = [embedder.embed_query(q) for q in queries]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for dtype in ("float32", "int8"):
+            start = time.perf_counter()
+            index = VectorIndex.build(rows, embedder, "BENCH", dtype=dtype, batch_size=256)
+            build = time.perf_counter() - start
+            path = Path(tmp) / dtype
+            index.save(path)
+            index = VectorIndex.load(path, mmap=True)
+
+            latencies, hits, tops = [], 0, []
+            for query, vector in zip(queries, query_vectors):
+                start = time.perf_counter()
+                found = index.search(vector, args.k)
+                latencies.append(time.perf_counter() - start)
+                ids = [(r.file_name, r.chunk_id) for r in found]
+                hits += any(query in r.text for r in found)
+                tops.append(ids)
+            results[dtype] = tops
+            size = (path / "vectors.npy").stat().st_size
+            latencies.sort()
+            print(f"{dtype:>8}: build {build:6.2f}s  size {size / 1024 / 1024:6.2f} MiB  "
+                  f"search p50 {statistics.median(latencies) * 1000:6.2f} ms  "
+                  f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:6.2f} ms  "
+                  f"hit@{args.k} {hits / len(queries):.2f}")
+
+    overlap = statistics.mean(
+        len(set(a) & set(b)) / len(a) for a, b in zip(results["float32"], results["int8"]) if a)
+    print(f"int8 と float32 の top-{args.k} 一致率: {overlap:.3f}  (chunks={len(rows)}, dim={args.dim})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Cortex Search / Analyst の環境構築を行う (サーバー起動とは別に実行する)
+変更のない再実行では DDL を実行しない (状態は PROVISION_STATE_PATH に記録する)
+python -m src.bootstrap [--force]
+"""
+import argparse
+from logging import getLogger
+import logging
+import time
+from dotenv import load_dotenv
+from src.analyst.preprocess import Analyst_preprocess
+from src.search.preprocess import Search_preprocess
+from src.common.pool import get_pool, use_role
+from src.common.provision import fingerprint
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = getLogger(__name__)
+
+CROSS_REGION_SQL = "ALTER ACCOUNT SET CORTEX_ENABLED_CROSS_REGION = 'ANY_REGION'"
+
+
+def enable_cross_region_inference(connector) -> None:
+    """クロスリージョン推論を有効化する (ACCOUNTADMIN で実行し、接続の ROLE は元に戻す)"""
+    with use_role(connector, "ACCOUNTADMIN") as cursor:
+        cursor.execute(CROSS_REGION_SQL)
+        connector.commit()
+    logger.info("Cross-region inferenceを有効化しました。")
+
+
+def bootstrap(force: bool = False) -> None:
+    """
+    テーブル・データ・Search Service・ステージを用意する
+    何度実行しても同じ状態になる (テーブルが既にあれば差分のみ取り込む)
+    DDL・アカウント設定は前回の適用から変わったものだけを実行する (force=True の場合はすべて実行する)
+    """
+    start = time.perf_counter()
+    load_dotenv(encoding='utf-8', override=True)
+
+    search_preprocess = Search_preprocess()
+    try:
+        search_preprocess.run(force=force)
+    finally:
+        search_preprocess.close()
+
+    analyst_preprocess = Analyst_preprocess()
+    try:
+        analyst_preprocess.run(force=force)
+        analyst_preprocess.reconciler.ensure("account.cross_region_inference", fingerprint(CROSS_REGION_SQL),
+                                             lambda: enable_cross_region_inference(analyst_preprocess.connector))
+    finally:
+        analyst_preprocess.close()
+
+    logger.info(f"接続プール: {get_pool().metrics()}")
+    logger.info(f"環境構築が完了しました ({time.perf_counter() - start:.2f}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--force", action="store_true", help="前回の適用の記録を無視してすべての DDL を実行する")
+    bootstrap(force=parser.parse_args().force)
@@ -0,0 +1,144 @@
+import csv
+import os
+import tempfile
+import time
+from logging import getLogger
+from typing import Iterable, Iterator, Sequence
+
+from pydantic import BaseModel, Field
+
+logger = getLogger(__name__)
+
+
+class LoadStats(BaseModel):
+    """一括ロードの結果"""
+    table: str = Field(description="ロード先テーブル名")
+    mode: str = Field(description="ロード方式 (batch / stage)")
+    rows: int = Field(default=0, description="ロードした行数")
+    batches: int = Field(default=0, description="実行したバッチ数")
+    elapsed: float = Field(default=0.0, description="所要時間(秒)")
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def iter_batches(rows: Iterable[Sequence], batch_size: int) -> Iterator[list]:
+    """行のイテラブルを batch_size 件ずつのリストに区切る"""
+    batch = []
+    for row in rows:
+        batch.append(tuple(row))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def dataframe_rows(frames, columns: Sequence[str] | None = None, date_columns: Sequence[str] = ()) -> Iterator[tuple]:
+    """
+    DataFrame (または read_csv(chunksize=...) のイテレータ) を columns の順の行タプルに変換する
+    DATE列の変換と欠損値のNone化は列単位でまとめて行う
+    """
+    import pandas as pd
+
+    if isinstance(frames, pd.DataFrame):
+        frames = [frames]
+
+    for df in frames:
+        df = (df[list(columns)] if columns is not None else df).copy()
+        for column in date_columns:
+            if column in df.columns:
+                df[column] = pd.to_datetime(df[column], format="%Y-%m-%d").dt.date
+        # numpy型をPythonの型に揃え、NaN/NaTはNULLとしてバインドする
+        df = df.astype(object).where(df.notna(), None)
+        yield from df.itertuples(index=False, name=None)
+
+
+class BulkLoader:
+    """
+    Snowflakeテーブルへの一括ロード
+    - batch: executemany によるマルチロウINSERT (1バッチ = 1ラウンドトリップ)
+    - stage: ローカルCSVに書き出し、テーブルステージへPUTしてCOPY INTO
+    commit は呼び出し側で行う
+    """
+
+    def __init__(self, connector, batch_size: int = 1000):
+        if batch_size < 1:
+            raise ValueError("batch_size は1以上を指定してください")
+        self.connector = connector
+        self.batch_size = batch_size
+
+    def load(self, table: str, columns: Sequence[str], rows: Iterable[Sequence], mode: str = "batch") -> LoadStats:
+        if mode == "batch":
+            return self.insert_rows(table, columns, rows)
+        if mode == "stage":
+            return self.copy_rows(table, columns, rows)
+        raise ValueError(f"未対応のロード方式です: {mode}")
+
+    def insert_rows(self, table: str, columns: Sequence[str], rows: Iterable[Sequence]) -> LoadStats:
+        """executemany でバッチ単位にINSERTする"""
+        placeholders = ", ".join(["%s"] * len(columns))
+        insert_query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+
+        stats = LoadStats(table=table, mode="batch")
+        start = time.perf_counter()
+        cursor = self.connector.cursor()
+        try:
+            for batch in iter_batches(rows, self.batch_size):
+                cursor.executemany(insert_query, batch)
+                stats.rows += len(batch)
+                stats.batches += 1
+        finally:
+            cursor.close()
+        stats.elapsed = time.perf_counter() - start
+        self._log(stats)
+        return stats
+
+    def copy_rows(self, table: str, columns: Sequence[str], rows: Iterable[Sequence]) -> LoadStats:
+        """CSVに書き出してテーブルステージ(@%table)経由で COPY INTO する"""
+        stats = LoadStats(table=table, mode="stage")
+        start = time.perf_counter()
+
+        fd, path = tempfile.mkstemp(prefix=f"{table.split('.')[-1].lower()}_", suffix=".csv")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
+                for batch in iter_batches(rows, self.batch_size):
+                    writer.writerows(batch)
+                    stats.rows += len(batch)
+
+            # テーブルステージは @[namespace.]%table の形式で参照する
+            namespace, _, name = table.rpartition(".")
+            stage = f"@{namespace}.%{name}" if namespace else f"@%{name}"
+            file_name = os.path.basename(path)
+            cursor = self.connector.cursor()
+            try:
+                cursor.execute(f"PUT 'file://{path}' {stage} AUTO_COMPRESS=TRUE OVERWRITE=TRUE")
+                cursor.execute(f"""
+                COPY INTO {table} ({', '.join(columns)})
+                FROM {stage}
+                FILES = ('{file_name}.gz')
+                FILE_FORMAT = (
+                    TYPE = CSV
+                    FIELD_OPTIONALLY_ENCLOSED_BY = '"'
+                    EMPTY_FIELD_AS_NULL = TRUE
+                    ENCODING = 'UTF8'
+                )
+                PURGE = TRUE
+                """)
+                stats.batches = 1
+            finally:
+                cursor.close()
+        finally:
+            os.remove(path)
+
+        stats.elapsed = time.perf_counter() - start
+        self._log(stats)
+        return stats
+
+    def _log(self, stats: LoadStats) -> None:
+        logger.info(
+            f"{stats.table} に {stats.rows} 行をロードしました "
+            f"(mode={stats.mode}, batches={stats.batches}, {stats.elapsed:.2f}s, {stats.rows_per_sec:.0f} rows/sec)"
+        )
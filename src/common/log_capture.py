@@ -0,0 +1,136 @@
+"""
+セッション・リクエスト単位のログ取得
+- 取得範囲は contextvars で決まる (capture.request() の中で出たログだけを取る)
+- セッションごとに上限付きのリングバッファに保持し、古い行・古いセッションから捨てる
+- 1行は受け取った時に1回だけフォーマット・解析する
+- request() を抜けると、そのリクエストのログは以降取得しない
+"""
+import contextvars
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Iterator
+
+from agent_gateway.tools.utils import parse_log_message
+
+_ANSI_ESCAPE = re.compile(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])")
+
+
+class LogLine:
+    __slots__ = ("request_id", "created", "level", "logger", "text", "display")
+
+    def __init__(self, request_id: str, record: logging.LogRecord, text: str, display: str | None):
+        self.request_id = request_id
+        self.created = record.created
+        self.level = record.levelname
+        self.logger = record.name
+        self.text = text  # フォーマット・ANSIエスケープ除去済みの1行
+        self.display = display  # parse_log_message の結果 (ツール選択など、なければ None)
+
+
+class CaptureScope:
+    """1リクエスト分の取得範囲"""
+
+    __slots__ = ("session_id", "request_id", "started", "active", "_buffer")
+
+    def __init__(self, session_id: str, request_id: str, buffer: deque):
+        self.session_id = session_id
+        self.request_id = request_id
+        self.started = time.time()
+        self.active = True
+        self._buffer = buffer
+
+    def lines(self) -> list[LogLine]:
+        """このリクエストのログ (リングバッファに残っている分)"""
+        return [line for line in list(self._buffer) if line.request_id == self.request_id]
+
+
+_current_scope: contextvars.ContextVar[CaptureScope | None] = contextvars.ContextVar(
+    "log_capture_scope", default=None)
+
+
+class LogCapture(logging.Handler):
+    """
+    ルートロガーと AgentGatewayLogger (propagate しない) に1つだけ登録するハンドラ
+    取得範囲外のログはフォーマットもせずに捨てる
+    """
+
+    def __init__(self, max_lines: int = 500, max_sessions: int = 256, level: int = logging.INFO):
+        super().__init__(level=level)
+        self.max_lines = max_lines
+        self.max_sessions = max_sessions
+        self.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+        self._sessions: OrderedDict[str, deque] = OrderedDict()
+        self._sessions_lock = threading.Lock()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        scope = _current_scope.get()
+        if scope is None or not scope.active:
+            return
+        try:
+            text = _ANSI_ESCAPE.sub("", self.format(record))
+            display = parse_log_message(text)
+        except Exception:
+            self.handleError(record)
+            return
+        # deque(maxlen) の append はスレッドセーフ
+        scope._buffer.append(LogLine(scope.request_id, record, text, display))
+
+    @contextmanager
+    def request(self, session_id: str, request_id: str) -> Iterator[CaptureScope]:
+        """with の中 (と、そこから引き継いだコンテキスト) で出たログを取得する"""
+        scope = CaptureScope(session_id, request_id, self._session_buffer(session_id))
+        token = _current_scope.set(scope)
+        try:
+            yield scope
+        finally:
+            scope.active = False
+            _current_scope.reset(token)
+
+    def session_lines(self, session_id: str, request_id: str | None = None) -> list[LogLine]:
+        with self._sessions_lock:
+            buffer = self._sessions.get(session_id)
+        if buffer is None:
+            return []
+        lines = list(buffer)
+        if request_id is not None:
+            lines = [line for line in lines if line.request_id == request_id]
+        return lines
+
+    def drop_session(self, session_id: str) -> None:
+        with self._sessions_lock:
+            self._sessions.pop(session_id, None)
+
+    def session_count(self) -> int:
+        with self._sessions_lock:
+            return len(self._sessions)
+
+    def _session_buffer(self, session_id: str) -> deque:
+        with self._sessions_lock:
+            buffer = self._sessions.get(session_id)
+            if buffer is None:
+                buffer = self._sessions[session_id] = deque(maxlen=self.max_lines)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return buffer
+
+
+_capture_lock = threading.Lock()
+_capture: LogCapture | None = None
+
+
+def get_log_capture() -> LogCapture:
+    """プロセス共有の LogCapture (初回呼び出し時にロガーへ登録する。何度呼んでも増えない)"""
+    global _capture
+    with _capture_lock:
+        if _capture is None:
+            _capture = LogCapture()
+            logging.getLogger().addHandler(_capture)
+            gateway_logger = logging.getLogger("AgentGatewayLogger")
+            if not gateway_logger.propagate:
+                gateway_logger.addHandler(_capture)
+        return _capture
@@ -0,0 +1,353 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from logging import getLogger
+from typing import Callable
+
+from pydantic import BaseModel, Field
+
+logger = getLogger(__name__)
+
+
+def connection_parameters() -> dict:
+    """環境変数からSnowflakeの接続パラメータを組み立てる"""
+    return {
+        "account": os.getenv("SNOWFLAKE_ACCOUNT"),
+        "user": os.getenv("SNOWFLAKE_USER"),
+        "password": os.getenv("SNOWFLAKE_PASSWORD"),
+        "role": os.getenv("SNOWFLAKE_ROLE"),
+        "warehouse": os.getenv("SNOWFLAKE_WAREHOUSE"),
+        "database": os.getenv("SNOWFLAKE_DATABASE"),
+        "schema": os.getenv("SNOWFLAKE_SCHEMA"),
+    }
+
+
+def snowflake_connect():
+    import snowflake.connector
+
+    return snowflake.connector.connect(**connection_parameters())
+
+
+@contextmanager
+def use_role(connection, role: str):
+    """
+    ROLE を一時的に切り替えたカーソルを返し、終わったら元の ROLE (SNOWFLAKE_ROLE、未設定なら切り替え前の ROLE) に戻す
+    戻せなかった接続はプールに戻さないよう閉じる
+    """
+    cursor = connection.cursor()
+    original = os.getenv("SNOWFLAKE_ROLE") or cursor.execute("SELECT CURRENT_ROLE()").fetchone()[0]
+    cursor.execute(f"USE ROLE {role}")
+    try:
+        yield cursor
+    finally:
+        try:
+            cursor.execute(f"USE ROLE {original}")
+            cursor.close()
+        except Exception as e:
+            logger.error(f"ROLE を {original} に戻せなかったため、接続を閉じます: {e}")
+            connection.close()
+            raise
+
+
+class PoolTimeout(Exception):
+    """接続の貸し出しが acquire_timeout 内にできなかった"""
+
+
+class PoolMetrics(BaseModel):
+    """接続プールのメトリクス"""
+    size: int = Field(description="作成済みの接続数 (貸出中 + 待機中)")
+    in_use: int = Field(description="貸出中の接続数")
+    idle: int = Field(description="待機中の接続数")
+    max_size: int = Field(description="最大接続数")
+    utilization: float = Field(description="in_use / max_size")
+    borrowed: int = Field(description="累計貸出回数")
+    created: int = Field(description="累計作成数")
+    evicted: int = Field(description="アイドル超過・ヘルスチェック失敗で破棄した数")
+    timeouts: int = Field(description="貸出待ちタイムアウト回数")
+    wait_seconds_total: float = Field(description="貸出待ち時間の合計")
+    wait_seconds_max: float = Field(description="貸出待ち時間の最大")
+
+    @property
+    def wait_seconds_avg(self) -> float:
+        return self.wait_seconds_total / self.borrowed if self.borrowed else 0.0
+
+
+class _Entry:
+    __slots__ = ("connection", "last_used", "last_checked")
+
+    def __init__(self, connection):
+        now = time.monotonic()
+        self.connection = connection
+        self.last_used = now
+        self.last_checked = now
+
+
+class ConnectionPool:
+    """
+    プロセス内で共有するSnowflake接続プール
+    - acquire / release (または with pool.connection()) で貸し借りする
+    - 一定時間使われていない接続は貸し出し前に SELECT 1 でヘルスチェックする
+    - min_size を超えるアイドル接続は idle_timeout 経過後に破棄する
+    ROLE / WAREHOUSE などセッション状態を変更した場合は返却前に元に戻すこと (ROLE は use_role() で切り替える)
+    ツールには LeasedConnection を渡し、呼び出しごとに借りて返す
+    """
+
+    def __init__(
+        self,
+        connect: Callable | None = None,
+        min_size: int = 1,
+        max_size: int = 8,
+        idle_timeout: float = 600.0,
+        health_check_interval: float = 60.0,
+        acquire_timeout: float = 30.0,
+    ):
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError("0 <= min_size <= max_size かつ max_size >= 1 を指定してください")
+        self.connect = connect or snowflake_connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+
+        self._idle: list[_Entry] = []
+        self._in_use: dict[int, _Entry] = {}
+        self._pending = 0 # 作成中・ヘルスチェック中の接続数
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._borrowed = 0
+        self._created = 0
+        self._evicted = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def acquire(self, timeout: float | None = None):
+        """接続を借りる。上限に達している場合は返却を待つ"""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+
+        while True:
+            entry = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("接続プールはクローズ済みです")
+                    if self._idle:
+                        entry = self._idle.pop()
+                        self._pending += 1
+                        break
+                    if len(self._in_use) + len(self._idle) + self._pending < self.max_size:
+                        self._pending += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(f"{timeout}秒以内に接続を確保できませんでした (max_size={self.max_size})")
+                    self._cond.wait(remaining)
+
+            if entry is None:
+                # ロックの外で接続を作成する
+                try:
+                    entry = _Entry(self.connect())
+                except Exception:
+                    with self._cond:
+                        self._pending -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created += 1
+            elif not self._healthy(entry):
+                with self._cond:
+                    self._pending -= 1
+                    self._cond.notify()
+                self._discard(entry)
+                continue
+
+            with self._cond:
+                self._pending -= 1
+                self._in_use[id(entry.connection)] = entry
+                waited = time.monotonic() - start
+                self._borrowed += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            return entry.connection
+
+    def release(self, connection, discard: bool = False) -> None:
+        """接続を返却する。discard=True の場合は破棄する"""
+        with self._cond:
+            entry = self._in_use.pop(id(connection), None)
+            if entry is None:
+                return
+            if discard or self._closed or _is_closed(connection):
+                self._cond.notify()
+            else:
+                entry.last_used = time.monotonic()
+                self._idle.append(entry)
+                self._cond.notify()
+                entry = None
+        if entry is not None:
+            self._discard(entry)
+        self.evict_idle()
+
+    @contextmanager
+    def connection(self, timeout: float | None = None):
+        connection = self.acquire(timeout)
+        discard = False
+        try:
+            yield connection
+        except Exception:
+            # 接続自体が壊れている可能性があるので、失敗時は閉じているかを確認する
+            discard = _is_closed(connection)
+            raise
+        finally:
+            self.release(connection, discard=discard)
+
+    def session(self, connection):
+        """借りた接続をSnowpark Sessionとして包む (接続は新規作成しない)"""
+        from snowflake.snowpark import Session
+
+        return Session.builder.configs({"connection": connection}).create()
+
+    def root(self, session):
+        """Session から Snowflake の Python API (snowflake.core.Root) を作る"""
+        from snowflake.core import Root
+
+        return Root(session)
+
+    def evict_idle(self) -> int:
+        """min_size を超え、idle_timeout を過ぎたアイドル接続を破棄する"""
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            keep = []
+            # 古いものから破棄する
+            for entry in sorted(self._idle, key=lambda e: e.last_used):
+                if now - entry.last_used > self.idle_timeout and len(self._idle) - len(expired) > self.min_size:
+                    expired.append(entry)
+                else:
+                    keep.append(entry)
+            self._idle = keep
+        for entry in expired:
+            self._discard(entry)
+        return len(expired)
+
+    def fill(self) -> None:
+        """min_size まで接続を事前に作成する"""
+        connections = [self.acquire() for _ in range(max(self.min_size - self.metrics().size, 0))]
+        for connection in connections:
+            self.release(connection)
+
+    def metrics(self) -> PoolMetrics:
+        with self._cond:
+            in_use = len(self._in_use)
+            idle = len(self._idle)
+            return PoolMetrics(
+                size=in_use + idle,
+                in_use=in_use,
+                idle=idle,
+                max_size=self.max_size,
+                utilization=in_use / self.max_size,
+                borrowed=self._borrowed,
+                created=self._created,
+                evicted=self._evicted,
+                timeouts=self._timeouts,
+                wait_seconds_total=self._wait_total,
+                wait_seconds_max=self._wait_max,
+            )
+
+    def close(self) -> None:
+        """アイドル接続を閉じる。貸出中の接続は返却時に閉じる"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for entry in idle:
+            self._discard(entry)
+
+    def _healthy(self, entry: _Entry) -> bool:
+        connection = entry.connection
+        if getattr(connection, "is_closed", lambda: False)():
+            return False
+        if time.monotonic() - entry.last_checked < self.health_check_interval:
+            return True
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+        except Exception as e:
+            logger.warning(f"接続のヘルスチェックに失敗しました: {e}")
+            return False
+        entry.last_checked = time.monotonic()
+        return True
+
+    def _discard(self, entry: _Entry) -> None:
+        with self._cond:
+            self._evicted += 1
+        try:
+            entry.connection.close()
+        except Exception as e:
+            logger.debug(f"接続のクローズに失敗しました: {e}")
+
+
+class LeasedConnection:
+    """
+    ツールに渡す接続 (SnowflakeConnection の代わり)
+    lease() の中では、その呼び出し (コンテキスト) のためにプールから借りた接続に属性・メソッドを委譲し、抜けると返却する
+    同時に動くツール呼び出しはそれぞれ別の接続を使うので、1本のセッションで直列にならない
+    lease() の外では fallback の接続を使う
+    """
+
+    def __init__(self, pool: ConnectionPool, fallback):
+        self._pool = pool
+        self._fallback = fallback
+        self._current: contextvars.ContextVar = contextvars.ContextVar(f"leased_connection_{id(self)}", default=None)
+
+    @contextmanager
+    def lease(self):
+        """接続を借りる (既に借りているコンテキストではそれを使う)"""
+        current = self._current.get()
+        if current is not None:
+            yield current
+            return
+        with self._pool.connection() as connection:
+            token = self._current.set(connection)
+            try:
+                yield connection
+            finally:
+                self._current.reset(token)
+
+    def __getattr__(self, name: str):
+        return getattr(self._current.get() or self._fallback, name)
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """プロセスで共有する接続プールを返す (サイズは環境変数で指定できる)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                min_size=int(os.getenv("SNOWFLAKE_POOL_MIN_SIZE", "1")),
+                max_size=int(os.getenv("SNOWFLAKE_POOL_MAX_SIZE", "8")),
+                idle_timeout=float(os.getenv("SNOWFLAKE_POOL_IDLE_TIMEOUT", "600")),
+            )
+        return _pool
+
+
+def set_pool(pool: ConnectionPool | None) -> None:
+    """共有プールを差し替える (ベンチマークやテスト用のバックエンドを使う場合)"""
+    global _pool
+    with _pool_lock:
+        _pool = pool
+
+
+def _is_closed(connection) -> bool:
+    return bool(getattr(connection, "is_closed", lambda: False)())
@@ -0,0 +1,150 @@
+"""
+環境構築 (DDL・アカウント設定・データの初期ロード) の差分適用
+- リソースごとに「あるべき状態」のフィンガープリント (DDL の文面・元データのハッシュ・セマンティックモデルのハッシュ) を作り、
+  前回適用したときのフィンガープリント (状態ファイル) と比べて、変わったものだけを実行する
+- 状態ファイルはアカウント / データベース / スキーマごとに分けて記録する。実行に失敗したリソースは記録しない
+- テーブルが消えているなど、記録と実際が食い違う場合は forget() で記録を消してから適用し直す
+変更のない再起動では DDL を1文も実行せず、Cortex Search Service の作り直し (全件の再索引) も起こさない
+"""
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from logging import getLogger
+from pathlib import Path
+from typing import Callable
+
+from pydantic import BaseModel, Field
+
+logger = getLogger(__name__)
+
+
+def fingerprint(*parts) -> str:
+    """DDL の文面などのフィンガープリント (空白の違いは無視する)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        text = part if isinstance(part, str) else json.dumps(part, sort_keys=True, ensure_ascii=False, default=str)
+        digest.update(" ".join(text.split()).encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+def database_ddl(database: str) -> str:
+    return f"CREATE DATABASE IF NOT EXISTS {database}"
+
+
+def schema_ddl(schema: str) -> str:
+    return f"CREATE SCHEMA IF NOT EXISTS {schema}"
+
+
+def warehouse_ddl(warehouse: str) -> str:
+    return f"""CREATE OR REPLACE WAREHOUSE {warehouse} WITH
+            WAREHOUSE_SIZE='X-SMALL'
+            AUTO_SUSPEND = 120
+            AUTO_RESUME = TRUE
+            INITIALLY_SUSPENDED=TRUE"""
+
+
+class AppliedResource(BaseModel):
+    """適用済みのリソース"""
+    fingerprint: str
+    applied_at: str = Field(description="適用した日時 (ISO 8601)")
+
+
+class ProvisionState(BaseModel):
+    """環境構築の状態ファイル (対象 "アカウント/データベース/スキーマ" → リソース名 → 適用済みの状態)"""
+    targets: dict[str, dict[str, AppliedResource]] = Field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: Path) -> "ProvisionState":
+        if not path.exists():
+            return cls()
+        try:
+            return cls.model_validate_json(path.read_text(encoding="utf-8"))
+        except Exception as e:
+            logger.warning(f"環境構築の状態ファイルを読み込めませんでした。すべて適用し直します: {e}")
+            return cls()
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(self.model_dump_json(indent=2), encoding="utf-8")
+        tmp.replace(path)
+
+
+class Reconciler:
+    """
+    リソース単位で「フィンガープリントが記録と違うときだけ apply を実行する」
+    reconciler.ensure("search.service", fingerprint(ddl), self.create_search_service)
+    """
+
+    def __init__(self, path: Path, target: str):
+        self.path = Path(path)
+        self.target = target
+        self.applied: list[str] = []
+        self.skipped: list[str] = []
+        self._resources = dict(ProvisionState.load(self.path).targets.get(target, {}))
+        self._changed: set[str] = set()
+        self._forgotten: set[str] = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, database: str | None, schema: str | None) -> "Reconciler":
+        """状態ファイルは PROVISION_STATE_PATH、対象は SNOWFLAKE_ACCOUNT とデータベース・スキーマ"""
+        path = Path(os.getenv("PROVISION_STATE_PATH") or ".cache/provision_state.json")
+        target = "/".join(str(part or "").upper() for part in (os.getenv("SNOWFLAKE_ACCOUNT"), database, schema))
+        return cls(path, target)
+
+    def is_current(self, key: str, fingerprint: str) -> bool:
+        with self._lock:
+            resource = self._resources.get(key)
+        return resource is not None and resource.fingerprint == fingerprint
+
+    def ensure(self, key: str, fingerprint: str, apply: Callable[[], object], adopt: bool = False) -> bool:
+        """
+        記録と違えば apply を実行して記録し、True を返す (例外は記録せずにそのまま送出する)
+        adopt=True の場合、記録がなければ実行せずに適用済みとして記録する (既にあるリソースを作り直さない)
+        """
+        if self.is_current(key, fingerprint):
+            self.skipped.append(key)
+            logger.debug(f"{key} は変更がないため適用しません")
+            return False
+        with self._lock:
+            adopted = adopt and key not in self._resources
+        if adopted:
+            logger.info(f"{key} は既にあるため、現在の定義で適用済みとして記録します")
+        else:
+            apply()
+        with self._lock:
+            self._resources[key] = AppliedResource(fingerprint=fingerprint, applied_at=datetime.now().isoformat(timespec="seconds"))
+            self._changed.add(key)
+            self._forgotten.discard(key)
+            (self.skipped if adopted else self.applied).append(key)
+        self.save()
+        return not adopted
+
+    def forget(self, *prefixes: str) -> None:
+        """prefixes のいずれかで始まるリソースの記録を消す (引数なしの場合はすべて)"""
+        with self._lock:
+            keys = [key for key in self._resources if not prefixes or key.startswith(prefixes)]
+            for key in keys:
+                del self._resources[key]
+            self._changed.difference_update(keys)
+            self._forgotten.update(keys)
+        if keys:
+            logger.info(f"環境構築の記録を破棄しました: {', '.join(keys)}")
+            self.save()
+
+    def save(self) -> None:
+        """他のプロセス・インスタンスが記録した分を読み直してから、このインスタンスの変更を書き込む"""
+        with self._lock:
+            state = ProvisionState.load(self.path)
+            resources = state.targets.setdefault(self.target, {})
+            for key in self._forgotten:
+                resources.pop(key, None)
+            resources.update({key: self._resources[key] for key in self._changed})
+            state.save(self.path)
+
+    def summary(self) -> str:
+        return f"適用 {len(self.applied)}件 ({', '.join(self.applied) or 'なし'}) / 変更なし {len(self.skipped)}件"
@@ -0,0 +1,174 @@
+"""
+スキーマの情報 (テーブル・列・ステージ・Cortex Search Service) のキャッシュ
+- INFORMATION_SCHEMA の TABLES / COLUMNS / STAGES / CORTEX_SEARCH_SERVICES を UNION ALL でまとめ、1回の問い合わせで取得する
+- 取得結果 (SchemaSnapshot) は ttl 秒のあいだ使い回し、テーブルの有無・列・ステージ・Search Service の有無をメモリ上で答える
+- DDL を実行したら invalidate() で破棄する
+CORTEX_SEARCH_SERVICES を参照できない環境では、それを除いて取得し直す (Search Service の有無は「不明」になる)
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from logging import getLogger
+
+from pydantic import BaseModel, Field
+
+logger = getLogger(__name__)
+
+# 列: KIND, NAME, DETAIL, DATA_TYPE, POSITION, ROW_COUNT, LAST_ALTERED
+_TABLES = """
+SELECT 'TABLE' AS KIND, TABLE_NAME AS NAME, CAST(NULL AS VARCHAR) AS DETAIL, TABLE_TYPE AS DATA_TYPE,
+       CAST(NULL AS INTEGER) AS POSITION, ROW_COUNT, LAST_ALTERED
+FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = '{schema}'"""
+_COLUMNS = """
+SELECT 'COLUMN', TABLE_NAME, COLUMN_NAME, DATA_TYPE, ORDINAL_POSITION, CAST(NULL AS INTEGER), CAST(NULL AS TIMESTAMP)
+FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_SCHEMA = '{schema}'"""
+_STAGES = """
+SELECT 'STAGE', STAGE_NAME, CAST(NULL AS VARCHAR), STAGE_TYPE, CAST(NULL AS INTEGER), CAST(NULL AS INTEGER), CREATED
+FROM INFORMATION_SCHEMA.STAGES WHERE STAGE_SCHEMA = '{schema}'"""
+_SEARCH_SERVICES = """
+SELECT 'CORTEX_SEARCH_SERVICE', SERVICE_NAME, SEARCH_COLUMN, ATTRIBUTE_COLUMNS, CAST(NULL AS INTEGER), CAST(NULL AS INTEGER), CREATED
+FROM INFORMATION_SCHEMA.CORTEX_SEARCH_SERVICES WHERE SERVICE_SCHEMA = '{schema}'"""
+
+
+class TableInfo(BaseModel):
+    name: str
+    table_type: str | None = None
+    row_count: int | None = None
+    last_altered: datetime | None = None
+    columns: dict[str, str] = Field(default_factory=dict, description="列名 → データ型 (ORDINAL_POSITION の順)")
+
+
+class SearchServiceInfo(BaseModel):
+    name: str
+    search_column: str | None = None
+    attribute_columns: list[str] = Field(default_factory=list)
+
+
+class SchemaSnapshot(BaseModel):
+    """ある時点のスキーマの情報。名前はすべて大文字で持つ"""
+    schema_name: str = ""
+    tables: dict[str, TableInfo] = Field(default_factory=dict)
+    stages: set[str] = Field(default_factory=set)
+    search_services: dict[str, SearchServiceInfo] | None = Field(default=None, description="取得できなかった場合は None")
+    fetched_at: float = 0.0
+
+    @classmethod
+    def from_rows(cls, schema: str, rows, search_services: bool = True) -> "SchemaSnapshot":
+        snapshot = cls(schema_name=schema.upper(), search_services={} if search_services else None, fetched_at=time.time())
+        columns = []
+        for kind, name, detail, data_type, position, row_count, last_altered in rows:
+            name = str(name).upper()
+            if kind == "TABLE":
+                snapshot.tables[name] = TableInfo(name=name, table_type=data_type, row_count=row_count, last_altered=last_altered)
+            elif kind == "COLUMN":
+                columns.append((name, position or 0, str(detail).upper(), data_type))
+            elif kind == "STAGE":
+                snapshot.stages.add(name)
+            elif kind == "CORTEX_SEARCH_SERVICE" and snapshot.search_services is not None:
+                snapshot.search_services[name] = SearchServiceInfo(
+                    name=name, search_column=detail,
+                    attribute_columns=[c.strip() for c in (data_type or "").split(",") if c.strip()])
+        for table, _, column, data_type in sorted(columns):
+            if table in snapshot.tables:
+                snapshot.tables[table].columns[column] = data_type
+        return snapshot
+
+    def table_exists(self, table: str) -> bool:
+        return _name(table) in self.tables
+
+    def missing_tables(self, tables) -> list[str]:
+        return [table for table in tables if not self.table_exists(table)]
+
+    def columns(self, table: str) -> dict[str, str]:
+        info = self.tables.get(_name(table))
+        return info.columns if info is not None else {}
+
+    def missing_columns(self, table: str, columns) -> list[str]:
+        """テーブルにない列 (テーブル自体がない場合はすべて)"""
+        existing = self.columns(table)
+        return [column for column in columns if column.upper() not in existing]
+
+    def last_altered(self) -> dict[str, datetime | None]:
+        """テーブル名 → LAST_ALTERED"""
+        return {name: info.last_altered for name, info in self.tables.items()}
+
+    def stage_exists(self, stage: str) -> bool:
+        return _name(stage) in self.stages
+
+    def search_service_exists(self, service: str) -> bool | None:
+        """Search Service があるか (CORTEX_SEARCH_SERVICES を参照できなかった場合は None)"""
+        if self.search_services is None:
+            return None
+        return _name(service) in self.search_services
+
+
+def _name(qualified: str) -> str:
+    return qualified.rsplit(".", 1)[-1].strip('"').upper()
+
+
+class SchemaCache:
+    """スキーマ1つ分の SchemaSnapshot を ttl 秒キャッシュする"""
+
+    def __init__(self, schema: str, ttl: float = 60.0):
+        self.schema = schema
+        self.ttl = ttl
+        self.fetches = 0
+        self._snapshot: SchemaSnapshot | None = None
+        self._lock = threading.Lock()
+
+    def get(self, connector, force: bool = False) -> SchemaSnapshot:
+        """キャッシュが新しければそれを、なければ1回の問い合わせで取得して返す (取得に失敗したら空のスナップショット)"""
+        with self._lock:
+            snapshot = self._snapshot
+            if not force and snapshot is not None and time.time() - snapshot.fetched_at < self.ttl:
+                return snapshot
+            try:
+                snapshot = self.fetch(connector)
+            except Exception as e:
+                logger.error(f"スキーマ情報の取得でエラー: {e}")
+                return SchemaSnapshot(schema_name=self.schema.upper())
+            self._snapshot = snapshot
+            return snapshot
+
+    def fetch(self, connector) -> SchemaSnapshot:
+        start = time.perf_counter()
+        schema = self.schema.upper()
+        branches = [_TABLES, _COLUMNS, _STAGES]
+        try:
+            rows = self._query(connector, branches + [_SEARCH_SERVICES], schema)
+            search_services = True
+        except Exception as e:
+            logger.warning(f"CORTEX_SEARCH_SERVICES を参照できないため、除いて取得します: {e}")
+            rows = self._query(connector, branches, schema)
+            search_services = False
+        self.fetches += 1
+        snapshot = SchemaSnapshot.from_rows(schema, rows, search_services=search_services)
+        logger.info(f"スキーマ {schema} の情報を取得しました (テーブル {len(snapshot.tables)}件, "
+                    f"ステージ {len(snapshot.stages)}件, {time.perf_counter() - start:.2f}s)")
+        return snapshot
+
+    def _query(self, connector, branches: list[str], schema: str) -> list:
+        cursor = connector.cursor()
+        try:
+            cursor.execute("\nUNION ALL".join(branch.format(schema=schema) for branch in branches))
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._snapshot = None
+
+
+_caches: dict[str, SchemaCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_schema_cache(database: str | None, schema: str | None) -> SchemaCache:
+    """プロセスで共有するスキーマのキャッシュ (TTL は SCHEMA_CACHE_TTL 秒)"""
+    key = f"{database or ''}.{schema or ''}".upper()
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = SchemaCache(schema or "", ttl=float(os.getenv("SCHEMA_CACHE_TTL", "60")))
+        return _caches[key]
@@ -1,20 +1,12 @@
 import streamlit as st
 from src.agent.agent import AgentGateway
-import asyncio
-import io
-import logging
 import os
-import queue
-import re
-import sys
-import threading
 import uuid
 import warnings
 import requests
 from agent_gateway.tools.utils import _determine_runtime
 from dotenv import load_dotenv
-from agent_gateway.tools.utils import parse_log_message
-from agent_gateway import Agent
+from src.common.log_capture import get_log_capture
 
 warnings.filterwarnings("ignore")
 
@@ -25,15 +17,14 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
-if "agent" not in st.session_state:
-    st.session_state.agent_gateway = AgentGateway()
-    st.session_state.agent_gateway.enable_cross_region_inference()
-    st.session_state.snowflake_tools = st.session_state.agent_gateway.initialize_tools()
-    st.session_state.agent = Agent(snowflake_connection=st.session_state.agent_gateway.connection, 
-                    tools=st.session_state.snowflake_tools, 
-                    max_retries=3,
-                    planner_llm="claude-4-sonnet", 
-                    agent_llm="claude-4-sonnet")
+@st.cache_resource
+def get_agent_gateway() -> AgentGateway:
+    """プロセスで1つのAgentGatewayを共有する (環境構築は `python -m src.bootstrap` で事前に行う)"""
+    return AgentGateway()
+
+
+if "agent_gateway" not in st.session_state:
+    st.session_state.agent_gateway = get_agent_gateway()
 
 
 
@@ -47,133 +38,40 @@ source_list = []
 if "prompt_history" not in st.session_state:
     st.session_state["prompt_history"] = {}
 
-class StreamlitLogHandler(logging.Handler):
-    def __init__(self):
-        super().__init__()
-        self.log_buffer = io.StringIO()
-        self.ansi_escape = re.compile(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])")
-
-    def emit(self, record):
-        msg = self.format(record)
-        clean_msg = self.ansi_escape.sub("", msg)
-        self.log_buffer.write(clean_msg + "\n")
-
-    def get_logs(self):
-        return self.log_buffer.getvalue()
-
-    def process_logs(self):
-        raw_logs = self.get_logs()
-        lines = raw_logs.strip().split("\n")
-        log_output = [parse_log_message(line.strip()) for line in lines if line.strip()]
-        cleaned_output = [line for line in log_output if line is not None]
-        all_logs = "\n".join(cleaned_output)
-        return all_logs
-
-    def clear_logs(self):
-        self.log_buffer = io.StringIO()
-
-
-def setup_logging():
-    root_logger = logging.getLogger()
-    handler = StreamlitLogHandler()
-    handler.setLevel(logging.INFO)
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
-    handler.setFormatter(formatter)
-    root_logger.addHandler(handler)
-    return handler
-
-
-# Set up logging
-if "logging_setup" not in st.session_state:
-    st.session_state.logging_setup = setup_logging()
-    st.logger = logging.getLogger("AgentGatewayLogger")
-    st.logger.propagate = True
-
-
-def run_acall(prompt, message_queue, agent):
-    old_stdout = sys.stdout
-    new_stdout = io.StringIO()
-    sys.stdout = new_stdout
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-
-    # Run the async call
-    response = loop.run_until_complete(agent.acall(prompt))
-    loop.close()
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = str(uuid.uuid4())
 
-    # Restore stdout
-    sys.stdout = old_stdout
+# ログはプロセス共有のハンドラ1つで、セッション・リクエスト単位に取得する
+log_capture = get_log_capture()
 
-    # Capture and send logs to the message queue
-    output = new_stdout.getvalue()
-    lines = output.split("\n")
-    for line in lines:
-        if line and "Running" in line and "tool" in line:
-            # Extract and send the tool selection string
-            tool_selection_string = extract_tool_name(line)
-            message_queue.put({"tool_selection": tool_selection_string})
-        elif line:
-            logging.info(line)  # Log other messages
-            message_queue.put(line)
 
-    # Ensure the final output is correctly added to the queue
-    message_queue.put(response)
-
-
-def process_message(prompt_id: str):
-    prompt = st.session_state["prompt_history"][prompt_id].get("prompt")
-    message_queue = queue.Queue()
-    agent = st.session_state.agent
-    log_container = st.empty()
-    log_handler = setup_logging()
-
-    def run_analysis():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        response = loop.run_until_complete(agent.acall(prompt))
-        loop.close()
-        message_queue.put(response)
-
-    thread = threading.Thread(target=run_analysis)
-    thread.start()
-
-    while True:
-        try:
-            response = message_queue.get(timeout=1)
-            if isinstance(response, dict) and "output" in response:
-                final_response = response
-                st.session_state["prompt_history"][prompt_id]["response"] = (
-                    final_response["output"]
-                )
-                st.session_state["prompt_history"][prompt_id]["sources"] = (
-                    final_response["sources"]
-                )
-                logs = log_handler.process_logs()
-                if logs:
-                    log_container.code(logs)
-                log_container.empty()
-                yield final_response
-                break
+def process_message(prompt_id: str, response_container):
+    """
+    ゲートウェイの常駐ループでクエリを実行し、進捗イベントが届いたらその場で表示する
+    進捗は追記のみ。生成中の回答は response_container を書き換え、最終回答が届いたら1回だけ再描画する
+    """
+    prompt_record = st.session_state["prompt_history"][prompt_id]
+    agent_gateway = st.session_state.agent_gateway
+
+    with log_capture.request(st.session_state["session_id"], prompt_id), \
+            st.status("Awaiting Response...", expanded=True) as status:
+        for event in agent_gateway.stream(prompt_record.get("prompt")):
+            if event.kind == "final":
+                prompt_record["response"] = event.data["output"]
+                prompt_record["sources"] = event.data["sources"]
+                status.update(label=f"Completed ({event.elapsed:.1f}s)", state="complete", expanded=False)
+            elif event.kind == "error":
+                prompt_record["response"] = f"エラーが発生しました: {event.text}"
+                status.update(label="Error", state="error")
+            elif event.kind == "answer":
+                response_container.markdown(event.text, unsafe_allow_html=True)
+            elif event.kind == "tool_result":
+                status.write(f"{event.tool_name}: {event.text}")
             else:
-                logs = log_handler.process_logs()
-                if logs:
-                    log_container.code(logs)
-
-        except queue.Empty:
-            logs = log_handler.process_logs()
-            if logs:
-                log_container.code(logs)
+                status.write(event.text)
     st.rerun()
 
 
-def extract_tool_name(statement):
-    start = statement.find("Running") + len("Running") + 1
-    end = statement.find("tool")
-    return statement[start:end].strip()
-
-
 st.markdown(
     """
     <style>
@@ -223,12 +121,7 @@ with st.container(border=False):
         with st.chat_message("assistant"):
             response_container = st.empty()
             if current_prompt.get("response") == "waiting":
-                # Start processing messages
-                message_generator = process_message(prompt_id=id)
-
-                with st.spinner("Awaiting Response..."):
-                    for response in message_generator:
-                        response_container.text(response)
+                process_message(prompt_id=id, response_container=response_container)
             else:
                 # Display the final response
                 response_container.markdown(
@@ -270,6 +163,12 @@ with st.container(border=False):
                         unsafe_allow_html=True,
                     )
 
+                # このリクエストのログ (セッションのリングバッファに残っている分)
+                log_lines = log_capture.session_lines(st.session_state["session_id"], id)
+                if log_lines:
+                    with st.expander("実行ログ"):
+                        st.code("\n".join(line.text for line in log_lines))
+
 
 st.chat_input(
     "Ask Anything", on_submit=create_prompt, key="chat_input", args=["chat_input"]
@@ -0,0 +1,202 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from logging import getLogger
+from pathlib import Path
+from typing import Iterable, Iterator, Literal
+
+from .embedding_pipeline import estimate_tokens
+from .response import Chunk
+
+logger = getLogger(__name__)
+
+# 見出しとみなす行: 第X条/章/節、「1. はじめに」「5.1 国内市場強化施策」、【...】・■ などの記号見出し
+HEADING = re.compile(
+    r"^(第\s*[0-9０-９一二三四五六七八九十百千]+\s*[編章節条項款]"
+    r"|[0-9０-９]+[.．]\s*\S"
+    r"|[0-9０-９]+(?:[.．][0-9０-９]+)+\s*\S"
+    r"|[【■◆□◇●]"
+    r"|[（(][0-9０-９]+[)）])"
+)
+HEADING_MAX_CHARS = 40
+BULLET = re.compile(r"^[-‐・•*]\s*")
+KEY_VALUE = re.compile(r"^[^。：:]{1,24}[：:]")
+SENTENCE_END = re.compile(r"(?<=[。！？!?])")
+CLOSED_LINE = ("。", "！", "？", "!", "?", "」", "』", "）", ")")
+
+
+def count_pages(file_path) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(str(file_path)).pages)
+
+
+def is_heading(line: str) -> bool:
+    return len(line) <= HEADING_MAX_CHARS and not line.endswith("。") and HEADING.match(line) is not None
+
+
+def split_structured(pages: Iterable[tuple[int, str]], max_tokens: int) -> list[tuple[str, int, str | None]]:
+    """
+    文と見出しの境界でチャンクに分ける (チャンクの大きさはトークン数の上限 max_tokens で決める)
+    - 見出し行 (第X条・番号つき見出しなど) の前では必ず区切り、以降のチャンクの section にする
+    - PDFの行の折り返しはつなぎ直し、文の途中では区切らない (1文で上限を超える場合だけ文字数で切る)
+    - ページをまたいでもつなげる。page はチャンク先頭のページ番号 (1始まり)
+    重なり (overlap) は持たせない。文脈は section で補う
+    返り値は (テキスト, ページ, 見出し) のリスト
+    """
+    chunks: list[tuple[str, int, str | None]] = []
+    units: list[str] = []
+    headings_only = False # units が見出しだけ (「5. 戦略」の直後の「5.1 ...」は同じチャンクにつなぐ)
+    tokens = 0
+    page_of_chunk = 0
+    section: str | None = None
+
+    def flush():
+        nonlocal units, tokens
+        if units:
+            chunks.append(("\n".join(units), page_of_chunk, section))
+        units, tokens = [], 0
+
+    def add(unit: str, page: int):
+        nonlocal tokens, page_of_chunk
+        size = estimate_tokens(unit)
+        if size > max_tokens:
+            flush()
+            for piece in _hard_split(unit, max_tokens):
+                page_of_chunk = page
+                units.append(piece)
+                flush()
+            return
+        if units and tokens + size > max_tokens:
+            flush()
+        if not units:
+            page_of_chunk = page
+        units.append(unit)
+        tokens += size
+
+    for page, text in pages:
+        for line in _logical_lines(text):
+            if is_heading(line):
+                if not headings_only:
+                    flush()
+                section = line
+                add(line, page)
+                headings_only = True
+                continue
+            for sentence in SENTENCE_END.split(line):
+                if sentence.strip():
+                    add(sentence.strip(), page)
+                    headings_only = False
+    flush()
+    return chunks
+
+
+def _logical_lines(text: str) -> Iterator[str]:
+    """PDFの折り返しで切れた行をつなぎ直す (見出し・箇条書き・文末で終わる行の後は改行として残す)"""
+    current = ""
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            if current:
+                yield current
+            current = ""
+            continue
+        starts_block = is_heading(line) or BULLET.match(line) is not None or KEY_VALUE.match(line) is not None
+        if current and (starts_block or current.endswith(CLOSED_LINE) or is_heading(current)):
+            yield current
+            current = ""
+        current += line
+    if current:
+        yield current
+
+
+def _hard_split(text: str, max_tokens: int) -> Iterator[str]:
+    start = 0
+    while start < len(text):
+        end = start + 1
+        # 上限を超える直前まで伸ばす (最低1文字)
+        while end < len(text) and estimate_tokens(text[start:end + 1]) <= max_tokens:
+            end += 1
+        yield text[start:end]
+        start = end
+
+
+def _extract_page_range(task: tuple) -> list[tuple[int, str]]:
+    """ワーカープロセスで実行する: PDFの指定ページ範囲のテキストを (ページ番号, テキスト) のリストで返す"""
+    from pypdf import PdfReader
+
+    file_path, start, end = task[:3]
+    reader = PdfReader(file_path)
+    return [(start + i + 1, page.extract_text()) for i, page in enumerate(reader.pages[start:end])]
+
+
+def _split_page_range(task: tuple) -> list[tuple[str, int, str | None]]:
+    """
+    ワーカープロセスで実行する: PDFの指定ページ範囲を抽出して recursive でチャンクに分割する
+    PyPDFLoader と同じくページ単位で分割するので、直列実行と同じチャンク列になる
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    chunk_size, chunk_overlap = task[3:5]
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return [(text, page, None) for page, page_text in _extract_page_range(task) for text in splitter.split_text(page_text)]
+
+
+def iter_pdf_chunks(
+    paths: Iterable[Path],
+    chunk_size: int,
+    chunk_overlap: int,
+    max_workers: int | None = None,
+    pages_per_task: int = 8,
+    strategy: Literal["recursive", "structured"] = "recursive",
+    max_tokens: int = 300,
+) -> Iterator[Chunk]:
+    """
+    PDFをページ範囲単位のタスクに分け、プロセスプールで並列に抽出・分割する
+    Chunk はファイル順・ページ順にジェネレータで返す (chunk_id はファイル内の通し番号)
+    strategy="recursive" は chunk_size / chunk_overlap 文字の RecursiveCharacterTextSplitter、
+    "structured" は見出し・文境界を守る max_tokens トークン上限の分割
+    structured は見出し (section) と書きかけのチャンクがページ範囲をまたぐので、ワーカーはテキストの抽出だけを行い、
+    分割はファイルごとに全ページを順に通して行う (ページ範囲の区切り方によらず直列実行と同じチャンク列になる)
+    """
+    paths = [Path(path) for path in paths]
+    max_workers = max_workers or os.cpu_count() or 1
+
+    tasks = []
+    for path in paths:
+        pages = count_pages(path)
+        for start in range(0, pages, pages_per_task):
+            tasks.append((str(path), start, min(start + pages_per_task, pages), chunk_size, chunk_overlap))
+
+    worker = _extract_page_range if strategy == "structured" else _split_page_range
+    if max_workers == 1 or len(tasks) <= 1:
+        yield from _number_chunks(_by_file(tasks, map(worker, tasks), strategy, max_tokens))
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # map は投入順に結果を返すので、ファイル内の chunk_id が直列実行と一致する
+        yield from _number_chunks(_by_file(tasks, executor.map(worker, tasks), strategy, max_tokens))
+
+
+def _by_file(
+    tasks: list[tuple], results: Iterator[list], strategy: str, max_tokens: int
+) -> Iterator[tuple[str, list[tuple[str, int, str | None]]]]:
+    """タスクの結果を (ファイル, チャンク) にする。structured はファイル内の全タスクのページを順につないで分割する"""
+    for file_path, group in groupby(zip(tasks, results), key=lambda item: item[0][0]):
+        if strategy == "structured":
+            yield file_path, split_structured((page for _, pages in group for page in pages), max_tokens)
+        else:
+            for _, texts in group:
+                yield file_path, texts
+
+
+def _number_chunks(results: Iterator[tuple[str, list[tuple[str, int, str | None]]]]) -> Iterator[Chunk]:
+    current_file = None
+    num = 0
+    for file_path, texts in results:
+        if file_path != current_file:
+            current_file, num = file_path, 0
+        for text, page, section in texts:
+            yield Chunk(num=num, file_name=Path(file_path).name, text=text, page=page, section=section)
+            num += 1
@@ -0,0 +1,75 @@
+"""
+チャンク・クエリの埋め込み
+embed_documents / embed_query を持つもの (LangChain の Embeddings と同じ形) なら何でも使える
+- azure: AzureOpenAIEmbeddings
+- hashing: 文字 n-gram をハッシュして固定次元に落とす決定的な埋め込み (外部APIなし。テスト・ベンチマーク用)
+"""
+import os
+import zlib
+from typing import Protocol
+
+import numpy as np
+
+
+class Embedder(Protocol):
+    def embed_documents(self, texts: list[str]) -> list[list[float]]: ...
+
+    def embed_query(self, text: str) -> list[float]: ...
+
+
+class HashingEmbedder:
+    """
+    文字 n-gram (既定は 1〜3 文字) を符号付きでハッシュし、dim 次元のベクトルにして L2 正規化する
+    日本語でも分かち書きなしで語の重なりを捉えられる
+    """
+
+    def __init__(self, dim: int = 256, ngram_range: tuple[int, int] = (1, 3)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    @property
+    def name(self) -> str:
+        return f"hashing:{self.dim}"
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embed_matrix(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_matrix([text])[0].tolist()
+
+    def embed_matrix(self, texts: list[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        low, high = self.ngram_range
+        for row, text in enumerate(texts):
+            text = "".join(text.split())
+            for n in range(low, high + 1):
+                for i in range(len(text) - n + 1):
+                    value = zlib.crc32(text[i:i + n].encode())
+                    matrix[row, value % self.dim] += 1.0 if value >> 31 else -1.0
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def embedder_name(embedder) -> str:
+    """インデックスに記録する埋め込みモデルの識別子 (検索時に同じモデルを使うため)"""
+    if hasattr(embedder, "name"):
+        return embedder.name
+    return f"azure:{getattr(embedder, 'deployment', None) or getattr(embedder, 'model', '')}"
+
+
+def load_embedder(name: str) -> Embedder:
+    """embedder_name() の識別子から埋め込みを作る"""
+    kind, _, arg = name.partition(":")
+    if kind == "hashing":
+        return HashingEmbedder(dim=int(arg or 256))
+    if kind == "azure":
+        from langchain_openai import AzureOpenAIEmbeddings
+
+        return AzureOpenAIEmbeddings(
+            deployment=arg,
+            model=arg,
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            openai_api_type="azure",
+            openai_api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            openai_api_version=os.getenv("AZURE_OPENAI_API_VERSION"))
+    raise ValueError(f"未対応の埋め込みです: {name}")
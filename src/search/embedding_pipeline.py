@@ -0,0 +1,257 @@
+"""
+チャンク埋め込みのパイプライン
+- テキストをトークン数の上限でバッチにまとめる (1チャンク1リクエストにしない)
+- 複数バッチを並行に投げ、分あたりのリクエスト数・トークン数の上限を守る
+- 失敗 (429 など) は指数バックオフ + ジッタで再試行する
+- ベクトルはモデル名 + テキストのハッシュをキーにディスク (SQLite) にキャッシュし、変更のないチャンクは API を呼ばない
+embed_documents / embed_query を持つので、そのまま VectorIndex.build などの埋め込みとして使える
+"""
+import asyncio
+import hashlib
+import random
+import sqlite3
+import threading
+import time
+from logging import getLogger
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+from pydantic import BaseModel
+
+from .embedder import Embedder, embedder_name
+
+logger = getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の見積もり (ASCII は4文字で1トークン、日本語などはほぼ1文字1トークン)"""
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars) + 1
+
+
+class EmbeddingCache:
+    """(モデル名, テキストのSHA-256) → float32 ベクトル の SQLite キャッシュ"""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (model TEXT, hash TEXT, vector BLOB, PRIMARY KEY (model, hash))")
+        self._db.commit()
+
+    def get_many(self, model: str, hashes: list[str]) -> dict[str, np.ndarray]:
+        found = {}
+        with self._lock:
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i + 500]
+                rows = self._db.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(part))})",
+                    [model, *part]).fetchall()
+                found.update((h, np.frombuffer(v, dtype=np.float32)) for h, v in rows)
+        return found
+
+    def put_many(self, model: str, items: list[tuple[str, np.ndarray]]) -> None:
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(model, h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in items])
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class ThroughputLimiter:
+    """
+    分あたりのリクエスト数 (rpm) とトークン数 (tpm) のトークンバケット
+    acquire(tokens) は両方に余裕ができるまで待つ。429 を受けたら pause() で全体を止める
+    確認と消費の間に await を挟まないので、同じループ内ではロックなしで使える (ループをまたいで状態を保つ)
+    """
+
+    def __init__(self, rpm: float | None = None, tpm: float | None = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        now = time.monotonic()
+        self._requests = (float(rpm or 0), now)
+        self._tokens = (float(tpm or 0), now)
+        self._paused_until = 0.0
+        self.wait_seconds = 0.0
+
+    def pause(self, seconds: float) -> None:
+        """
+        並行しているリクエストもまとめて seconds 秒止める (一斉に再試行して再び 429 になるのを防ぐ)
+        バケットも空にして、再開後はバーストせずに rpm / tpm の速度で流す
+        """
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._requests = (0.0, now + seconds)
+        self._tokens = (0.0, now + seconds)
+
+    async def acquire(self, tokens: int) -> None:
+        while True:
+            now = time.monotonic()
+            wait = max(self._paused_until - now, self._wait(self.rpm, "_requests", 1, now), self._wait(self.tpm, "_tokens", tokens, now))
+            if wait <= 0:
+                self._take(self.rpm, "_requests", 1, now)
+                self._take(self.tpm, "_tokens", tokens, now)
+                return
+            self.wait_seconds += wait
+            await asyncio.sleep(wait)
+
+    def _level(self, limit, name, now) -> float:
+        level, updated = getattr(self, name)
+        return min(float(limit), level + (now - updated) * limit / 60.0)
+
+    def _wait(self, limit, name, amount, now) -> float:
+        if not limit:
+            return 0.0
+        # 1回でバケットを超える要求は、満杯になるまで待って通す
+        amount = min(amount, limit)
+        return max(0.0, (amount - self._level(limit, name, now)) * 60.0 / limit)
+
+    def _take(self, limit, name, amount, now) -> None:
+        if limit:
+            setattr(self, name, (self._level(limit, name, now) - min(amount, limit), now))
+
+
+class EmbeddingMetrics(BaseModel):
+    texts: int = 0
+    cache_hits: int = 0
+    api_calls: int = 0
+    api_tokens: int = 0
+    retries: int = 0
+    rate_limit_wait_seconds: float = 0.0
+    seconds: float = 0.0
+
+
+class EmbeddingPipeline:
+    """
+    embedder (embed_documents を持つもの) の前段に置くバッチ化・流量制御・キャッシュ
+    同じテキストが複数回出てきた場合も1回だけ埋め込む
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        cache: EmbeddingCache | None = None,
+        max_batch_tokens: int = 8000,
+        max_batch_size: int = 256,
+        concurrency: int = 4,
+        rpm: float | None = None,
+        tpm: float | None = None,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        count_tokens: Callable[[str], int] = estimate_tokens,
+    ):
+        self.embedder = embedder
+        self.name = embedder_name(embedder)
+        self.cache = cache
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.count_tokens = count_tokens
+        self.limiter = ThroughputLimiter(rpm, tpm)
+        self._metrics = EmbeddingMetrics()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embed_matrix(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_matrix([text])[0].tolist()
+
+    def embed_matrix(self, texts: list[str]) -> np.ndarray:
+        """同期版 (イベントループの外から呼ぶ)"""
+        return asyncio.run(self.aembed(texts))
+
+    async def aembed(self, texts: list[str]) -> np.ndarray:
+        start = time.perf_counter()
+        hashes = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+        vectors: dict[str, np.ndarray] = self.cache.get_many(self.name, list(set(hashes))) if self.cache else {}
+        self._metrics.texts += len(texts)
+        self._metrics.cache_hits += sum(1 for h in hashes if h in vectors)
+
+        pending: dict[str, str] = {}
+        for h, text in zip(hashes, texts):
+            if h not in vectors:
+                pending.setdefault(h, text)
+
+        if pending:
+            waited = self.limiter.wait_seconds
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def run(batch: list[tuple[str, str]]):
+                async with semaphore:
+                    embedded = await self._embed_batch([text for _, text in batch])
+                items = list(zip((h for h, _ in batch), embedded))
+                vectors.update(items)
+                if self.cache:
+                    await asyncio.to_thread(self.cache.put_many, self.name, items)
+
+            await asyncio.gather(*(run(batch) for batch in self.batches(list(pending.items()))))
+            self._metrics.rate_limit_wait_seconds += self.limiter.wait_seconds - waited
+
+        self._metrics.seconds += time.perf_counter() - start
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack([vectors[h] for h in hashes]).astype(np.float32)
+
+    def batches(self, items: list[tuple[str, str]]) -> list[list[tuple[str, str]]]:
+        """トークン数の上限 (max_batch_tokens) と件数の上限 (max_batch_size) でまとめる"""
+        batches, batch, batch_tokens = [], [], 0
+        for item in items:
+            tokens = self.count_tokens(item[1])
+            if batch and (batch_tokens + tokens > self.max_batch_tokens or len(batch) >= self.max_batch_size):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(item)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def _embed_batch(self, texts: list[str]) -> list[np.ndarray]:
+        tokens = sum(self.count_tokens(text) for text in texts)
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(tokens)
+            self._metrics.api_calls += 1
+            self._metrics.api_tokens += tokens
+            try:
+                embedded = await asyncio.to_thread(self.embedder.embed_documents, texts)
+                return [np.asarray(v, dtype=np.float32) for v in embedded]
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                self._metrics.retries += 1
+                delay = retry_after(e) or self.backoff * 2 ** attempt
+                delay *= random.uniform(1.0, 1.5)
+                if is_rate_limited(e):
+                    self.limiter.pause(delay)
+                logger.warning(f"埋め込みに失敗しました。{delay:.1f}s 後に再試行します ({attempt + 1}/{self.max_retries}): {e}")
+                await asyncio.sleep(delay)
+
+    def metrics(self) -> EmbeddingMetrics:
+        return self._metrics.model_copy()
+
+
+def is_rate_limited(error: Exception) -> bool:
+    response = getattr(error, "response", None)
+    return getattr(error, "status_code", None) == 429 or getattr(response, "status_code", None) == 429
+
+
+def retry_after(error: Exception) -> float | None:
+    """429 応答の Retry-After (openai / httpx の例外から取れる場合)"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is None:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
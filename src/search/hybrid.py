@@ -0,0 +1,88 @@
+"""
+キーワード (BM25) とベクトルのハイブリッド検索
+両方の索引は同じ順序のチャンク (取り込み時に同じ SELECT の結果) から作る前提で、全チャンクのスコアを配列のまま融合する
+- weighted: それぞれのスコアを [0, 1] に min-max 正規化して alpha で重み付けした和
+- rrf: Reciprocal Rank Fusion (スコアの尺度に依存しない。上位 candidates 件の順位だけを使う)
+"""
+from typing import Literal
+
+import numpy as np
+from pydantic import BaseModel
+
+from .embedder import Embedder
+from .keyword_index import KeywordIndex, top_k
+from .response import Search_Result
+from .vector_index import VectorIndex
+
+
+class HybridResult(BaseModel):
+    results: list[Search_Result]
+    vector_top: float | None = None # ベクトル検索の最大コサイン類似度 (ベクトル索引がない場合は None)
+    keyword_top: float | None = None # BM25 の最大スコア (キーワード索引がない場合は None)
+
+
+class HybridRetriever:
+    def __init__(
+        self,
+        vector_index: VectorIndex | None = None,
+        keyword_index: KeywordIndex | None = None,
+        embedder: Embedder | None = None,
+        alpha: float = 0.5,
+        method: Literal["weighted", "rrf"] = "weighted",
+        rrf_k: int = 60,
+        candidates: int = 100,
+    ):
+        if vector_index is None and keyword_index is None:
+            raise ValueError("vector_index か keyword_index のどちらかが必要です")
+        if vector_index is not None and embedder is None:
+            raise ValueError("ベクトル検索には embedder が必要です")
+        if vector_index is not None and keyword_index is not None and vector_index.chunks != keyword_index.chunks:
+            raise ValueError("ベクトル索引とキーワード索引のチャンクが一致しません")
+        self.vector_index = vector_index
+        self.keyword_index = keyword_index
+        self.embedder = embedder
+        self.alpha = alpha
+        self.method = method
+        self.rrf_k = rrf_k
+        self.candidates = candidates
+
+    @property
+    def chunks(self) -> list[tuple[int, str, str]]:
+        return (self.vector_index or self.keyword_index).chunks
+
+    def search(self, query: str, k: int = 10) -> HybridResult:
+        vector = self.vector_index.scores(self.embedder.embed_query(query)) if self.vector_index is not None else None
+        keyword = self.keyword_index.scores(query) if self.keyword_index is not None else None
+        result = HybridResult(
+            results=[],
+            vector_top=float(vector.max()) if vector is not None and len(vector) else None,
+            keyword_top=float(keyword.max()) if keyword is not None and len(keyword) else None,
+        )
+        if vector is None or keyword is None:
+            result.results = top_k(vector if vector is not None else keyword, self.chunks, k)
+            return result
+
+        fused = self._rrf(vector, keyword) if self.method == "rrf" else self._weighted(vector, keyword)
+        result.results = top_k(fused, self.chunks, k)
+        return result
+
+    def _weighted(self, vector: np.ndarray, keyword: np.ndarray) -> np.ndarray:
+        return self.alpha * min_max(vector) + (1.0 - self.alpha) * min_max(keyword)
+
+    def _rrf(self, vector: np.ndarray, keyword: np.ndarray) -> np.ndarray:
+        fused = np.zeros(len(vector), dtype=np.float32)
+        n = min(self.candidates, len(vector))
+        for scores in (vector, keyword):
+            top = np.argpartition(-scores, n - 1)[:n]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            # スコアが 0 (キーワードが1つも一致しない) のチャンクには順位を与えない
+            top = top[scores[top] > 0] if scores is keyword else top
+            fused[top] += 1.0 / (self.rrf_k + np.arange(1, len(top) + 1))
+        return fused
+
+
+def min_max(scores: np.ndarray) -> np.ndarray:
+    low, high = float(scores.min()), float(scores.max())
+    if high <= low:
+        return np.zeros_like(scores, dtype=np.float32)
+    return ((scores - low) / (high - low)).astype(np.float32)
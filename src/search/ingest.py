@@ -0,0 +1,239 @@
+import hashlib
+import time
+from logging import getLogger
+from pathlib import Path
+from typing import Iterable
+
+from pydantic import BaseModel, Field
+
+from src.common.bulk_load import BulkLoader, LoadStats
+from .response import Chunk
+
+logger = getLogger(__name__)
+
+CHUNK_COLUMNS = ["chunk_id", "file_name", "text", "page", "section"]
+
+
+def file_hash(path: Path) -> str:
+    """ファイル内容のSHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_hash(chunk: Chunk) -> str:
+    """テキストと page / section のハッシュ (見出しやページだけが変わったチャンクも更新する)"""
+    return text_hash(f"{chunk.page}\x1f{chunk.section or ''}\x1f{chunk.text}")
+
+
+class FileEntry(BaseModel):
+    """マニフェストに記録する1ファイル分の情報"""
+    hash: str = Field(description="ファイル内容のハッシュ")
+    chunks: list[str] = Field(default_factory=list, description="chunk_id順のチャンクハッシュ")
+
+
+class IngestManifest(BaseModel):
+    """取り込み済みファイルとチャンクのマニフェスト"""
+    table: str = Field(default="", description="取り込み先テーブル")
+    chunker: str = Field(default="", description="チャンク設定のフィンガープリント")
+    files: dict[str, FileEntry] = Field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: Path) -> "IngestManifest":
+        if not path.exists():
+            return cls()
+        return cls.model_validate_json(path.read_text(encoding="utf-8"))
+
+    def save(self, path: Path) -> None:
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(self.model_dump_json(indent=2), encoding="utf-8")
+        tmp.replace(path)
+
+
+class IngestPlan(BaseModel):
+    """差分取り込みの計画"""
+    added: list[str] = Field(default_factory=list)
+    changed: list[str] = Field(default_factory=list)
+    removed: list[str] = Field(default_factory=list)
+    unchanged: list[str] = Field(default_factory=list)
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.changed or self.removed)
+
+
+class IncrementalIngest:
+    """
+    PDFディレクトリをチャンクテーブルへ差分で取り込む
+    - ファイルハッシュが変わったファイルだけを再チャンク化する
+    - チャンクハッシュを比較し、変わったチャンクだけを (file_name, chunk_id) で MERGE する
+    - 削除されたファイル・短くなったファイルの余剰チャンクは DELETE する
+    - テーブルかチャンク設定が変わった場合はテーブルを空にしてから全件ロードする (古いチャンクを残さない)
+    トランザクションになるのは MERGE と DELETE だけ (一時テーブルの作成は DDL で暗黙にコミットされるので、その前にロードまで済ませる)
+    テーブルを空にしてからの全件ロードはトランザクションにしないが、先に空のマニフェストを保存するので、
+    途中で失敗しても次回は残った行に全件を MERGE し直す
+    """
+
+    def __init__(self, preprocess, manifest_path: Path, batch_size: int = 1000):
+        self.preprocess = preprocess
+        self.manifest_path = Path(manifest_path)
+        self.batch_size = batch_size
+        self.table = f"{preprocess.schema}.{preprocess.table}"
+        self.staging_table = f"{preprocess.schema}.{preprocess.table}_STAGING"
+
+    def list_files(self) -> dict[str, Path]:
+        """取り込み対象のPDF (file_name -> パス)"""
+        data_dir = Path(self.preprocess.data_dir)
+        return {path.name: path for path in sorted(data_dir.glob("*.pdf"))}
+
+    def load_manifest(self) -> IngestManifest | None:
+        """前回のマニフェスト。テーブルかチャンク設定が変わっていれば None (チャンクの対応が取れないので使えない)"""
+        manifest = IngestManifest.load(self.manifest_path)
+        if manifest.table != self.table or manifest.chunker != self.preprocess.chunker_fingerprint():
+            return None
+        return manifest
+
+    def clear(self) -> None:
+        """テーブルの全チャンクを削除し、空のマニフェストを保存する (途中で失敗しても次回は全件を取り込む)"""
+        connector = self.preprocess.connector
+        cursor = connector.cursor()
+        try:
+            cursor.execute(f"DELETE FROM {self.table}")
+            connector.commit()
+        except Exception:
+            connector.rollback()
+            raise
+        finally:
+            cursor.close()
+        IngestManifest(table=self.table, chunker=self.preprocess.chunker_fingerprint()).save(self.manifest_path)
+
+    def plan(self, manifest: IngestManifest, files: dict[str, Path]) -> tuple[IngestPlan, dict[str, str]]:
+        plan = IngestPlan()
+        hashes = {}
+        for name, path in files.items():
+            hashes[name] = file_hash(path)
+            entry = manifest.files.get(name)
+            if entry is None:
+                plan.added.append(name)
+            elif entry.hash != hashes[name]:
+                plan.changed.append(name)
+            else:
+                plan.unchanged.append(name)
+        plan.removed = [name for name in manifest.files if name not in files]
+        return plan, hashes
+
+    def run(self, reset: bool = False) -> IngestPlan:
+        """差分取り込みを実行する。reset=True の場合 (またはマニフェストが使えない場合) はテーブルを空にして全件取り込む"""
+        start = time.perf_counter()
+        manifest = None if reset else self.load_manifest()
+        previous = None
+        if manifest is None:
+            if not reset:
+                logger.info("テーブルかチャンク設定が変わったため、全件を取り込み直します")
+            reset = True
+            previous = list(IngestManifest.load(self.manifest_path).files)
+            self.clear()
+            manifest = IngestManifest(table=self.table, chunker=self.preprocess.chunker_fingerprint())
+        files = self.list_files()
+        plan, hashes = self.plan(manifest, files)
+        if previous is not None:
+            # 空にしたテーブルにあったファイルのうち、もうないものは削除として数える (索引を作り直させる)
+            plan.removed = [name for name in previous if name not in files]
+
+        logger.info(
+            f"差分取り込み計画: 追加 {len(plan.added)} / 変更 {len(plan.changed)} / "
+            f"削除 {len(plan.removed)} / 変更なし {len(plan.unchanged)}"
+        )
+        if plan.is_empty:
+            return plan
+
+        targets = plan.added + plan.changed
+        entries = {name: FileEntry(hash=hashes[name]) for name in targets}
+
+        def changed_chunks():
+            # チャンクはファイル単位でストリームされるので、ハッシュを比較しながら差分だけを流す
+            for chunk in self.preprocess.iter_chunks([files[name] for name in targets]):
+                digest = chunk_hash(chunk)
+                entries[chunk.file_name].chunks.append(digest)
+                previous = manifest.files[chunk.file_name].chunks if chunk.file_name in manifest.files else []
+                if chunk.num >= len(previous) or previous[chunk.num] != digest:
+                    yield chunk
+
+        connector = self.preprocess.connector
+        staged = bool(targets) and not reset
+        if not targets:
+            stats = LoadStats(table=self.table, mode="merge")
+        elif reset:
+            # 空のテーブルへの全件取り込みはMERGEせずにそのままロードする
+            stats = self.preprocess.upload_pdf(changed_chunks(), batch_size=self.batch_size)
+        else:
+            stats = self._stage(changed_chunks())
+
+        # 短くなったファイルの余剰チャンク (file_name, 残すチャンク数)
+        deletes = [
+            (name, len(entries[name].chunks))
+            for name in plan.changed
+            if len(manifest.files[name].chunks) > len(entries[name].chunks)
+        ]
+        cursor = connector.cursor()
+        try:
+            cursor.execute("BEGIN")
+            if staged and stats.rows:
+                cursor.execute(self._merge_sql())
+            if deletes:
+                cursor.executemany(f"DELETE FROM {self.table} WHERE file_name = %s AND chunk_id >= %s", deletes)
+            if plan.removed:
+                cursor.executemany(f"DELETE FROM {self.table} WHERE file_name = %s", [(name,) for name in plan.removed])
+            connector.commit()
+        except Exception:
+            connector.rollback()
+            raise
+        finally:
+            if staged:
+                try:
+                    cursor.execute(f"DROP TABLE IF EXISTS {self.staging_table}")
+                except Exception as e:
+                    logger.warning(f"一時テーブル {self.staging_table} を削除できませんでした: {e}")
+            cursor.close()
+
+        # コミット後にマニフェストを更新する
+        for name in plan.removed:
+            manifest.files.pop(name, None)
+        manifest.files.update(entries)
+        manifest.save(self.manifest_path)
+
+        logger.info(
+            f"差分取り込みが完了しました: upsert {stats.rows} チャンク, "
+            f"削除 {len(deletes) + len(plan.removed)} ファイル分 ({time.perf_counter() - start:.2f}s)"
+        )
+        return plan
+
+    def _stage(self, chunks: Iterable[Chunk]) -> LoadStats:
+        """変わったチャンクを一時テーブルにロードする (一時テーブルの作成は暗黙にコミットされるので、トランザクションの前に行う)"""
+        cursor = self.preprocess.connector.cursor()
+        try:
+            cursor.execute(f"CREATE OR REPLACE TEMPORARY TABLE {self.staging_table} LIKE {self.table}")
+        finally:
+            cursor.close()
+        return BulkLoader(self.preprocess.connector, batch_size=self.batch_size).insert_rows(
+            self.staging_table,
+            CHUNK_COLUMNS,
+            ((chunk.num, chunk.file_name, chunk.text, chunk.page, chunk.section) for chunk in chunks),
+        )
+
+    def _merge_sql(self) -> str:
+        """一時テーブルの行を (file_name, chunk_id) で MERGE する"""
+        return f"""
+        MERGE INTO {self.table} t
+        USING {self.staging_table} s
+        ON t.file_name = s.file_name AND t.chunk_id = s.chunk_id
+        WHEN MATCHED THEN UPDATE SET t.text = s.text, t.page = s.page, t.section = s.section
+        WHEN NOT MATCHED THEN INSERT (chunk_id, file_name, text, page, section)
+            VALUES (s.chunk_id, s.file_name, s.text, s.page, s.section)
+        """
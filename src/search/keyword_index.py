@@ -0,0 +1,149 @@
+"""
+チャンクテーブルのキーワード索引 (BM25)
+日本語は分かち書きせずに文字 bi-gram で索引する (条番号・「36協定」のような語の完全一致を拾うため)
+- 転置索引は語ごとの (チャンク番号, BM25 の重み) を CSR 形式の配列で持ち、取り込み時に重みまで計算しておく
+- 検索はクエリの語の posting をつないで np.bincount で足し合わせる (Python のループはクエリの語数だけ)
+"""
+import json
+import time
+import unicodedata
+from collections import Counter
+from logging import getLogger
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+from .response import Search_Result
+
+logger = getLogger(__name__)
+
+POSTINGS_FILE = "postings.npz"
+VOCAB_FILE = "vocab.json"
+CHUNKS_FILE = "chunks.json"
+MANIFEST_FILE = "manifest.json"
+TOKENIZER = "char-bigram:nfkc"
+
+
+def tokenize(text: str) -> list[str]:
+    """NFKC 正規化・小文字化・空白除去のあとの文字 bi-gram (1文字だけの場合はその文字)"""
+    text = "".join(unicodedata.normalize("NFKC", text).lower().split())
+    if len(text) < 2:
+        return [text] if text else []
+    return [text[i:i + 2] for i in range(len(text) - 1)]
+
+
+class KeywordManifest(BaseModel):
+    table: str
+    tokenizer: str = TOKENIZER
+    count: int
+    terms: int
+    k1: float
+    b: float
+    built_at: float = Field(default_factory=time.time)
+
+
+class KeywordIndex:
+    def __init__(self, vocab: dict[str, int], indptr: np.ndarray, doc_ids: np.ndarray, weights: np.ndarray,
+                 chunks: list[tuple[int, str, str]], manifest: KeywordManifest):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.chunks = chunks
+        self.manifest = manifest
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    @classmethod
+    def build(cls, rows: Iterable[tuple[int, str, str]], table: str, k1: float = 1.2, b: float = 0.75) -> "KeywordIndex":
+        start = time.perf_counter()
+        chunks = [(int(chunk_id), file_name, text) for chunk_id, file_name, text in rows]
+        vocab: dict[str, int] = {}
+        term_ids, doc_ids, tfs, lengths = [], [], [], []
+        for doc, (_, _, text) in enumerate(chunks):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                doc_ids.append(doc)
+                tfs.append(tf)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.float32)
+        lengths = np.asarray(lengths, dtype=np.float32)
+
+        # BM25 の重みを posting ごとにまとめて計算する
+        n = max(len(chunks), 1)
+        df = np.bincount(term_ids, minlength=len(vocab)).astype(np.float32)
+        idf = np.log1p((n - df + 0.5) / (df + 0.5))
+        avgdl = float(lengths.mean()) if len(lengths) and lengths.mean() > 0 else 1.0
+        norm = k1 * (1.0 - b + b * lengths[doc_ids] / avgdl) if len(doc_ids) else np.zeros(0, dtype=np.float32)
+        weights = (idf[term_ids] * tfs * (k1 + 1.0) / (tfs + norm)).astype(np.float32)
+
+        # 語ごとに並べて CSR にする
+        order = np.argsort(term_ids, kind="stable")
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(term_ids, minlength=len(vocab)))]).astype(np.int64)
+        manifest = KeywordManifest(table=table, count=len(chunks), terms=len(vocab), k1=k1, b=b)
+        logger.info(f"キーワード索引を作成しました ({len(chunks)}件, {len(vocab)}語, {time.perf_counter() - start:.2f}s)")
+        return cls(vocab, indptr, doc_ids[order], weights[order], chunks, manifest)
+
+    def save(self, path: Path) -> None:
+        path.mkdir(parents=True, exist_ok=True)
+        _atomic_save(path / POSTINGS_FILE, lambda f: np.savez(f, indptr=self.indptr, doc_ids=self.doc_ids, weights=self.weights))
+        _atomic_save(path / VOCAB_FILE, lambda f: f.write(json.dumps(self.vocab, ensure_ascii=False).encode("utf-8")))
+        _atomic_save(path / CHUNKS_FILE, lambda f: f.write(json.dumps(self.chunks, ensure_ascii=False).encode("utf-8")))
+        _atomic_save(path / MANIFEST_FILE, lambda f: f.write(self.manifest.model_dump_json(indent=2).encode("utf-8")))
+
+    @classmethod
+    def load(cls, path: Path) -> "KeywordIndex | None":
+        if not (path / MANIFEST_FILE).exists():
+            return None
+        manifest = KeywordManifest.model_validate_json((path / MANIFEST_FILE).read_text(encoding="utf-8"))
+        if manifest.tokenizer != TOKENIZER:
+            logger.warning(f"キーワード索引のトークナイザが異なります: {manifest.tokenizer}")
+            return None
+        with np.load(path / POSTINGS_FILE) as postings:
+            indptr, doc_ids, weights = postings["indptr"], postings["doc_ids"], postings["weights"]
+        vocab = json.loads((path / VOCAB_FILE).read_text(encoding="utf-8"))
+        chunks = [tuple(chunk) for chunk in json.loads((path / CHUNKS_FILE).read_text(encoding="utf-8"))]
+        if len(chunks) != manifest.count:
+            logger.warning(f"キーワード索引が壊れています: {path}")
+            return None
+        return cls(vocab, indptr, doc_ids, weights, chunks, manifest)
+
+    def scores(self, query: str) -> np.ndarray:
+        """全チャンクの BM25 スコア (クエリ内で重複する語はその回数だけ足す)"""
+        counts = Counter(self.vocab[t] for t in tokenize(query) if t in self.vocab)
+        if not counts:
+            return np.zeros(len(self), dtype=np.float32)
+        slices = [slice(self.indptr[t], self.indptr[t + 1]) for t in counts]
+        docs = np.concatenate([self.doc_ids[s] for s in slices])
+        weights = np.concatenate([self.weights[s] * counts[t] for s, t in zip(slices, counts)])
+        return np.bincount(docs, weights=weights, minlength=len(self)).astype(np.float32)
+
+    def search(self, query: str, k: int = 10) -> list[Search_Result]:
+        scores = self.scores(query)
+        return top_k(scores, self.chunks, k)
+
+
+def top_k(scores: np.ndarray, chunks: list[tuple[int, str, str]], k: int) -> list[Search_Result]:
+    if len(scores) == 0:
+        return []
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [
+        Search_Result(chunk_id=chunks[i][0], file_name=chunks[i][1], text=chunks[i][2], score=float(scores[i]))
+        for i in top
+    ]
+
+
+def _atomic_save(path: Path, write) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        write(f)
+    tmp.replace(path)
@@ -1,15 +1,23 @@
 from pathlib import Path
-import snowflake.connector
+from typing import Iterator
 from dotenv import load_dotenv
 import os
 from logging import getLogger
 import logging
 from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai import AzureOpenAIEmbeddings
 from .response import Chunk
+from .chunking import iter_pdf_chunks
+from .ingest import CHUNK_COLUMNS, IncrementalIngest
+from .embedder import Embedder, HashingEmbedder
+from .embedding_pipeline import EmbeddingCache, EmbeddingPipeline
+from .vector_index import VectorIndex, read_manifest
+from .keyword_index import KeywordIndex
+from src.common.pool import ConnectionPool, get_pool
+from src.common.bulk_load import BulkLoader, LoadStats
+from src.common.provision import Reconciler, database_ddl, fingerprint, schema_ddl, warehouse_ddl
+from src.common.schema_cache import get_schema_cache
 from snowflake.core import Root
-from snowflake.snowpark import Session
 
 logging.basicConfig(
     level=logging.INFO,
@@ -23,35 +31,82 @@ def load_pdf_document(file_path):
 
 
 class Search_preprocess:
-    def __init__(self):
+    table = "SAMPLE_TECH_1Q_MANAGEMENT_PLAN" # Search用のテーブル名
+    search_service = "CORTEX_SEARCH_SVC" # Cortex Search Service名
+    target_lag = "1 hour" # Search Service の更新間隔
+    index_dir = Path(__file__).resolve().parent / ".vector_index" # ローカルベクトルインデックスの保存先
+    keyword_index_dir = Path(__file__).resolve().parent / ".keyword_index" # キーワード (BM25) 索引の保存先
+
+    def __init__(self, pool: ConnectionPool | None = None):
         load_dotenv(encoding='utf-8',override=True)
 
         self.warehouse = os.getenv('SNOWFLAKE_WAREHOUSE')
         self.database = os.getenv('SNOWFLAKE_DATABASE')
         self.schema = os.getenv('SNOWFLAKE_SCHEMA')
-        self.table = "SAMPLE_TECH_1Q_MANAGEMENT_PLAN" # Search用のテーブル名
-
-        self.connector = snowflake.connector.connect(
-        user=os.getenv('SNOWFLAKE_USER'),
-        password=os.getenv('SNOWFLAKE_PASSWORD'),
-        account=os.getenv('SNOWFLAKE_ACCOUNT'), 
-        warehouse=self.warehouse,
-        database=self.database,
-        schema=self.schema)
+
+        # 接続はプロセス共有のプールから借り、close() で返却する
+        self.pool = pool or get_pool()
+        self.connector = self.pool.acquire()
+        # 前回から変わった DDL だけを実行する
+        self.reconciler = Reconciler.from_env(self.database, self.schema)
+        # テーブル・列・Search Service の有無は1回の問い合わせでまとめて取得し、キャッシュから答える
+        self.schema_cache = get_schema_cache(self.database, self.schema)
         
         base_dir = Path(__file__).resolve().parent
-        self.filename = base_dir / "data" / "サンプルテック_2025年度_第1四半期_経営計画.pdf"
+        self.data_dir = base_dir / "data" # 取り込み対象のPDFを置くディレクトリ
+        self.manifest_path = base_dir / ".ingest_manifest.json"
+        self.embedding_cache_path = base_dir / ".embedding_cache.sqlite"
+
+        # structured / recursive。変えると次回の取り込みでテーブルを空にして全件を取り込み直す
+        self.chunk_strategy = os.getenv("CHUNK_STRATEGY", "structured")
+        self.chunk_max_tokens = int(os.getenv("CHUNK_MAX_TOKENS", "300")) # structured のチャンクのトークン数上限
+        self.chunk_size = 100 # recursive の文字数
+        self.chunk_overlap = 20
+        self.max_workers = None # PDF解析のプロセス数 (None の場合はCPU数)
+        self.index_dtype = os.getenv("VECTOR_INDEX_DTYPE", "float32") # float32 / int8
+        self.embed_batch_size = 4096 # VectorIndex から渡す件数 (API へのバッチはパイプラインがトークン数で分ける)
+        self._embeddings = None
+        self._embedder = None
 
-        self.data = load_pdf_document(self.filename)
-        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=100, chunk_overlap=20)
-        self.embeddings = AzureOpenAIEmbeddings(
+    @property
+    def embeddings(self) -> AzureOpenAIEmbeddings:
+        """埋め込みクライアント (初回アクセス時に生成する)"""
+        if self._embeddings is None:
+            self._embeddings = AzureOpenAIEmbeddings(
                 deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"), 
                 model=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
                 azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
                 openai_api_type="azure",
                 openai_api_key=os.getenv("AZURE_OPENAI_API_KEY"),
                 openai_api_version=os.getenv("AZURE_OPENAI_API_VERSION"))
-        
+        return self._embeddings
+
+    @property
+    def embedder(self) -> Embedder:
+        """
+        ローカルベクトルインデックスに使う埋め込み (SEARCH_EMBEDDER=hashing で外部APIなしの埋め込み)
+        バッチ化・流量制御・ディスクキャッシュのパイプラインを通す
+        """
+        if self._embedder is None:
+            base = HashingEmbedder() if os.getenv("SEARCH_EMBEDDER", "azure") == "hashing" else self.embeddings
+            self._embedder = EmbeddingPipeline(
+                base,
+                cache=EmbeddingCache(self.embedding_cache_path),
+                max_batch_tokens=int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "8000")),
+                concurrency=int(os.getenv("EMBEDDING_CONCURRENCY", "4")),
+                rpm=float(os.getenv("EMBEDDING_RPM") or 0) or None,
+                tpm=float(os.getenv("EMBEDDING_TPM") or 0) or None)
+        return self._embedder
+
+    def close(self) -> None:
+        """借りている接続をプールに返却する"""
+        if self._embedder is not None and self._embedder.cache is not None:
+            self._embedder.cache.close()
+            self._embedder = None
+        if self.connector is not None:
+            self.pool.release(self.connector)
+            self.connector = None
+
     def test_connection(self):
         try:
             cursor = self.connector.cursor()
@@ -63,44 +118,67 @@ class Search_preprocess:
             logger.error(f"Failed to connect to Snowflake: {e}")
 
     def table_exists(self) -> bool:
-        """テーブルが既に存在するか確認する"""
-        cursor = self.connector.cursor()
-        try:
-            check_query = f"""
-            SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES 
-            WHERE TABLE_SCHEMA = '{self.schema.upper()}' 
-            AND TABLE_NAME = '{self.table.upper()}'
-            """
-            cursor.execute(check_query)
-            exists = cursor.fetchone()[0] > 0
-            return exists
-        except Exception as e:
-            logger.error(f"テーブル存在確認でエラー: {e}")
-            return False
-        finally:
-            cursor.close()
+        """テーブルが既に存在するか確認する (スキーマ情報のキャッシュから答える)"""
+        return self.schema_cache.get(self.connector).table_exists(self.table)
 
 
-    def run(self) -> Root:
-        """Cortex Searchを使用する環境を構築"""
-        if not self.table_exists():
+    def run(self, force: bool = False) -> Root:
+        """
+        Cortex Searchを使用する環境を構築
+        DDL は前回の適用から変わったものだけを実行する (force=True の場合はすべて実行する)
+        """
+        ingest = IncrementalIngest(self, self.manifest_path)
+        exists = self.table_exists()
+        if force:
+            self.reconciler.forget("database", "warehouse", "schema", "search.")
+        elif not exists:
+            # 記録があってもテーブルがなければ、データベース・スキーマから作り直す (ウェアハウスはテーブルと関係なく残る)
+            self.reconciler.forget("database", "schema", "search.")
+        if not exists:
             logger.info(f"テーブル {self.table} は存在しません。")
-            self.create_db()
-            self.create_wh()
-            self.create_schema()
-            self.create_table()
-            Chunk_list = self.pdf_to_chunks()
-            self.upload_pdf(Chunk_list)
-            
-        self.create_search_service()
+        if self.schema_cache.get(self.connector).search_service_exists(self.search_service) is False:
+            # 記録があっても Search Service がなければ作り直す
+            self.reconciler.forget("search.service")
+        self.provision(exists, adopt=exists and not force)
+        # 追加・変更・削除されたPDFだけを反映する (テーブルを作った場合は全件)
+        plan = ingest.run(reset=not exists)
+
+        rows = None
+        if not plan.is_empty or not self.keyword_index_is_current():
+            rows = self.fetch_chunk_rows()
+            self.build_keyword_index(rows)
+        try:
+            if not plan.is_empty or not self.vector_index_is_current():
+                self.build_vector_index(rows)
+        except Exception as e:
+            logger.warning(f"ベクトルインデックスを作成できませんでした。ローカル検索はキーワード索引のみで行います: {e}")
+
+        try:
+            self.reconciler.ensure("search.service", fingerprint(self.search_service_ddl()), self.create_search_service)
+        except Exception as e:
+            logger.error(f"Cortex Searchの作成に失敗しました: {e}")
+        if self.reconciler.applied:
+            self.schema_cache.invalidate()
         search_client = self.search_client()
-        logger.info("Cortex Search Preprocessが完了しました")
+        logger.info(f"Cortex Search Preprocessが完了しました (DDL: {self.reconciler.summary()})")
 
         return search_client
     
+    def provision(self, exists: bool, adopt: bool = False) -> None:
+        """
+        データベース・ウェアハウス・スキーマ・テーブルのうち、前回から変わったものを作成する
+        adopt=True の場合、記録のないデータベース等は既にあるものとして作り直さない
+        """
+        self.reconciler.ensure("database", fingerprint(database_ddl(self.database)), self.create_db, adopt=adopt)
+        self.reconciler.ensure("warehouse", fingerprint(warehouse_ddl(self.warehouse)), self.create_wh, adopt=adopt)
+        self.reconciler.ensure("schema", fingerprint(schema_ddl(self.schema)), self.create_schema, adopt=adopt)
+        # 既存のテーブルは作り直さず、足りない列 (page / section) を追加する
+        self.reconciler.ensure("search.table", fingerprint(self.table_ddl()),
+                               self.add_metadata_columns if exists else self.create_table)
+
     def create_db(self) -> None:
         """データベースを作成する"""
-        query = f"""CREATE DATABASE IF NOT EXISTS {self.database}"""
+        query = database_ddl(self.database)
         self.connector.cursor().execute(query)
         self.connector.commit()  
         self.connector.cursor().close()
@@ -108,7 +186,7 @@ class Search_preprocess:
     
     def create_schema(self) -> None:
         """スキーマを作成する"""
-        query = f"""CREATE SCHEMA IF NOT EXISTS {self.schema}"""
+        query = schema_ddl(self.schema)
         cursor = self.connector.cursor()
         cursor.execute(query)
         self.connector.commit()
@@ -117,120 +195,159 @@ class Search_preprocess:
     
     def create_wh(self) -> None:
         """ウェアハウスを作成する"""
-        query = f"""CREATE OR REPLACE WAREHOUSE {self.warehouse} WITH
-            WAREHOUSE_SIZE='X-SMALL'
-            AUTO_SUSPEND = 120
-            AUTO_RESUME = TRUE
-            INITIALLY_SUSPENDED=TRUE"""
+        query = warehouse_ddl(self.warehouse)
         self.connector.cursor().execute(query)
         self.connector.commit()  
         self.connector.cursor().close()
         return logger.info(f"ウェアハウス {self.warehouse} を作成しました")
     
-    def create_table(self) -> None:
-        """チャンク情報を保存するテーブルを作成する"""
-        cursor = self.connector.cursor()
-        cursor.execute(f"DROP TABLE IF EXISTS {self.table};")
-        
-        query = f"""CREATE TABLE IF NOT EXISTS {self.schema}.{self.table} (
+    def table_ddl(self) -> str:
+        return f"""CREATE TABLE IF NOT EXISTS {self.schema}.{self.table} (
                 chunk_id NUMBER,
                 file_name VARCHAR,
-                text VARCHAR
+                text VARCHAR,
+                page NUMBER,
+                section VARCHAR
             )
             """
-        
-        cursor.execute(query)
+
+    def create_table(self) -> None:
+        """チャンク情報を保存するテーブルを作成する"""
+        cursor = self.connector.cursor()
+        cursor.execute(f"DROP TABLE IF EXISTS {self.table};")
+        cursor.execute(self.table_ddl())
         self.connector.commit()
         cursor.close()
         logger.info(f"Snowflakeにテーブル {self.table} を作成しました")
 
-    def pdf_to_chunks(self) -> list[Chunk]:
-        """PDFをチャンクに分割する"""
-        documents = self.data
-        chunks = self.text_splitter.split_documents(documents)
-
-        Chunk_list = []
-        for num, chunk in enumerate(chunks):
-            chunk_data = Chunk(
-                num=num,
-                file_name=str(self.filename),
-                text=chunk.page_content
-            )
-            Chunk_list.append(chunk_data)
+    def add_metadata_columns(self) -> None:
+        """page / section 列がない既存のテーブルに列を追加する"""
+        cursor = self.connector.cursor()
+        try:
+            for column, type_ in (("page", "NUMBER"), ("section", "VARCHAR")):
+                cursor.execute(f"ALTER TABLE {self.schema}.{self.table} ADD COLUMN IF NOT EXISTS {column} {type_}")
+            self.connector.commit()
+        finally:
+            cursor.close()
+
+    def chunker_fingerprint(self) -> str:
+        """チャンク設定の識別子 (設定が変わると全ファイルを再チャンク化する)"""
+        if self.chunk_strategy == "structured":
+            return f"StructuredChunker:2:{self.chunk_max_tokens}"
+        return f"RecursiveCharacterTextSplitter:{self.chunk_size}:{self.chunk_overlap}"
 
+    def iter_chunks(self, paths) -> Iterator[Chunk]:
+        """複数のPDFをプロセスプールで並列にチャンク化し、ジェネレータで返す"""
+        return iter_pdf_chunks(paths, self.chunk_size, self.chunk_overlap, max_workers=self.max_workers,
+                               strategy=self.chunk_strategy, max_tokens=self.chunk_max_tokens)
+
+    def pdf_to_chunks(self, file_path: Path) -> list[Chunk]:
+        """PDFをチャンクに分割する。chunk_id はファイル内の通し番号"""
+        Chunk_list = list(self.iter_chunks([file_path]))
         logger.info("PDFのチャンク生成が完了しました")
         return Chunk_list
     
-    def upload_pdf(self, Chunk_list) -> None:
-        """PDFチャンクをSnowflakeにアップロードする"""
-        cursor = self.connector.cursor()
-
-        insert_query = f"""
-        INSERT INTO {self.schema}.{self.table} (chunk_id, file_name, text)
-        VALUES (%s, %s, %s)
+    def upload_pdf(self, Chunk_list, mode: str = "batch", batch_size: int = 1000) -> LoadStats:
         """
-
-        for chunk in Chunk_list:
-            # INSERT 処理
-            cursor.execute(
-                insert_query,
-                (chunk.num, chunk.file_name, chunk.text)
-            )
+        PDFチャンクをSnowflakeにアップロードする
+        mode="batch" はバッチ単位のマルチロウINSERT、mode="stage" はCSV + PUT + COPY INTO
+        """
+        loader = BulkLoader(self.connector, batch_size=batch_size)
+        rows = ((chunk.num, chunk.file_name, chunk.text, chunk.page, chunk.section) for chunk in Chunk_list)
+        stats = loader.load(f"{self.schema}.{self.table}", CHUNK_COLUMNS, rows, mode=mode)
 
         self.connector.commit()
-        cursor.close()
         logger.info("チャンク化したPDFをSnowflakeにアップロードしました")
+        return stats
 
-    def create_search_service(self) -> None:
-        """Cortex Search Service を作成する"""
+    def vector_index_is_current(self) -> bool:
+        """保存済みのインデックスが同じテーブル・同じ埋め込みで作られているか"""
+        manifest = read_manifest(self.index_dir)
+        return (manifest is not None and manifest.table == self.table
+                and manifest.embedder == self.embedder_name() and manifest.dtype == self.index_dtype)
+
+    def embedder_name(self) -> str:
+        """self.embedder に対する embedder_name() の値 (埋め込みクライアントを生成せず、環境変数から求める)"""
+        if self._embedder is not None:
+            return self._embedder.name
+        if os.getenv("SEARCH_EMBEDDER", "azure") == "hashing":
+            return HashingEmbedder().name
+        return f"azure:{os.getenv('AZURE_OPENAI_DEPLOYMENT_NAME') or ''}"
+
+    def keyword_index_is_current(self) -> bool:
+        """保存済みのキーワード索引が同じテーブルで作られているか (ベクトル索引と同じチャンク列であることも確認する)"""
+        index = KeywordIndex.load(self.keyword_index_dir)
+        if index is None or index.manifest.table != self.table:
+            return False
+        manifest = read_manifest(self.index_dir)
+        return manifest is None or manifest.count == index.manifest.count
+
+    def fetch_chunk_rows(self) -> list[tuple[int, str, str]]:
+        """チャンクテーブル全体を索引と同じ順序 (file_name, chunk_id) で読む"""
         cursor = self.connector.cursor()
+        try:
+            cursor.execute(f"SELECT chunk_id, file_name, text FROM {self.schema}.{self.table} ORDER BY file_name, chunk_id")
+            return cursor.fetchall()
+        finally:
+            cursor.close()
 
-        self.search_service = "CORTEX_SEARCH_SVC"
+    def build_keyword_index(self, rows: list[tuple[int, str, str]] | None = None) -> KeywordIndex:
+        """チャンクテーブル全体からキーワード (BM25) 索引を作って保存する (埋め込みは使わない)"""
+        index = KeywordIndex.build(rows if rows is not None else self.fetch_chunk_rows(), self.table)
+        index.save(self.keyword_index_dir)
+        logger.info(f"キーワード索引を保存しました: {self.keyword_index_dir}")
+        return index
 
-        query = f"""
+    def build_vector_index(self, rows: list[tuple[int, str, str]] | None = None) -> VectorIndex:
+        """チャンクテーブル全体を埋め込み、ローカルベクトルインデックスとして保存する"""
+        index = VectorIndex.build(rows if rows is not None else self.fetch_chunk_rows(), self.embedder, self.table,
+                                  dtype=self.index_dtype, batch_size=self.embed_batch_size)
+        index.save(self.index_dir)
+        metrics = self.embedder.metrics()
+        logger.info(f"ベクトルインデックスを保存しました: {self.index_dir} "
+                    f"(キャッシュヒット {metrics.cache_hits}/{metrics.texts}, API呼び出し {metrics.api_calls}回)")
+        return index
+
+    def search_service_ddl(self) -> str:
+        return f"""
         CREATE OR REPLACE CORTEX SEARCH SERVICE {self.database}.{self.schema}.{self.search_service}
         ON text
-        ATTRIBUTES file_name, chunk_id
+        ATTRIBUTES file_name, chunk_id, page, section
         WAREHOUSE = {self.warehouse}
-        TARGET_LAG = '1 hour'
+        TARGET_LAG = '{self.target_lag}'
         AS
             SELECT
                 chunk_id,
                 file_name,
-                text
+                text,
+                page,
+                section
             FROM {self.database}.{self.schema}.{self.table}
         """
 
+    def create_search_service(self) -> None:
+        """
+        Cortex Search Service を作成する (作り直すとテーブル全体が再索引される)
+        データの更新は TARGET_LAG で反映されるので、定義が変わったときだけ呼ぶ
+        """
+        cursor = self.connector.cursor()
         try:
-            cursor.execute(query)
+            cursor.execute(self.search_service_ddl())
             self.connector.commit()
             logger.info("Cortex Searchの作成が完了しました")
-        except Exception as e:
-            logger.error(f"Cortex Searchの作成に失敗しました: {e}")
         finally:
             cursor.close()
-            logger.info("Cortex Searchの作成が完了しました")
 
     def search_client(self) -> Root:
         """
         Snowflake Cortex Search Service の構築
-        SQL実行系とconnectionが違うので、別途用意する
+        SQL実行系と同じプールの接続をSnowpark Sessionとして使う
         """
-        connection_parameters = {
-            "account": os.getenv("SNOWFLAKE_ACCOUNT"),
-            "user": os.getenv("SNOWFLAKE_USER"),
-            "password": os.getenv("SNOWFLAKE_PASSWORD"),
-            "role": os.getenv("SNOWFLAKE_ROLE"),
-            "warehouse": os.getenv("SNOWFLAKE_WAREHOUSE"),
-            "database": os.getenv("SNOWFLAKE_DATABASE"),
-            "schema": os.getenv("SNOWFLAKE_SCHEMA")
-        }
-
-        session = Session.builder.configs(connection_parameters).create()
+        session = self.pool.session(self.connector)
 
         # Search Service オブジェクトを取得
         search_service = (
-            Root(session)
+            self.pool.root(session)
             .databases[self.database]
             .schemas[self.schema]
             .cortex_search_services[self.search_service]
@@ -1,13 +1,16 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 
 class Chunk(BaseModel):
     num : int = Field(description="チャンク番号")
     file_name : str = Field(description="ファイル名")
     text: str = Field(description="チャンクのテキスト")
+    page: Optional[int] = Field(default=None, description="チャンク先頭のページ番号 (1始まり)")
+    section: Optional[str] = Field(default=None, description="チャンクが属する見出し (第X条など)")
 
 class Search_Result(BaseModel):
     """検索結果のモデル"""
     chunk_id: int = Field(description="チャンクID")
     file_name: str = Field(description="ファイル名")
-    text: str = Field(description="テキスト")
\ No newline at end of file
+    text: str = Field(description="テキスト")
+    score: Optional[float] = Field(default=None, description="類似度スコア (ローカル検索のみ)")
\ No newline at end of file
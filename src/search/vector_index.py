@@ -0,0 +1,151 @@
+"""
+チャンクテーブルのローカルベクトルインデックス
+- 取り込み時にチャンクをバッチで埋め込み、L2 正規化した行列 (float32 または int8 + 行ごとのスケール) で保存する
+- 読み込みは np.load の mmap で、プロセス間でページキャッシュを共有できる
+- 検索は行列積 + argpartition の top-k (Python のループなし)
+"""
+import json
+import time
+from logging import getLogger
+from pathlib import Path
+from typing import Iterable, Literal
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+from .embedder import Embedder, embedder_name
+from .response import Search_Result
+
+logger = getLogger(__name__)
+
+VECTORS_FILE = "vectors.npy"
+SCALES_FILE = "scales.npy"
+CHUNKS_FILE = "chunks.json"
+MANIFEST_FILE = "manifest.json"
+
+
+class IndexManifest(BaseModel):
+    """インデックスの作成条件 (検索時に同じ埋め込みモデルを使うために記録する)"""
+    table: str = Field(description="元のチャンクテーブル")
+    embedder: str = Field(description="埋め込みモデルの識別子")
+    dtype: Literal["float32", "int8"]
+    dim: int
+    count: int
+    built_at: float = Field(default_factory=time.time)
+
+
+class VectorIndex:
+    def __init__(self, vectors: np.ndarray, scales: np.ndarray | None, chunks: list[tuple[int, str, str]],
+                 manifest: IndexManifest):
+        self.vectors = vectors
+        self.scales = scales
+        self.chunks = chunks
+        self.manifest = manifest
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    @classmethod
+    def build(
+        cls,
+        rows: Iterable[tuple[int, str, str]],
+        embedder: Embedder,
+        table: str,
+        dtype: Literal["float32", "int8"] = "float32",
+        batch_size: int = 64,
+    ) -> "VectorIndex":
+        """(chunk_id, file_name, text) の行からインデックスを作る。埋め込みは batch_size 件ずつまとめて依頼する"""
+        start = time.perf_counter()
+        chunks = [(int(chunk_id), file_name, text) for chunk_id, file_name, text in rows]
+        texts = [text for _, _, text in chunks]
+        blocks = [
+            np.asarray(embedder.embed_documents(texts[i:i + batch_size]), dtype=np.float32)
+            for i in range(0, len(texts), batch_size)
+        ]
+        matrix = np.vstack(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+        vectors, scales = quantize(normalize(matrix), dtype)
+
+        manifest = IndexManifest(table=table, embedder=embedder_name(embedder), dtype=dtype,
+                                 dim=matrix.shape[1], count=len(chunks))
+        logger.info(f"ベクトルインデックスを作成しました ({len(chunks)}件, {dtype}, "
+                    f"{time.perf_counter() - start:.2f}s)")
+        return cls(vectors, scales, chunks, manifest)
+
+    def save(self, path: Path) -> None:
+        """ファイルごとに一時ファイル経由で置き換え、マニフェストを最後に書く"""
+        path.mkdir(parents=True, exist_ok=True)
+        _atomic_save(path / VECTORS_FILE, lambda f: np.save(f, self.vectors))
+        if self.scales is not None:
+            _atomic_save(path / SCALES_FILE, lambda f: np.save(f, self.scales))
+        _atomic_save(path / CHUNKS_FILE, lambda f: f.write(json.dumps(self.chunks, ensure_ascii=False).encode("utf-8")))
+        _atomic_save(path / MANIFEST_FILE, lambda f: f.write(self.manifest.model_dump_json(indent=2).encode("utf-8")))
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True) -> "VectorIndex | None":
+        """保存済みのインデックスを読み込む (なければ None)"""
+        manifest = read_manifest(path)
+        if manifest is None:
+            return None
+        vectors = np.load(path / VECTORS_FILE, mmap_mode="r" if mmap else None)
+        scales = np.load(path / SCALES_FILE) if manifest.dtype == "int8" else None
+        chunks = [tuple(chunk) for chunk in json.loads((path / CHUNKS_FILE).read_text(encoding="utf-8"))]
+        if len(chunks) != manifest.count or vectors.shape[0] != manifest.count:
+            logger.warning(f"ベクトルインデックスが壊れています: {path}")
+            return None
+        return cls(vectors, scales, chunks, manifest)
+
+    def scores(self, query_vector, block_rows: int = 65536) -> np.ndarray:
+        """全チャンクとのコサイン類似度 (int8 はブロックごとに float32 に戻して計算する)"""
+        query = normalize(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+        if self.vectors.dtype == np.float32:
+            return self.vectors @ query
+        out = np.empty(len(self), dtype=np.float32)
+        for i in range(0, len(self), block_rows):
+            block = self.vectors[i:i + block_rows].astype(np.float32)
+            out[i:i + block_rows] = (block @ query) * self.scales[i:i + block_rows]
+        return out
+
+    def search(self, query_vector, k: int = 10) -> list[Search_Result]:
+        if len(self) == 0:
+            return []
+        scores = self.scores(query_vector)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [
+            Search_Result(chunk_id=self.chunks[i][0], file_name=self.chunks[i][1], text=self.chunks[i][2],
+                          score=float(scores[i]))
+            for i in top
+        ]
+
+    def query(self, text: str, embedder: Embedder, k: int = 10) -> list[Search_Result]:
+        return self.search(embedder.embed_query(text), k)
+
+
+def read_manifest(path: Path) -> IndexManifest | None:
+    """インデックスのマニフェストだけを読む (なければ None)"""
+    if not (path / MANIFEST_FILE).exists():
+        return None
+    return IndexManifest.model_validate_json((path / MANIFEST_FILE).read_text(encoding="utf-8"))
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return (matrix / np.where(norms == 0, 1.0, norms)).astype(np.float32)
+
+
+def quantize(matrix: np.ndarray, dtype: str) -> tuple[np.ndarray, np.ndarray | None]:
+    """int8 の場合は行ごとに max|v| が 127 になるようにスケールする"""
+    if dtype == "float32":
+        return np.ascontiguousarray(matrix, dtype=np.float32), None
+    scales = np.abs(matrix).max(axis=1) / 127.0 if matrix.size else np.zeros(len(matrix), dtype=np.float32)
+    scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+    vectors = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return vectors, scales
+
+
+def _atomic_save(path: Path, write) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        write(f)
+    tmp.replace(path)
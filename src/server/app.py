@@ -0,0 +1,200 @@
+"""
+AgentGateway の HTTP API (ASGI)
+プロセスで1つの AgentGateway を共有し、同時実行数・待ち行列・テナントごとのレートで流量を制御する
+
+- POST /query         {"query": "..."} → AgentResult (JSON)
+- POST /query/stream  {"query": "..."} → 進捗イベント (Server-Sent Events)
+- GET  /health
+- GET  /metrics       同時実行・待ち行列・接続プール・キャッシュ・段階ごとの所要時間の状況
+- GET  /metrics/prometheus  スパンの所要時間のヒストグラムとトークン数 (Prometheus のテキスト形式)
+
+テナントは X-Tenant-ID ヘッダーで指定する (省略時は "default")
+uvicorn src.server.app:app --host 0.0.0.0 --port 8000
+"""
+import json
+import os
+from logging import getLogger
+from typing import Callable
+
+from dotenv import load_dotenv
+
+from src.agent.agent import AgentGateway
+from .limits import AdmissionController, RateLimiter, Rejected
+
+logger = getLogger(__name__)
+
+MAX_BODY_BYTES = 64 * 1024
+
+
+class GatewayApp:
+    """
+    ASGI アプリケーション
+    gateway を渡さない場合は lifespan の startup で gateway_factory から生成し、shutdown で閉じる
+    """
+
+    def __init__(
+        self,
+        gateway: AgentGateway | None = None,
+        gateway_factory: Callable[[], AgentGateway] = AgentGateway,
+        admission: AdmissionController | None = None,
+        rate_limiter: RateLimiter | None = None,
+    ):
+        self.gateway = gateway
+        self.gateway_factory = gateway_factory
+        self.admission = admission or AdmissionController()
+        self.rate_limiter = rate_limiter or RateLimiter()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        route = (scope["method"], scope["path"].rstrip("/") or "/")
+        try:
+            if route == ("GET", "/health"):
+                await _send_json(send, 200, {"status": "ok"})
+            elif route == ("GET", "/metrics"):
+                await _send_json(send, 200, self.metrics())
+            elif route == ("GET", "/metrics/prometheus"):
+                text = self.gateway.prometheus_metrics() if self.gateway is not None else ""
+                await _send_text(send, 200, text, b"text/plain; version=0.0.4; charset=utf-8")
+            elif route == ("POST", "/query"):
+                await self._query(scope, receive, send)
+            elif route == ("POST", "/query/stream"):
+                await self._query_stream(scope, receive, send)
+            else:
+                await _send_json(send, 404, {"error": "not found"})
+        except Rejected as e:
+            await _send_json(send, e.status, {"error": str(e)},
+                             headers=[(b"retry-after", str(max(1, round(e.retry_after))).encode())])
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                if self.gateway is None:
+                    load_dotenv(encoding='utf-8', override=True)
+                    self.gateway = self.gateway_factory()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.gateway is not None:
+                    self.gateway.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _query(self, scope, receive, send) -> None:
+        query = await self._admit(scope, receive)
+        async with self.admission.slot():
+            try:
+                result = await self.gateway.arun(query)
+            except Exception as e:
+                logger.exception(f"クエリの実行に失敗しました: {query}")
+                await _send_json(send, 500, {"error": str(e)})
+                return
+        await _send_json(send, 200, result.model_dump())
+
+    async def _query_stream(self, scope, receive, send) -> None:
+        query = await self._admit(scope, receive)
+        async with self.admission.slot():
+            stream = self.gateway.stream(query)
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream; charset=utf-8"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            })
+            async for event in stream:
+                body = f"event: {event.kind}\ndata: {event.model_dump_json()}\n\n".encode()
+                await send({"type": "http.response.body", "body": body, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+
+    async def _admit(self, scope, receive) -> str:
+        """レート制限を確認して、リクエストボディから query を取り出す"""
+        headers = dict(scope.get("headers") or [])
+        tenant = headers.get(b"x-tenant-id", b"default").decode("latin-1")
+        self.rate_limiter.check(tenant)
+
+        body = await _read_body(receive)
+        try:
+            query = json.loads(body)["query"]
+        except (ValueError, KeyError, TypeError):
+            raise Rejected(400, '{"query": "..."} の形式で送ってください')
+        if not isinstance(query, str) or not query.strip():
+            raise Rejected(400, "query が空です")
+        return query
+
+    def metrics(self) -> dict:
+        metrics = {
+            "admission": self.admission.metrics().model_dump(),
+            "rate_limited": self.rate_limiter.rejected,
+        }
+        if self.gateway is not None:
+            metrics["pool"] = self.gateway.pool_metrics().model_dump()
+            cache = self.gateway.cache_metrics()
+            metrics["response_cache"] = cache.model_dump() if cache is not None else None
+            metrics["tool_cache"] = {name: m.model_dump() for name, m in self.gateway.tool_cache_metrics().items()}
+            compression = self.gateway.context_compression_metrics()
+            metrics["context_compression"] = compression.model_dump() if compression is not None else None
+            sql_cache = self.gateway.sql_cache_metrics()
+            metrics["analyst_sql_cache"] = sql_cache.model_dump() if sql_cache is not None else None
+            router = self.gateway.analyst_router_metrics()
+            metrics["analyst_router"] = router.model_dump() if router is not None else None
+            stages = self.gateway.telemetry_metrics()
+            metrics["stages"] = {name: s.model_dump() for name, s in stages.items()} if stages is not None else None
+        return metrics
+
+
+async def _read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise Rejected(400, "リクエストが中断されました")
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_BYTES:
+            raise Rejected(413, "リクエストが大きすぎます")
+        if not message.get("more_body"):
+            return body
+
+
+async def _send_json(send, status: int, payload, headers: list | None = None) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json; charset=utf-8"),
+                    (b"content-length", str(len(body)).encode())] + (headers or []),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_text(send, status: int, text: str, content_type: bytes) -> None:
+    body = text.encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def create_app() -> GatewayApp:
+    """環境変数の設定で GatewayApp を作る"""
+    load_dotenv(encoding='utf-8', override=True)
+    return GatewayApp(
+        admission=AdmissionController(
+            max_concurrency=int(os.getenv("API_MAX_CONCURRENCY", "8")),
+            max_queue=int(os.getenv("API_MAX_QUEUE", "32")),
+            queue_timeout=float(os.getenv("API_QUEUE_TIMEOUT", "30"))),
+        rate_limiter=RateLimiter(
+            rate=float(os.getenv("API_TENANT_RATE", "5")),
+            burst=int(os.getenv("API_TENANT_BURST", "10"))),
+    )
+
+
+app = create_app()
@@ -0,0 +1,135 @@
+"""
+API サーバーの流量制御
+- AdmissionController: 同時実行数の上限と、上限付きの待ち行列 (溢れたら即座に断る)
+- RateLimiter: テナントごとのトークンバケット
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from pydantic import BaseModel
+
+
+class Rejected(Exception):
+    """受け付けられないリクエスト (status は HTTP ステータス、retry_after は再試行までの秒数)"""
+
+    def __init__(self, status: int, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionMetrics(BaseModel):
+    running: int
+    queued: int
+    max_concurrency: int
+    max_queue: int
+    admitted: int
+    rejected_queue_full: int
+    rejected_timeout: int
+
+
+class AdmissionController:
+    """
+    同時に実行するリクエストを max_concurrency 件までにする
+    待ちは max_queue 件までで、それを超えたら 503、queue_timeout 秒待っても実行できなければ 503
+    """
+
+    def __init__(self, max_concurrency: int = 8, max_queue: int = 32, queue_timeout: float = 30.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._running = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._admitted = 0
+        self._rejected_queue_full = 0
+        self._rejected_timeout = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        await self._acquire()
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self) -> None:
+        if self._running < self.max_concurrency and not self._waiters:
+            self._running += 1
+            self._admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._rejected_queue_full += 1
+            raise Rejected(503, "サーバーが混み合っています", retry_after=1.0)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # タイムアウトと同時に枠を譲られた場合は、その枠を次に回す
+                self._release()
+            else:
+                waiter.cancel()
+            self._rejected_timeout += 1
+            raise Rejected(503, "待ち時間が上限を超えました", retry_after=self.queue_timeout)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        self._admitted += 1
+
+    def _release(self) -> None:
+        # 実行数は減らさずに、待っている先頭に枠をそのまま譲る
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._running -= 1
+
+    def metrics(self) -> AdmissionMetrics:
+        return AdmissionMetrics(
+            running=self._running,
+            queued=len(self._waiters),
+            max_concurrency=self.max_concurrency,
+            max_queue=self.max_queue,
+            admitted=self._admitted,
+            rejected_queue_full=self._rejected_queue_full,
+            rejected_timeout=self._rejected_timeout,
+        )
+
+
+class RateLimiter:
+    """
+    テナントごとのトークンバケット (rate 件/秒、最大 burst 件まで貯まる)
+    テナント数は max_tenants までで、古いものから忘れる
+    """
+
+    def __init__(self, rate: float = 5.0, burst: int = 10, max_tenants: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_tenants = max_tenants
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self.rejected = 0
+
+    def check(self, tenant: str) -> None:
+        """トークンを1つ消費する。足りなければ 429 の Rejected を投げる"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(tenant, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+        if tokens < 1.0:
+            self._buckets[tenant] = (tokens, now)
+            self.rejected += 1
+            raise Rejected(429, "リクエストが多すぎます", retry_after=(1.0 - tokens) / self.rate)
+        self._buckets[tenant] = (tokens - 1.0, now)
+        self._buckets.move_to_end(tenant)
+        while len(self._buckets) > self.max_tenants:
+            self._buckets.popitem(last=False)